@@ -0,0 +1,239 @@
+"""
+Check that the packed face records (consult pack_face) draw exactly what the meshers drew before them, when they wrote
+the 6 vertices of every face: each record is expanded on the CPU like shaders/chunk.vert does (its per-face table of
+corners is read from the shader) and compared with the vertices of a port of the old meshers, classic and greedy,
+for whole chunks and every section of a few generated chunks. Exits with status 1 if any mesh differs.
+
+Run it from the project folder:
+    python -m benchmarks.face_records --chunks 8
+"""
+import argparse
+import re
+import sys
+from settings import *
+from meshes.chunk_mesh_builder import (FACE_SIZE, FULL_LIGHT, PADDED_SIZE, PADDED_AREA, build_chunk_mesh, build_chunk_mesh_greedy,
+                                       build_faces, get_ao, get_chunk_rows, get_face_voxel, get_padded_chunk, get_padded_chunk_light)
+from benchmarks.world_gen import get_chunk_positions, generate_heightmap
+from terrain_gen import generate_terrain_parallel
+from noise import noise_tables
+from voxel_storage import VoxelStorage
+
+VERTEX_SIZE = 9 # x, y, z, voxel_id, face_id, ao, flipped, width, height
+
+# Offsets of the 4 corners of a face from its voxel and the order of the 6 vertices the old meshers wrote, not flipped and flipped
+OLD_CORNERS = np.array([
+    [[0, 1, 0], [1, 1, 0], [1, 1, 1], [0, 1, 1]], # Top face
+    [[0, 0, 0], [1, 0, 0], [1, 0, 1], [0, 0, 1]], # Bottom face
+    [[1, 0, 0], [1, 1, 0], [1, 1, 1], [1, 0, 1]], # Right face
+    [[0, 0, 0], [0, 1, 0], [0, 1, 1], [0, 0, 1]], # Left face
+    [[0, 0, 0], [0, 1, 0], [1, 1, 0], [1, 0, 0]], # Back face
+    [[0, 0, 1], [0, 1, 1], [1, 1, 1], [1, 0, 1]], # Front face
+])
+OLD_ORDERS = np.array([
+    [[0, 3, 2, 0, 2, 1], [1, 0, 3, 1, 3, 2]],
+    [[0, 2, 3, 0, 1, 2], [1, 3, 0, 1, 2, 3]],
+    [[0, 1, 2, 0, 2, 3], [3, 0, 1, 3, 1, 2]],
+    [[0, 2, 1, 0, 3, 2], [3, 1, 0, 3, 2, 1]],
+    [[0, 1, 2, 0, 2, 3], [3, 0, 1, 3, 1, 2]],
+    [[0, 2, 1, 0, 3, 2], [3, 1, 0, 3, 2, 1]],
+])
+STEPS = np.array([[0, 1, 0], [0, -1, 0], [1, 0, 0], [-1, 0, 0], [0, 0, -1], [0, 0, 1]]) # Neighbour in front of each face
+
+def get_shader_corners() -> np.array:
+    """The corner_indices table of shaders/chunk.vert (corner of every vertex, indexed face_id * 12 + flipped * 6 + vertex)."""
+    with open('shaders/chunk.vert') as file:
+        table = re.search(r'corner_indices\[72\] = int\[72\]\(([^;]*)\);', file.read()).group(1)
+    return np.array([int(value) for value in re.sub(r'//[^\n]*', '', table).split(',')])
+
+def expand_records(face_data) -> np.array:
+    """Vertices (faces, 6, VERTEX_SIZE) built by the vertex shader from packed faces (consult unpack and get_corner in shaders/chunk.vert)."""
+    records = face_data.reshape(-1, FACE_SIZE).astype('int64')
+    face, shape = records[:, 0], records[:, 1]
+    x, y, z = face >> 24, face >> 18 & 63, face >> 12 & 63
+    voxel_id, face_id, flipped = face >> 4 & 255, face >> 1 & 7, face & 1
+    width, height = shape >> 6 & 63, shape & 63
+    ao = np.stack([shape >> (18 - 2 * corner) & 3 for corner in range(4)], axis=1)
+
+    corners = get_shader_corners()[face_id[:, None] * 12 + flipped[:, None] * 6 + np.arange(6)] # (faces, 6)
+    # get_corner: along u and v of the face plane, (0, 0), (1, 0), (1, 1), (0, 1) in sizes of the quad
+    u = np.where(face_id[:, None] < 2, (corners == 1) | (corners == 2), corners >= 2) * width[:, None]
+    v = np.where(face_id[:, None] < 2, corners >= 2, (corners == 1) | (corners == 2)) * height[:, None]
+    zeros = np.zeros_like(u)
+    offsets = np.where((face_id < 2)[:, None, None], np.stack([u, zeros, v], axis=2),
+                       np.where((face_id < 4)[:, None, None], np.stack([zeros, v, u], axis=2), np.stack([u, v, zeros], axis=2)))
+
+    vertices = np.empty((len(records), 6, VERTEX_SIZE), dtype='int64')
+    vertices[:, :, 0:3] = np.stack([x, y, z], axis=1)[:, None, :] + offsets
+    vertices[:, :, 3], vertices[:, :, 4], vertices[:, :, 6] = voxel_id[:, None], face_id[:, None], flipped[:, None]
+    vertices[:, :, 5] = np.take_along_axis(ao, corners, axis=1)
+    vertices[:, :, 7], vertices[:, :, 8] = width[:, None], height[:, None]
+    return vertices
+
+@njit(cache=True)
+def is_void(padded_voxels, x, y, z) -> bool:
+    """Check if the voxel at a local position (the layer of the neighbours included) is air, like the old is_void."""
+    return padded_voxels[(x + 1) + PADDED_SIZE * (z + 1) + PADDED_AREA * (y + 1)] == 0
+
+@njit(cache=True)
+def get_old_face(padded_voxels, x, y, z, face_id) -> tuple:
+    """(visible, ao, flipped) of a face of the voxel at a local position, one voxel at a time like the old meshers."""
+    fx, fy, fz = x + STEPS[face_id, 0], y + STEPS[face_id, 1], z + STEPS[face_id, 2]
+    if not is_void(padded_voxels, fx, fy, fz):
+        return False, (0, 0, 0, 0), False
+    plane = 'Y' if face_id < 2 else ('X' if face_id < 4 else 'Z')
+    ao = get_ao(padded_voxels, PADDED_SIZE, (fx + 1) + PADDED_SIZE * (fz + 1) + PADDED_AREA * (fy + 1), plane)
+    return True, ao, ao[1] + ao[3] > ao[0] + ao[2]
+
+@njit(cache=True)
+def add_old_face(vertices, index, x, y, z, voxel_id, face_id, ao, flipped, width, height):
+    """Write the 6 vertices of a face (or a greedy quad of width x height voxels) in the order of the old meshers."""
+    for vertex in range(6):
+        corner = OLD_ORDERS[face_id, int(flipped), vertex]
+        # the corners of a quad are its first voxel's corners stretched along u (width) and v (height) of the face plane
+        cx, cy, cz = OLD_CORNERS[face_id, corner, 0], OLD_CORNERS[face_id, corner, 1], OLD_CORNERS[face_id, corner, 2]
+        if face_id < 2:
+            cx, cz = cx * width, cz * height
+        elif face_id < 4:
+            cy, cz = cy * height, cz * width
+        else:
+            cx, cy = cx * width, cy * height
+        vertices[index, vertex, 0], vertices[index, vertex, 1], vertices[index, vertex, 2] = x + cx, y + cy, z + cz
+        vertices[index, vertex, 3], vertices[index, vertex, 4], vertices[index, vertex, 5] = voxel_id, face_id, ao[corner]
+        vertices[index, vertex, 6], vertices[index, vertex, 7], vertices[index, vertex, 8] = int(flipped), width, height
+    return index + 1
+
+@njit(cache=True)
+def build_old_mesh(padded_voxels, section_pos, section_size, vertices) -> int:
+    """Port of the old build_chunk_mesh: 6 vertices per visible face, returns the number of faces written."""
+    index = 0
+    sx, sy, sz = section_pos
+    for x in range(sx, sx + section_size):
+        for y in range(sy, sy + section_size):
+            for z in range(sz, sz + section_size):
+                voxel_id = padded_voxels[(x + 1) + PADDED_SIZE * (z + 1) + PADDED_AREA * (y + 1)]
+                if not voxel_id:
+                    continue
+                for face_id in range(6):
+                    visible, ao, flipped = get_old_face(padded_voxels, x, y, z, face_id)
+                    if visible:
+                        index = add_old_face(vertices, index, x, y, z, voxel_id, face_id, ao, flipped, 1, 1)
+    return index
+
+@njit(cache=True)
+def build_old_mesh_greedy(padded_voxels, section_pos, section_size, vertices) -> int:
+    """Port of the old build_chunk_mesh_greedy: the same keys and merging, 6 vertices per quad, returns the number of quads written."""
+    index = 0
+    sx, sy, sz = section_pos
+    face_keys = np.zeros((6, section_size, section_size, section_size), dtype='int32')
+    for x in range(sx, sx + section_size):
+        for y in range(sy, sy + section_size):
+            for z in range(sz, sz + section_size):
+                voxel_id = padded_voxels[(x + 1) + PADDED_SIZE * (z + 1) + PADDED_AREA * (y + 1)]
+                if not voxel_id:
+                    continue
+                for face_id in range(6):
+                    visible, ao, flipped = get_old_face(padded_voxels, x, y, z, face_id)
+                    if not visible:
+                        continue
+                    key = voxel_id << 9 | ao[0] << 7 | ao[1] << 5 | ao[2] << 3 | ao[3] << 1 | int(flipped)
+                    if face_id < 2:
+                        face_keys[face_id, y - sy, x - sx, z - sz] = key
+                    elif face_id < 4:
+                        face_keys[face_id, x - sx, z - sz, y - sy] = key
+                    else:
+                        face_keys[face_id, z - sz, x - sx, y - sy] = key
+
+    for face_id in range(6):
+        u_corner = 1 if face_id < 2 else 3
+        v_corner = 4 - u_corner
+        for s in range(section_size):
+            mask = face_keys[face_id, s]
+            for v in range(section_size):
+                for u in range(section_size):
+                    key = mask[u, v]
+                    if not key:
+                        continue
+                    ao = (key >> 7) & 3, (key >> 5) & 3, (key >> 3) & 3, (key >> 1) & 3
+                    grow_u = ao[0] == ao[u_corner] and ao[v_corner] == ao[2]
+                    grow_v = ao[0] == ao[v_corner] and ao[u_corner] == ao[2]
+
+                    width = 1
+                    if grow_u:
+                        while u + width < section_size and mask[u + width, v] == key:
+                            width += 1
+                    height = 1
+                    if grow_v:
+                        while v + height < section_size:
+                            row_matches = True
+                            for iu in range(width):
+                                if mask[u + iu, v + height] != key:
+                                    row_matches = False
+                                    break
+                            if not row_matches:
+                                break
+                            height += 1
+                    for iu in range(width):
+                        for iv in range(height):
+                            mask[u + iu, v + iv] = 0
+
+                    x, y, z = get_face_voxel(face_id, s, u, v)
+                    index = add_old_face(vertices, index, x + sx, y + sy, z + sz, key >> 9, face_id, ao, key & 1, width, height)
+    return index
+
+OLD_MESHERS = {
+    'classic': (build_chunk_mesh, build_old_mesh),
+    'greedy': (build_chunk_mesh_greedy, build_old_mesh_greedy),
+}
+
+def sort_faces(vertices) -> np.array:
+    """The faces (faces, 6, VERTEX_SIZE) in a canonical order, the meshers visit the voxels in different orders."""
+    rows = vertices.reshape(len(vertices), -1)
+    return rows[np.lexsort(rows.T[::-1])]
+
+def check_mesh(name, padded_voxels, solid_rows, padded_light, section_pos, section_size) -> bool:
+    """Compare the expanded records of a mesher with the vertices of its old version for a cube of a chunk."""
+    mesh_builder, old_builder = OLD_MESHERS[name]
+    face_data = build_faces(mesh_builder, padded_voxels, solid_rows, padded_light, section_pos, section_size)
+    old_vertices = np.empty((section_size ** 3 * 6, 6, VERTEX_SIZE), dtype='int64')
+    count = old_builder(padded_voxels, section_pos, section_size, old_vertices)
+    full_light = np.all(face_data.reshape(-1, FACE_SIZE)[:, 1] >> 20 == FULL_LIGHT) # The old meshes had no light
+    return full_light and np.array_equal(sort_faces(expand_records(face_data)), sort_faces(old_vertices[:count]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=8, help='generated chunks to check (spread over the world)')
+    args = parser.parse_args()
+
+    chunk_positions = get_chunk_positions()
+    chunks_voxels = np.empty([len(chunk_positions), CHUNK_VOL], dtype='uint8')
+    generate_terrain_parallel(chunks_voxels, generate_heightmap(), chunk_positions, noise_tables, SEED)
+    chunk_coords = chunk_positions.astype('int32')
+    storage = VoxelStorage(len(chunk_positions))
+    for chunk_index, voxels in enumerate(chunks_voxels):
+        storage.store(chunk_index, voxels)
+
+    # chunks with faces (neither all air nor all solid), spread over the world
+    candidates = [i for i, voxels in enumerate(chunks_voxels) if voxels.min() == 0 and voxels.max() > 0]
+    checked = [candidates[i] for i in np.linspace(0, len(candidates) - 1, min(args.chunks, len(candidates))).astype('int64')]
+    sections = [(0, 0, 0, CHUNK_SIZE)] + [(x, y, z, SECTION_SIZE) for y in range(0, CHUNK_SIZE, SECTION_SIZE)
+                                          for z in range(0, CHUNK_SIZE, SECTION_SIZE) for x in range(0, CHUNK_SIZE, SECTION_SIZE)]
+    print(f'seed {SEED}, {len(checked)} chunks, the whole chunk and its {len(sections) - 1} sections each')
+
+    failed = False
+    for name in OLD_MESHERS:
+        mismatches = []
+        for chunk_index in checked:
+            chunk_pos = tuple(chunk_positions[chunk_index])
+            padded_voxels = get_padded_chunk(chunk_pos, storage.arrays, chunk_coords)
+            padded_light = get_padded_chunk_light(chunk_pos, None, chunk_coords)
+            solid_rows = get_chunk_rows(padded_voxels)
+            for x, y, z, size in sections:
+                if not check_mesh(name, padded_voxels, solid_rows, padded_light, (x, y, z), size):
+                    mismatches.append((chunk_pos, (x, y, z), size))
+        failed |= bool(mismatches)
+        print(f'{name:8s}: identical to the old vertices: {not mismatches}' + (f'  (first mismatch: chunk {mismatches[0][0]}, '
+              f'cube at {mismatches[0][1]} of {mismatches[0][2]} voxels)' if mismatches else ''))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
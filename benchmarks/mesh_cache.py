@@ -0,0 +1,74 @@
+"""
+Benchmark of the mesh cache: meshing the whole world with an empty cache (cold start) and with a full one (warm start).
+
+Run it from the project folder:
+    python -m benchmarks.mesh_cache
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from settings import *
+from terrain_gen import generate_terrain_parallel
+from noise import noise_tables
+from voxel_storage import VoxelStorage
+from meshes.chunk_mesh import get_section_pos
+from meshes.chunk_mesh_builder import build_faces, get_chunk_rows, get_padded_chunk, get_padded_chunk_light
+from meshes.mesh_cache import MeshCache
+from benchmarks.meshing import MESHERS
+from benchmarks.world_gen import get_chunk_positions, generate_heightmap
+
+def mesh_chunk(mesh_builder, padded_voxels, padded_light) -> list:
+    """Packed faces of every section of a chunk, like ChunkMesh.get_vertex_data."""
+    section_data = []
+    solid_rows = get_chunk_rows(padded_voxels)
+    for section in range(CHUNK_SECTIONS):
+        x, y, z = get_section_pos(section)
+        section_pos = x * SECTION_SIZE, y * SECTION_SIZE, z * SECTION_SIZE
+        section_data.append(build_faces(mesh_builder, padded_voxels, solid_rows, padded_light, section_pos, SECTION_SIZE))
+    return section_data
+
+def mesh_world(mesh_cache, mesh_builder, world_voxels, chunk_positions, chunk_coords) -> float:
+    """Get the mesh of every chunk from the cache, meshing (and caching) the missing ones. Returns the seconds spent."""
+    start = time.perf_counter()
+    for chunk_pos in chunk_positions:
+        padded_voxels = get_padded_chunk(tuple(chunk_pos), world_voxels, chunk_coords)
+        padded_light = get_padded_chunk_light(tuple(chunk_pos), None, chunk_coords) # Full light, like a world without lighting
+        key = mesh_cache.get_key(padded_voxels, padded_light)
+        if not mesh_cache.get(key):
+            mesh_cache.put(key, mesh_chunk(mesh_builder, padded_voxels, padded_light))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mesher', choices=MESHERS, default='greedy' if GREEDY_MESHING else 'classic')
+    args = parser.parse_args()
+    mesh_builder = MESHERS[args.mesher]
+
+    chunk_positions = get_chunk_positions()
+    chunks_voxels = np.empty([len(chunk_positions), CHUNK_VOL], dtype='uint8')
+    generate_terrain_parallel(chunks_voxels, generate_heightmap(), chunk_positions, noise_tables, SEED)
+    chunk_coords = chunk_positions.astype('int32')
+
+    storage = VoxelStorage(len(chunk_positions))
+    for chunk_index, voxels in enumerate(chunks_voxels):
+        storage.store(chunk_index, voxels)
+    world_voxels = storage.arrays
+
+    path = tempfile.mkdtemp(prefix='mesh_cache_')
+    try:
+        # Compile before timing
+        padded_voxels = get_padded_chunk(tuple(chunk_positions[0]), world_voxels, chunk_coords)
+        mesh_chunk(mesh_builder, padded_voxels, get_padded_chunk_light(tuple(chunk_positions[0]), None, chunk_coords))
+
+        print(f'seed {SEED}, {len(chunk_positions)} chunks, {args.mesher} mesher')
+        for run in ('cold', 'warm'):
+            mesh_cache = MeshCache(path) # Reads the cache folder like a new launch
+            seconds = mesh_world(mesh_cache, mesh_builder, world_voxels, chunk_positions, chunk_coords)
+            print(f'{run}: {seconds * 1000:8.1f} ms ({seconds * 1000 / len(chunk_positions):.2f} ms/chunk)  '
+                  f'hits {mesh_cache.hits}  misses {mesh_cache.misses}  cache {mesh_cache.size / 2 ** 20:.1f} MiB')
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
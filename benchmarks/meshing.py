@@ -0,0 +1,188 @@
+"""
+Benchmark comparing the classic mesher (one quad per voxel face) with the greedy one, and with the meshes of the levels of detail.
+The meshes of the bitmask builders are also checked against the same builders reading one voxel at a time (consult check_bitmasks).
+
+Run it from the project folder:
+    python -m benchmarks.meshing
+"""
+import argparse
+import time
+import tracemalloc
+from settings import *
+from meshes.chunk_mesh_builder import (FACE_SIZE, FACE_OFFSETS, PADDED_SIZE, PADDED_AREA, add_face, build_chunk_mesh, build_chunk_mesh_greedy, build_faces,
+                                       build_lod_faces, get_ao, get_chunk_rows, get_padded_chunk, get_padded_chunk_light, get_scratch_size, merge_face_keys)
+from benchmarks.world_gen import get_chunk_positions, generate_heightmap
+from terrain_gen import generate_terrain_parallel
+from noise import noise_tables
+from voxel_storage import VoxelStorage
+
+MESHERS = {
+    'classic': build_chunk_mesh,
+    'greedy': build_chunk_mesh_greedy,
+}
+
+def mesh_world(mesh_builder, world_voxels, chunk_positions, chunk_coords):
+    """Mesh every chunk of the world (the padded copy of each chunk and its solid rows included) under full light, returns (seconds, faces, mesh bytes)."""
+    faces = 0
+    mesh_bytes = 0
+    start = time.perf_counter()
+    for chunk_pos in chunk_positions:
+        padded_voxels = get_padded_chunk(tuple(chunk_pos), world_voxels, chunk_coords)
+        padded_light = get_padded_chunk_light(tuple(chunk_pos), None, chunk_coords)
+        mesh = build_faces(mesh_builder, padded_voxels, get_chunk_rows(padded_voxels), padded_light)
+        faces += len(mesh) // FACE_SIZE
+        mesh_bytes += mesh.nbytes
+    return time.perf_counter() - start, faces, mesh_bytes
+
+def mesh_world_lod(lod, world_voxels, chunk_positions, chunk_coords):
+    """Mesh every chunk of the world at a level of detail (1 to 3, consult downsample_voxels), returns (seconds, faces, mesh bytes)."""
+    faces = 0
+    mesh_bytes = 0
+    start = time.perf_counter()
+    for chunk_pos in chunk_positions:
+        padded_voxels = get_padded_chunk(tuple(chunk_pos), world_voxels, chunk_coords)
+        mesh = build_lod_faces(padded_voxels, lod)
+        faces += len(mesh) // FACE_SIZE
+        mesh_bytes += mesh.nbytes
+    return time.perf_counter() - start, faces, mesh_bytes
+
+@njit(cache=True)
+def get_voxel_face(padded_voxels, padded_light, i, face_id) -> tuple:
+    """
+    (visible, ao, flipped, light) of a face of the voxel at the padded index i, read one voxel at a time like the builders did
+    before the bitmasks: the face is visible if the voxel in front of it is void, and its ambient occlusion comes from get_ao.
+    """
+    front = i + FACE_OFFSETS[face_id]
+    if padded_voxels[front]:
+        return False, (0, 0, 0, 0), False, 0
+    plane = 'Y' if face_id < 2 else ('X' if face_id < 4 else 'Z')
+    ao = get_ao(padded_voxels, PADDED_SIZE, front, plane)
+    return True, ao, ao[1] + ao[3] > ao[0] + ao[2], int(padded_light[front])
+
+@njit(cache=True)
+def build_reference_mesh(padded_voxels, padded_light, face_data, section_pos, section_size) -> int:
+    """build_chunk_mesh without the bitmasks: every voxel of the cube and its 6 faces are checked (same faces in the same order)."""
+    index = 0
+    sx, sy, sz = section_pos
+    for y in range(sy, sy + section_size):
+        for z in range(sz, sz + section_size):
+            for x in range(sx, sx + section_size):
+                i = (x + 1) + PADDED_SIZE * (z + 1) + PADDED_AREA * (y + 1)
+                voxel_id = padded_voxels[i]
+                if not voxel_id:
+                    continue
+                for face_id in range(6):
+                    visible, ao, flipped, light = get_voxel_face(padded_voxels, padded_light, i, face_id)
+                    if visible:
+                        index = add_face(face_data, index, x + (face_id == 2), y + (face_id == 0), z + (face_id == 5), voxel_id, face_id, ao, flipped, 1, 1, light)
+    return index
+
+@njit(cache=True)
+def build_reference_mesh_greedy(padded_voxels, padded_light, face_data, section_pos, section_size) -> int:
+    """build_chunk_mesh_greedy without the bitmasks: the keys of the faces are found one voxel at a time, then merged the same way."""
+    sx, sy, sz = section_pos
+    face_keys = np.zeros((6, section_size, section_size, section_size), dtype='int32')
+    for y in range(sy, sy + section_size):
+        for z in range(sz, sz + section_size):
+            for x in range(sx, sx + section_size):
+                i = (x + 1) + PADDED_SIZE * (z + 1) + PADDED_AREA * (y + 1)
+                voxel_id = padded_voxels[i]
+                if not voxel_id:
+                    continue
+                lx, ly, lz = x - sx, y - sy, z - sz
+                for face_id in range(6):
+                    visible, ao, flipped, light = get_voxel_face(padded_voxels, padded_light, i, face_id)
+                    if not visible:
+                        continue
+                    key = light << 17 | voxel_id << 9 | ao[0] << 7 | ao[1] << 5 | ao[2] << 3 | ao[3] << 1 | int(flipped)
+                    if face_id < 2:
+                        face_keys[face_id, ly, lx, lz] = key
+                    elif face_id < 4:
+                        face_keys[face_id, lx, lz, ly] = key
+                    else:
+                        face_keys[face_id, lz, lx, ly] = key
+    return merge_face_keys(face_keys, face_data, section_pos, section_size)
+
+REFERENCES = {
+    'classic': build_reference_mesh,
+    'greedy': build_reference_mesh_greedy,
+}
+
+def check_bitmasks(mesh_builder, reference_builder, world_voxels, chunk_positions, chunk_coords) -> bool:
+    """
+    Check that a builder gives byte-identical meshes to its reference (visible faces from get_exposed_faces and their
+    ambient occlusion from AO_TABLES, against the voxels read one at a time) for every chunk, whole and section by section.
+    """
+    cubes = [((0, 0, 0), CHUNK_SIZE)] + [((x, y, z), SECTION_SIZE) for y in range(0, CHUNK_SIZE, SECTION_SIZE)
+                                          for z in range(0, CHUNK_SIZE, SECTION_SIZE) for x in range(0, CHUNK_SIZE, SECTION_SIZE)]
+    reference = np.empty(get_scratch_size(CHUNK_SIZE), dtype='uint32')
+    for chunk_pos in chunk_positions:
+        padded_voxels = get_padded_chunk(tuple(chunk_pos), world_voxels, chunk_coords)
+        padded_light = get_padded_chunk_light(tuple(chunk_pos), None, chunk_coords)
+        solid_rows = get_chunk_rows(padded_voxels)
+        for section_pos, section_size in cubes:
+            mesh = build_faces(mesh_builder, padded_voxels, solid_rows, padded_light, section_pos, section_size)
+            count = reference_builder(padded_voxels, padded_light, reference, section_pos, section_size)
+            if not np.array_equal(mesh, reference[:count]):
+                return False
+    return True
+
+def read_memory_status() -> dict:
+    """Resident memory of the process (VmRSS) and its peak since the last reset (VmHWM) in bytes, from /proc (Linux)."""
+    with open('/proc/self/status') as file:
+        return {name: int(value.split()[0]) * 1024 for name, value in (line.split(':', 1) for line in file if ':' in line) if name in ('VmRSS', 'VmHWM')}
+
+def get_peak_memory(function) -> tuple:
+    """
+    Call function, returns (its result, the peak of the memory used during the call in bytes, the bytes still used at its end).
+    On Linux this is the resident memory of the process above what it was before the call (its peak is reset first), so the
+    arrays allocated inside njit kernels count too. Elsewhere, or if the peak can't be reset, tracemalloc is used: it only
+    sees the arrays allocated from Python, not the ones allocated by numba inside the kernels.
+    """
+    try:
+        before = read_memory_status()['VmRSS']
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5') # VmHWM starts again from the current resident memory
+    except (OSError, KeyError):
+        tracemalloc.start()
+        value = function()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return value, peak, retained
+
+    value = function()
+    status = read_memory_status()
+    return value, max(status['VmHWM'] - before, 0), max(status['VmRSS'] - before, 0) # Retained includes memory freed but kept by the allocator
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    chunk_positions = get_chunk_positions()
+    chunks_voxels = np.empty([len(chunk_positions), CHUNK_VOL], dtype='uint8')
+    generate_terrain_parallel(chunks_voxels, generate_heightmap(), chunk_positions, noise_tables, SEED)
+    chunk_coords = chunk_positions.astype('int32')
+
+    storage = VoxelStorage(len(chunk_positions)) # Same rows as chunks_voxels
+    for chunk_index, voxels in enumerate(chunks_voxels):
+        storage.store(chunk_index, voxels)
+    world_voxels = storage.arrays
+    print(f'seed {SEED}, {len(chunk_positions)} chunks')
+
+    for name, mesh_builder in MESHERS.items():
+        mesh_world(mesh_builder, world_voxels, chunk_positions[:1], chunk_coords) # Compile before timing
+        seconds, faces, mesh_bytes = mesh_world(mesh_builder, world_voxels, chunk_positions, chunk_coords)
+        _, peak, _ = get_peak_memory(lambda: mesh_world(mesh_builder, world_voxels, chunk_positions, chunk_coords))
+        print(f'{name:8s}: {faces * 2:10d} triangles  {mesh_bytes / 2 ** 20:8.1f} MiB of faces  '
+              f'{seconds * 1000:8.1f} ms ({seconds * 1000 / len(chunk_positions):.2f} ms/chunk)  peak {peak / 2 ** 20:.2f} MiB')
+        identical = check_bitmasks(mesh_builder, REFERENCES[name], world_voxels, chunk_positions, chunk_coords)
+        print(f'{"":8s}  identical to the voxel by voxel reference (whole chunks and sections): {identical}')
+
+    for lod in range(1, len(LOD_DISTANCES) + 1):
+        mesh_world_lod(lod, world_voxels, chunk_positions[:1], chunk_coords) # Compile before timing
+        seconds, faces, mesh_bytes = mesh_world_lod(lod, world_voxels, chunk_positions, chunk_coords)
+        print(f'lod {lod} ({1 << lod}x): {faces * 2:10d} triangles  {mesh_bytes / 2 ** 20:8.1f} MiB of faces  '
+              f'{seconds * 1000:8.1f} ms ({seconds * 1000 / len(chunk_positions):.2f} ms/chunk)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+"""
+Benchmarks of the hot paths of the engine, run without a window (an offscreen OpenGL context is used to build the world).
+Every benchmark runs once to warm up (JIT compilation, or loading the kernels from the numba cache) and then --repeat
+times, the two are reported apart. The world size and the seed are compiled into the kernels, so each combination runs in
+its own process with the settings overridden from the environment (see settings.get_override).
+The saved world and the mesh cache are disabled so every run does the same work.
+
+Run it from the project folder:
+    python -m benchmarks.suite --world 8 2 --seeds 1 2 --output results.json
+    python -m benchmarks.suite --world 8 2 --seeds 1 2 --compare results.json
+--compare exits with status 1 if a benchmark got slower than the results file by more than --threshold percent.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numba
+import moderngl as mgl
+from numba.core import event
+from settings import *
+from startup_profiler import CompileListener, StartupProfiler
+from frame_profiler import FrameProfiler
+from noise import noise_tables
+from terrain_gen import generate_terrain_parallel
+from voxel_storage import VoxelStorage
+from lighting import get_empty_box, light_chunks, update_light
+from light_storage import LightStorage
+from meshes.chunk_mesh_builder import PADDED_SIZE, PADDED_AREA, get_ao, get_padded_voxels
+from meshes.cloud_mesh import get_tile_scratch, build_tile
+from meshes.mesh_scheduler import MeshScheduler
+from meshes.mesh_cache import MeshCache
+from textures import Textures
+from player import Player
+from shader_program import ShaderProgram
+from world import World
+from benchmarks.world_gen import get_chunk_positions, generate_heightmap, generate_serial
+from benchmarks.meshing import MESHERS, mesh_world, mesh_world_lod, get_peak_memory
+
+BENCHMARKS = ('heightmap', 'terrain', 'terrain_parallel', 'mesh_classic', 'mesh_greedy', 'mesh_lod1', 'mesh_lod2', 'mesh_lod3', 'ao', 'padding', 'clouds',
+              'lighting', 'light_edit', 'world', 'ray_cast', 'ray_batch', 'physics', 'frustum', 'occlusion')
+
+def warm_up(function) -> tuple:
+    """Call function for the first time, returns (its result, the seconds it took and the numba compilations it caused)."""
+    listener = CompileListener()
+    event.register('numba:compile', listener)
+    start = time.perf_counter()
+    value = function()
+    seconds = time.perf_counter() - start
+    event.unregister('numba:compile', listener)
+    return value, {'seconds': seconds, 'jit': listener.seconds, 'compiled': listener.compiled}
+
+def measure_memory(function) -> dict:
+    """Peak of the memory used during a call of function and what was still used at its end (MiB, resident memory on Linux, see get_peak_memory)."""
+    _, peak, retained = get_peak_memory(function)
+    return {'peak_mb': peak / 2 ** 20, 'retained_mb': retained / 2 ** 20}
+
+def measure(function, items, repeat, warmup=None) -> dict:
+    """
+    Time a warm-up call of function (unless warmup, the report of warm_up, says it was already called) and then repeat more.
+    items is the amount of work done by a call.
+    """
+    if warmup is None:
+        _, warmup = warm_up(function)
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    median = statistics.median(times)
+    return {
+        'items': items,
+        'warmup': warmup['seconds'], # Seconds of the first call, compilation included
+        'jit': warmup['jit'], # Seconds spent compiling during the first call (0 if the kernels came from the cache)
+        'compiled': warmup['compiled'],
+        'min': min(times),
+        'median': median,
+        'mean': statistics.mean(times),
+        'per_item_us': median / items * 1e6,
+    }
+
+@njit(cache=True)
+def sum_ao(padded_chunks, positions):
+    """Ambient occlusion of the faces of all the planes of the given voxels (row of padded_chunks, x, y, z), like the mesh builders do."""
+    total = 0
+    for i in range(len(positions)):
+        chunk, x, y, z = positions[i]
+        index = (x + 1) + PADDED_SIZE * (z + 1) + PADDED_AREA * (y + 1)
+        for ao in (get_ao(padded_chunks[chunk], PADDED_SIZE, index, 'X'),
+                   get_ao(padded_chunks[chunk], PADDED_SIZE, index, 'Y'),
+                   get_ao(padded_chunks[chunk], PADDED_SIZE, index, 'Z')):
+            total += ao[0] + ao[1] + ao[2] + ao[3]
+    return total
+
+def edit_light(storage, light, chunk_coords, edits):
+    """Place a lamp at every voxel of edits (rows: chunk index, voxel index) and put the old voxel back, updating the light after each change."""
+    box = get_empty_box()
+    for chunk_index, voxel_index in edits:
+        old_id = storage.get_voxel(chunk_index, voxel_index)
+        for voxel_id in (LAMP, old_id):
+            storage.set_voxel(chunk_index, voxel_index, voxel_id)
+            light.arrays = update_light(chunk_index, voxel_index, light.arrays, storage.arrays, chunk_coords, box)
+            light.recycle_pages() # No meshes are built meanwhile
+
+def pad_chunks(world_voxels, chunk_positions, chunk_coords, padded_chunks):
+    """Padded copy of every chunk (consult get_padded_voxels), chunk i goes to the row i % len(padded_chunks)."""
+    for i, chunk_pos in enumerate(chunk_positions):
+        get_padded_voxels(tuple(chunk_pos), world_voxels, chunk_coords, padded_chunks[i % len(padded_chunks)])
+
+class HeadlessEngine:
+    """The objects of VoxelEngine the world needs, with an offscreen OpenGL context instead of a window."""
+
+    def __init__(self):
+        pg.init()
+        try:
+            self.ctx = mgl.create_standalone_context(require=MAJOR_VER * 100 + MINOR_VER * 10)
+        except Exception: # No display (e.g. a server): render without one
+            self.ctx = mgl.create_standalone_context(require=MAJOR_VER * 100 + MINOR_VER * 10, backend='egl')
+        self.ctx.enable(flags=mgl.DEPTH_TEST | mgl.CULL_FACE | mgl.BLEND)
+        self.ctx.gc_mode = 'auto'
+        self.delta_time = 0
+        self.time = 0
+
+        self.startup_profiler = StartupProfiler(time.perf_counter()) # Never finished, so it doesn't report anything
+        self.frame_profiler = FrameProfiler(self)
+        self.textures = Textures(self)
+        self.player = Player(self)
+        self.shader_program = ShaderProgram(self)
+        self.mesh_scheduler = MeshScheduler(self)
+        self.mesh_cache = MeshCache() if MESH_CACHE else None
+
+def run_benchmarks(names, repeat, samples) -> dict:
+    """Run the given benchmarks with the world of the current settings, returns name -> result (see measure)."""
+    results = {}
+    chunk_positions = get_chunk_positions()
+    num_chunks = len(chunk_positions)
+    heightmap, heightmap_warmup = warm_up(generate_heightmap)
+    chunks_voxels = np.empty([num_chunks, CHUNK_VOL], dtype='uint8')
+    generate_parallel = lambda: generate_terrain_parallel(chunks_voxels, heightmap, chunk_positions, noise_tables, SEED)
+    _, generate_parallel_warmup = warm_up(generate_parallel)
+
+    storage = VoxelStorage(num_chunks) # Same rows as chunks_voxels (see benchmarks.meshing)
+    for chunk_index, voxels in enumerate(chunks_voxels):
+        storage.store(chunk_index, voxels)
+    world_voxels = storage.arrays
+    chunk_coords = chunk_positions.astype('int32')
+
+    rng = np.random.default_rng(SEED)
+    world_size = np.array([WORLD_W, WORLD_H, WORLD_D]) * CHUNK_SIZE
+    world_positions = rng.integers(0, world_size, [samples, 3])
+
+    if 'heightmap' in names:
+        results['heightmap'] = measure(generate_heightmap, WORLD_AREA, repeat, heightmap_warmup)
+    if 'terrain' in names: # generate_terrain on every chunk (like Chunk.build_voxels), one at a time
+        voxels = np.empty_like(chunks_voxels)
+        results['terrain'] = measure(lambda: generate_serial(voxels, heightmap, chunk_positions), num_chunks, repeat)
+    if 'terrain_parallel' in names:
+        results['terrain_parallel'] = measure(generate_parallel, num_chunks, repeat, generate_parallel_warmup)
+
+    for name, mesher in (('mesh_classic', 'classic'), ('mesh_greedy', 'greedy')):
+        if name in names:
+            mesh_builder = MESHERS[mesher]
+            mesh = lambda: mesh_world(mesh_builder, world_voxels, chunk_positions, chunk_coords)
+            results[name] = measure(mesh, num_chunks, repeat) | measure_memory(mesh) # The meshes are dropped: only the scratch counts
+            results[name]['faces'] = mesh()[1]
+
+    for lod in range(1, 4): # The same chunks meshed at each level of detail (consult downsample_voxels)
+        name = f'mesh_lod{lod}'
+        if name in names:
+            mesh = lambda: mesh_world_lod(lod, world_voxels, chunk_positions, chunk_coords)
+            results[name] = measure(mesh, num_chunks, repeat)
+            results[name]['faces'] = mesh()[1]
+
+    if 'ao' in names: # Voxels of the padded copies of up to 64 chunks
+        padded_chunks = np.empty([min(num_chunks, 64), PADDED_SIZE ** 3], dtype='uint8')
+        pad_chunks(world_voxels, chunk_positions[:len(padded_chunks)], chunk_coords, padded_chunks)
+        ao_positions = np.column_stack([rng.integers(0, len(padded_chunks), samples), rng.integers(0, CHUNK_SIZE, [samples, 3])])
+        results['ao'] = measure(lambda: sum_ao(padded_chunks, ao_positions), samples * 3, repeat)
+    if 'padding' in names: # The copies of the chunks with the layer of their neighbours, made before meshing them
+        padded_chunks = np.empty([1, PADDED_SIZE ** 3], dtype='uint8')
+        results['padding'] = measure(lambda: pad_chunks(world_voxels, chunk_positions, chunk_coords, padded_chunks), num_chunks, repeat)
+
+    if 'clouds' in names: # The cloud tiles meshed around the player when the game starts (consult CloudMesh)
+        tiles = [(x, z) for x in range(-CLOUD_TILE_RADIUS, CLOUD_TILE_RADIUS + 1) for z in range(-CLOUD_TILE_RADIUS, CLOUD_TILE_RADIUS + 1)]
+        rows, scratch = get_tile_scratch()
+        build_tiles = lambda: [build_tile(x, z, rows, scratch) for x, z in tiles]
+        results['clouds'] = measure(build_tiles, len(tiles), repeat) | measure_memory(lambda: (get_tile_scratch(), build_tiles()))
+        results['clouds']['faces'] = sum(len(mesh) for mesh in build_tiles()) // 18 # Quads (two triangles each)
+
+    if {'lighting', 'light_edit'} & set(names): # Light of the whole world (consult lighting.py), the columns of chunks one after the other
+        light = LightStorage(num_chunks)
+        columns = np.array(sorted(range(num_chunks), key=lambda i: (chunk_positions[i, 0], chunk_positions[i, 2], chunk_positions[i, 1])), dtype='int64')
+        def light_world():
+            light.arrays = light_chunks(columns, light.arrays, world_voxels, chunk_coords)
+            light.recycle_pages()
+        if 'lighting' in names:
+            results['lighting'] = measure(light_world, num_chunks, repeat)
+            report = light.get_report(columns) # Light of the whole world, compared to a CHUNK_VOL array per chunk
+            results['lighting']['light_mb'], results['lighting']['dense_light_mb'] = report['bytes'] / 2 ** 20, report['dense_bytes'] / 2 ** 20
+        else:
+            light_world()
+        if 'light_edit' in names: # A lamp placed on the surface and removed, 2 incremental updates
+            edits = []
+            for x, _, z in world_positions[:min(samples, 1000)]:
+                column_heights = heightmap[x // CHUNK_SIZE + WORLD_W * (z // CHUNK_SIZE)]
+                y = min(int(column_heights[x % CHUNK_SIZE + CHUNK_SIZE * (z % CHUNK_SIZE)]), WORLD_H * CHUNK_SIZE - 1)
+                chunk_index = x // CHUNK_SIZE + WORLD_W * (z // CHUNK_SIZE) + WORLD_AREA * (y // CHUNK_SIZE)
+                edits.append((chunk_index, x % CHUNK_SIZE + CHUNK_SIZE * (z % CHUNK_SIZE) + CHUNK_AREA * (y % CHUNK_SIZE)))
+            results['light_edit'] = measure(lambda: edit_light(storage, light, chunk_coords, edits), 2 * len(edits), repeat)
+
+    if not {'world', 'ray_cast', 'ray_batch', 'physics', 'frustum', 'occlusion'} & set(names):
+        return results
+
+    engine = HeadlessEngine()
+    worlds = []
+    build_world = lambda: worlds.append(World(engine))
+    if 'world' in names:
+        results['world'] = measure(lambda: (worlds.clear(), build_world()), num_chunks, repeat)
+        worlds.clear()
+        results['world'] |= measure_memory(build_world) # Retained: voxels and meshes of the world, peak - retained: scratch
+    else:
+        build_world()
+    world = worlds[-1]
+    player = engine.player
+
+    if {'ray_cast', 'ray_batch'} & set(names): # From above the terrain, looking around and down
+        rays = []
+        for x, _, z in world_positions[:min(samples, 10_000)]:
+            position = glm.vec3(x + 0.5, world.get_height(x, z) + 2.5, z + 0.5)
+            yaw, pitch = rng.uniform(-math.pi, math.pi), rng.uniform(-PITCH_MAX, 0)
+            forward = glm.normalize(glm.vec3(math.cos(yaw) * math.cos(pitch), math.sin(pitch), math.sin(yaw) * math.cos(pitch)))
+            rays.append((position, forward))
+
+        def cast_rays():
+            for player.position, player.forward in rays:
+                world.voxel_handler.ray_cast()
+        if 'ray_cast' in names:
+            results['ray_cast'] = measure(cast_rays, len(rays), repeat)
+        if 'ray_batch' in names: # The same rays in a single call of VoxelHandler.cast_rays
+            origins, directions = np.array([tuple(origin) for origin, _ in rays]), np.array([tuple(forward) for _, forward in rays])
+            results['ray_batch'] = measure(lambda: world.voxel_handler.cast_rays(origins, directions), len(rays), repeat)
+
+    if 'physics' in names: # Steps of player sized bodies falling on the terrain and walking around (Physics.move_bodies)
+        bodies = world_positions[:min(samples, 10_000)]
+        start_positions = np.array([(x + 0.5, world.get_height(x, z) + 4.0, z + 0.5) for x, _, z in bodies])
+        angles = rng.uniform(-math.pi, math.pi, len(bodies))
+        start_velocities = np.stack([np.cos(angles) * 5, np.zeros(len(bodies)), np.sin(angles) * 5], axis=1)
+        sizes = np.tile([PLAYER_WIDTH, PLAYER_HEIGTH, PLAYER_DEPTH], (len(bodies), 1)).astype('float64')
+
+        def step_bodies():
+            positions, velocities = start_positions.copy(), start_velocities.copy()
+            for _ in range(PHYSICS_TICK_RATE): # One second
+                world.physics.move_bodies(positions, velocities, sizes)
+        results['physics'] = measure(step_bodies, len(bodies) * PHYSICS_TICK_RATE, repeat)
+
+    if 'frustum' in names: # Culling of all the chunks (World.render) while the player turns around
+        player.position = glm.vec3(PLAYER_POS)
+        views = []
+        for yaw in np.linspace(-180, 180, 64, endpoint=False):
+            player.yaw, player.pitch = glm.radians(yaw), glm.radians(-20)
+            player.update_vectors()
+            views.append((glm.vec3(player.forward), glm.vec3(player.right), glm.vec3(player.up)))
+
+        def cull():
+            for player.forward, player.right, player.up in views:
+                player.frustum.get_visible_chunks(world.chunk_coords, world.mesh_vertices)
+        results['frustum'] = measure(cull, len(views) * len(world.chunks), repeat)
+
+    if 'occlusion' in names: # Frustum and occlusion culling (the search of the chunks seen through air) from above the terrain
+        views = []
+        for x, _, z in world_positions[:256]:
+            player.position = glm.vec3(x + 0.5, world.get_height(x, z) + 2.5, z + 0.5)
+            player.yaw, player.pitch = rng.uniform(-math.pi, math.pi), rng.uniform(-PITCH_MAX / 2, 0)
+            player.update_vectors()
+            views.append((glm.vec3(player.position), glm.vec3(player.forward), glm.vec3(player.right), glm.vec3(player.up)))
+
+        def cull(chunk_visibility):
+            drawn = 0
+            for player.position, player.forward, player.right, player.up in views:
+                drawn += len(player.frustum.get_visible_chunks(world.chunk_coords, world.mesh_vertices, chunk_visibility))
+            return drawn
+        results['occlusion'] = measure(lambda: cull(world.chunk_visibility), len(views), repeat)
+        in_frustum = cull(None)
+        results['occlusion']['culled_pct'] = 100 * (in_frustum - cull(world.chunk_visibility)) / max(in_frustum, 1) # Of the chunks in the frustum
+
+    return results
+
+def run_worker(world, seed, names, args) -> dict:
+    """Run the benchmarks of a world size and seed in a new process (settings are read when the modules are imported)."""
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1',
+               VOXEL_WORLD_W=str(world[0]), VOXEL_WORLD_H=str(world[1]), VOXEL_SEED=str(seed),
+               VOXEL_LOAD_SAVED_WORLD='false', VOXEL_SAVE_ON_EXIT='false', VOXEL_MESH_CACHE='false')
+    with tempfile.TemporaryDirectory(prefix='benchmarks_') as folder:
+        if args.cold:
+            env['NUMBA_CACHE_DIR'] = os.path.join(folder, 'numba') # Nothing compiled yet
+        output = os.path.join(folder, 'results.json')
+        subprocess.run([sys.executable, '-m', 'benchmarks.suite', '--worker', output, '--only', *names,
+                        '--repeat', str(args.repeat), '--samples', str(args.samples)], env=env, check=True)
+        with open(output) as file:
+            return json.load(file)
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(run, baseline=None):
+    print(f'world {run["world"][0]}x{run["world"][1]}, seed {run["seed"]}')
+    for name, result in run['benchmarks'].items():
+        line = (f'  {name:16s} warm-up {result["warmup"] * 1000:9.1f} ms (jit {result["jit"] * 1000:8.1f} ms)  '
+                f'median {result["median"] * 1000:9.2f} ms  {result["per_item_us"]:10.3f} us/item')
+        if 'faces' in result:
+            line += f'  {result["faces"] * 2:10d} triangles'
+        if 'culled_pct' in result:
+            line += f'  {result["culled_pct"]:5.1f}% of the frustum occluded'
+        if 'light_mb' in result:
+            line += f'  light {result["light_mb"]:8.2f} MiB (dense {result["dense_light_mb"]:.2f})'
+        if 'peak_mb' in result:
+            line += f'  peak {result["peak_mb"]:8.2f} MiB (retained {result["retained_mb"]:.2f})'
+        if baseline and name in baseline:
+            line += f'  {(result["median"] / baseline[name]["median"] - 1) * 100:+6.1f}%'
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--world', type=int, nargs=2, default=[WORLD_W, WORLD_H], metavar=('W', 'H'), help='world size in chunks')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS, help='benchmarks to run')
+    parser.add_argument('--repeat', type=int, default=3, help='runs after the warm-up (the median is compared)')
+    parser.add_argument('--samples', type=int, default=200_000, help='voxels sampled by ao (rays and bodies: up to 10000)')
+    parser.add_argument('--cold', action='store_true', help='start from an empty numba cache, so the warm-up includes the JIT')
+    parser.add_argument('--output', help='JSON file of the results')
+    parser.add_argument('--compare', help='JSON file of previous results to compare with')
+    parser.add_argument('--threshold', type=float, default=10, help='slowdown (percent) reported as a regression')
+    parser.add_argument('--worker', help=argparse.SUPPRESS) # Results file of a single world and seed (internal)
+    args = parser.parse_args()
+
+    if args.worker:
+        with open(args.worker, 'w') as file:
+            json.dump(run_benchmarks(args.only, args.repeat, args.samples), file)
+        return
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = {(tuple(run['world']), run['seed']): run['benchmarks'] for run in json.load(file)['runs']}
+
+    results = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'numba': numba.__version__,
+            'numpy': np.__version__,
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+            'samples': args.samples,
+            'cold': args.cold,
+        },
+        'runs': [],
+    }
+    regressions = []
+    for seed in args.seeds:
+        run = {'world': args.world, 'seed': seed, 'benchmarks': run_worker(args.world, seed, args.only, args)}
+        results['runs'].append(run)
+        old_run = baseline.get((tuple(args.world), seed))
+        print_results(run, old_run)
+        for name, result in run['benchmarks'].items():
+            if old_run and name in old_run and result['median'] > old_run[name]['median'] * (1 + args.threshold / 100):
+                regressions.append(f'{name} (seed {seed})')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if regressions:
+        print(f'slower than {args.compare} by more than {args.threshold:g}%: {", ".join(regressions)}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Memory used by the compact voxel storage compared to one CHUNK_VOL array per chunk, and the cost of reading from it.
+
+Run it from the project folder:
+    python -m benchmarks.voxel_storage
+"""
+import argparse
+import time
+from settings import *
+from terrain_gen import generate_terrain_parallel
+from noise import noise_tables
+from voxel_storage import VoxelStorage, get_voxel
+from benchmarks.world_gen import get_chunk_positions, generate_heightmap
+
+@njit
+def read_dense(chunks_voxels, chunk_indices, voxel_indices):
+    total = 0
+    for i in range(len(chunk_indices)):
+        total += chunks_voxels[chunk_indices[i], voxel_indices[i]]
+    return total
+
+@njit
+def read_storage(world_voxels, chunk_indices, voxel_indices):
+    total = 0
+    for i in range(len(chunk_indices)):
+        total += get_voxel(world_voxels, chunk_indices[i], voxel_indices[i])
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reads', type=int, default=10_000_000, help='random voxel reads to time')
+    args = parser.parse_args()
+
+    chunk_positions = get_chunk_positions()
+    num_chunks = len(chunk_positions)
+    chunks_voxels = np.empty([num_chunks, CHUNK_VOL], dtype='uint8')
+    generate_terrain_parallel(chunks_voxels, generate_heightmap(), chunk_positions, noise_tables, SEED)
+
+    for voxels in chunks_voxels: # Compile before timing (including the compaction)
+        VoxelStorage(1).store(0, voxels)
+
+    storage = VoxelStorage(num_chunks)
+    start = time.perf_counter()
+    for chunk_index, voxels in enumerate(chunks_voxels):
+        storage.store(chunk_index, voxels)
+    store_time = time.perf_counter() - start
+
+    report = storage.get_report(np.arange(num_chunks))
+    print(f'seed {SEED}, {num_chunks} chunks: {report["uniform"]} uniform, {report["palette"]} palette, {report["dense"]} dense')
+    print(f'dense   : {report["dense_bytes"] / 2 ** 20:8.1f} MiB')
+    print(f'compact : {report["bytes"] / 2 ** 20:8.1f} MiB ({report["allocated_bytes"] / 2 ** 20:.1f} MiB allocated), '
+          f'{report["saved_bytes"] / 2 ** 20:.1f} MiB saved, stored in {store_time * 1000:.1f} ms')
+
+    identical = all(np.array_equal(storage.get_chunk(i), voxels) for i, voxels in enumerate(chunks_voxels))
+    print(f'decoded chunks identical: {identical}')
+
+    rng = np.random.default_rng(0)
+    chunk_indices = rng.integers(0, num_chunks, args.reads)
+    voxel_indices = rng.integers(0, CHUNK_VOL, args.reads)
+    for name, reader, voxels in (('dense', read_dense, chunks_voxels), ('compact', read_storage, storage.arrays)):
+        reader(voxels, chunk_indices[:1], voxel_indices[:1]) # Compile before timing
+        start = time.perf_counter()
+        reader(voxels, chunk_indices, voxel_indices)
+        seconds = time.perf_counter() - start
+        print(f'{name:8s}: {seconds * 1e9 / args.reads:6.2f} ns per random read')
+
+if __name__ == '__main__':
+    main()
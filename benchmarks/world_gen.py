@@ -0,0 +1,73 @@
+"""
+Benchmark of the world generation (chunks generated per second).
+
+Run it from the project folder:
+    python -m benchmarks.world_gen --threads 1 2 4 8
+"""
+import argparse
+import time
+from numba import config, set_num_threads
+from settings import *
+from terrain_gen import build_heightmap, generate_terrain, generate_terrain_parallel
+from noise import noise_tables
+from chunk_table import get_column_index
+
+def get_chunk_positions():
+    """Positions of all the chunks of the world, in the same order used by World.voxels (chunk table)."""
+    positions = [(x, y, z) for y in range(WORLD_H) for z in range(WORLD_D) for x in range(WORLD_W)]
+    return np.array(positions, dtype='int64')
+
+def generate_heightmap():
+    """Heightmap of the whole world, like World.build_heightmap."""
+    column_positions = np.array([(x, z) for z in range(WORLD_D) for x in range(WORLD_W)], dtype='int64')
+    heightmap = np.empty([WORLD_AREA, CHUNK_AREA], dtype='int32')
+    build_heightmap(heightmap, column_positions, noise_tables)
+    return heightmap
+
+def generate_serial(voxels, heightmap, chunk_positions):
+    """Generate the chunks one at a time like the old World.build_chunks."""
+    for i, (x, y, z) in enumerate(chunk_positions):
+        voxels[i] = 0
+        generate_terrain(voxels[i], heightmap[get_column_index(x, z)], x * CHUNK_SIZE, y * CHUNK_SIZE, z * CHUNK_SIZE, noise_tables, SEED)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, config.NUMBA_NUM_THREADS], help='worker counts to measure')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per worker count (the best one is reported)')
+    args = parser.parse_args()
+
+    chunk_positions = get_chunk_positions()
+    num_chunks = len(chunk_positions)
+    voxels = np.empty([num_chunks, CHUNK_VOL], dtype='uint8')
+    reference = np.empty_like(voxels)
+
+    # Compile the kernels before timing them
+    heightmap = generate_heightmap()
+    generate_serial(reference[:1], heightmap, chunk_positions[:1])
+    generate_terrain_parallel(voxels, heightmap, chunk_positions[:1], noise_tables, SEED)
+
+    start = time.perf_counter()
+    heightmap = generate_heightmap()
+    heightmap_time = time.perf_counter() - start
+    print(f'seed {SEED}, {num_chunks} chunks')
+    print(f'heightmap  : {WORLD_AREA / heightmap_time:8.1f} columns/s ({heightmap_time * 1000:.1f} ms, shared by {WORLD_H} chunks per column)')
+
+    start = time.perf_counter()
+    generate_serial(reference, heightmap, chunk_positions)
+    serial_time = time.perf_counter() - start
+    print(f'serial     : {num_chunks / serial_time:8.1f} chunks/s')
+
+    for threads in args.threads:
+        set_num_threads(min(threads, config.NUMBA_NUM_THREADS))
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            generate_terrain_parallel(voxels, heightmap, chunk_positions, noise_tables, SEED)
+            best = min(best, time.perf_counter() - start)
+
+        identical = np.array_equal(voxels, reference)
+        print(f'{threads:3d} threads: {num_chunks / best:8.1f} chunks/s  '
+              f'speedup {serial_time / best:5.2f}x  identical to serial: {identical}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark of saving and loading the edits of the world (region files): a loaded chunk is generated again and its edits are
+written over it, so the save only grows with the number of edits.
+
+Run it from the project folder:
+    python -m benchmarks.world_save --edits 10000 --path saves/benchmark
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from settings import *
+from terrain_gen import generate_terrain_parallel
+from noise import noise_tables
+from world_save import WorldSave
+from world import apply_edits
+from benchmarks.world_gen import get_chunk_positions, generate_heightmap
+
+def get_size(path) -> int:
+    """Total size of the files in a folder."""
+    return sum(os.path.getsize(os.path.join(folder, name)) for folder, _, names in os.walk(path) for name in names)
+
+def get_random_edits(num_chunks, num_edits, seed=0) -> list:
+    """Random edits of the chunks (voxel index -> voxel id for each chunk), like the player placing and removing blocks."""
+    rng = np.random.default_rng(seed)
+    edits = [{} for _ in range(num_chunks)]
+    for chunk, voxel_index, voxel_id in zip(rng.integers(0, num_chunks, num_edits), rng.integers(0, CHUNK_VOL, num_edits),
+                                            rng.choice((0,) + PLACEABLE_BLOCKS, num_edits)):
+        edits[chunk][int(voxel_index)] = int(voxel_id)
+    return edits
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--edits', type=int, default=10000, help='number of random edits of the world')
+    parser.add_argument('--path', help='folder of the benchmark save (a temporary folder by default, deleted at the end)')
+    args = parser.parse_args()
+    path = args.path or tempfile.mkdtemp(prefix='world_save_')
+    if os.path.exists(path):
+        shutil.rmtree(path) # Start from an empty save
+
+    chunk_positions = get_chunk_positions()
+    num_chunks = len(chunk_positions)
+    voxels = np.empty([num_chunks, CHUNK_VOL], dtype='uint8')
+
+    # Compile the kernels before timing them
+    generate_terrain_parallel(voxels, generate_heightmap(), chunk_positions[:1], noise_tables, SEED)
+
+    start = time.perf_counter()
+    generate_terrain_parallel(voxels, generate_heightmap(), chunk_positions, noise_tables, SEED)
+    generate_time = time.perf_counter() - start
+    edits = get_random_edits(num_chunks, args.edits)
+    num_edits = sum(map(len, edits))
+    for chunk_voxels, chunk_edits in zip(voxels, edits):
+        apply_edits(chunk_voxels, chunk_edits)
+    print(f'seed {SEED}, {num_chunks} chunks ({voxels.nbytes / 2 ** 20:.1f} MiB of voxels), {num_edits} edits')
+    print(f'generate   : {generate_time * 1000:8.1f} ms')
+
+    start = time.perf_counter()
+    world_save = WorldSave(path)
+    for position, chunk_edits in zip(chunk_positions, edits):
+        if chunk_edits: # Only the edited chunks are saved
+            world_save.save_edits(position, chunk_edits)
+    world_save.save_meta()
+    world_save.close()
+    save_time = time.perf_counter() - start
+    size = get_size(path)
+    print(f'save       : {save_time * 1000:8.1f} ms  ({size / 2 ** 10:.1f} KiB on disk, '
+          f'{size / max(num_edits, 1):.2f} bytes per edit, {voxels.nbytes / size:.0f}x smaller than the voxels)')
+
+    # Opening maps the region files and checks their headers, once per region
+    start = time.perf_counter()
+    world_save = WorldSave(path)
+    for x, _, z in chunk_positions:
+        if world_save.has_region(x, z):
+            world_save.get_region(x, z)
+    open_time = time.perf_counter() - start
+    print(f'open       : {open_time * 1000:8.1f} ms  ({len(world_save.regions)} region files)')
+
+    # The edits of a single column (what the streaming world loads when the player moves)
+    x, _, z = chunk_positions[0]
+    start = time.perf_counter()
+    for y in range(WORLD_H):
+        world_save.load_edits((x, y, z))
+    column_time = time.perf_counter() - start
+    print(f'load column: {column_time * 1000:8.3f} ms  ({WORLD_H} chunks)')
+
+    # Loading the world is generating it again and writing the saved edits over it
+    loaded = np.empty_like(voxels)
+    start = time.perf_counter()
+    loaded_edits = [world_save.load_edits(position) or {} for position in chunk_positions]
+    generate_terrain_parallel(loaded, generate_heightmap(), chunk_positions, noise_tables, SEED)
+    for chunk_voxels, chunk_edits in zip(loaded, loaded_edits):
+        apply_edits(chunk_voxels, chunk_edits)
+    load_time = time.perf_counter() - start
+    world_save.close()
+    print(f'load       : {load_time * 1000:8.1f} ms  (identical: {np.array_equal(loaded, voxels)})')
+
+    if not args.path:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+from settings import *
+
+# Coordinates stored for the rows of the chunk table that don't hold any chunk
+UNLOADED = np.iinfo(np.int32).min
+
+@njit(cache=True)
+def get_column_index(cx, cz):
+    """
+    Get the index of a column of chunks (chunk coordinates) in the chunk table.
+    Coordinates wrap around the table, so in a streaming world every chunk around the player has its own row
+    and a column that comes into view reuses the row of the one that left it.
+    """
+    return cx % CHUNK_TABLE_W + CHUNK_TABLE_W * (cz % CHUNK_TABLE_D)
+
+@njit(cache=True)
+def get_table_index(cx, cy, cz):
+    """Get the index of a chunk (chunk coordinates) in the chunk table (World.chunks, World.voxels)."""
+    return get_column_index(cx, cz) + CHUNK_TABLE_AREA * cy
+
+@njit(cache=True)
+def is_chunk_loaded(chunk_coords, cx, cy, cz):
+    """Check if the chunk at the given chunk coordinates is currently stored in the chunk table."""
+    if not 0 <= cy < WORLD_H:
+        return False
+
+    index = get_table_index(cx, cy, cz)
+    return chunk_coords[index, 0] == cx and chunk_coords[index, 2] == cz
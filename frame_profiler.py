@@ -0,0 +1,148 @@
+import csv
+import json
+import os
+import time
+from collections import deque
+from settings import *
+
+class FrameProfiler:
+    """
+    Times the stages of every frame (the time between two calls of mark) and sums counters (chunks drawn, triangles...).
+    Nothing is measured while it is off, mark and count return immediately, so it can be left in the main loop.
+    It is on while the overlay is shown (PROFILER_OVERLAY_KEY), while recording (PROFILER_TRACE_KEY) or if FRAME_PROFILER is set.
+    A recording is saved to FRAME_TRACE_DIR as a Chrome trace (open it with chrome://tracing or ui.perfetto.dev) and a CSV.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.show_overlay = False
+        self.is_recording = False
+        self.enabled = FRAME_PROFILER
+
+        self.frame_start = 0.0
+        self.last_time = 0.0 # End of the last stage
+        self.stages = {} # Stage -> [start, seconds] during the current frame
+        self.counters = {} # Counter -> value during the current frame
+        self.history = deque(maxlen=FRAME_PROFILER_HISTORY) # Last frames: (seconds, stages, counters)
+        self.recorded_frames = [] # Frames of the recording: (start, seconds, stages, counters)
+        self.record_start = 0.0
+
+        self.overlay = None # OverlayMesh, created the first time it is shown
+        self.overlay_time = 0.0 # When the text of the overlay was last updated
+
+    def update_enabled(self):
+        was_enabled = self.enabled
+        self.enabled = FRAME_PROFILER or self.show_overlay or self.is_recording
+        if self.enabled and not was_enabled: # Start from the next frame, the old history is out of date
+            self.frame_start = 0.0
+            self.history.clear()
+
+    def handle_event(self, event):
+        if event.type != pg.KEYDOWN:
+            return
+        if event.key == PROFILER_OVERLAY_KEY:
+            self.show_overlay = not self.show_overlay
+        elif event.key == PROFILER_TRACE_KEY:
+            if self.is_recording:
+                self.save_trace()
+            else:
+                self.recorded_frames = []
+                self.record_start = time.perf_counter()
+            self.is_recording = not self.is_recording
+        self.update_enabled()
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.frame_start = self.last_time = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+
+    def mark(self, stage):
+        """End the current stage of the frame (it started at the end of the previous one)."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if stage in self.stages: # A stage run twice in the same frame is summed up
+            self.stages[stage][1] += now - self.last_time
+        else:
+            self.stages[stage] = [self.last_time, now - self.last_time]
+        self.last_time = now
+
+    def count(self, counter, value=1):
+        if not self.enabled:
+            return
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def end_frame(self):
+        if not self.enabled or not self.frame_start:
+            return
+        seconds = time.perf_counter() - self.frame_start
+        self.history.append((seconds, self.stages, self.counters))
+        if self.is_recording:
+            self.recorded_frames.append((self.frame_start, seconds, self.stages, self.counters))
+
+        if self.show_overlay and time.perf_counter() - self.overlay_time > FRAME_OVERLAY_INTERVAL:
+            self.update_overlay()
+
+    def get_report_lines(self) -> list:
+        """Average of the frames in the history, as lines of text."""
+        frames = len(self.history)
+        frame_ms = sum(seconds for seconds, _, _ in self.history) * 1000 / frames
+        stages, counters = {}, {}
+        for _, frame_stages, frame_counters in self.history:
+            for stage, (_, seconds) in frame_stages.items():
+                stages[stage] = stages.get(stage, 0) + seconds * 1000 / frames
+            for counter, value in frame_counters.items():
+                counters[counter] = counters.get(counter, 0) + value / frames
+
+        lines = [f'frame {frame_ms:6.2f} ms ({1000 / frame_ms:.0f} fps, average of {frames} frames)']
+        lines += [f'  {stage:24s} {ms:6.2f} ms' for stage, ms in stages.items()]
+        lines += [f'{counter:26s} {value:10.0f}' for counter, value in counters.items()]
+        if self.is_recording:
+            lines.append(f'recording {len(self.recorded_frames)} frames ({pg.key.name(PROFILER_TRACE_KEY).upper()} to save)')
+        return lines
+
+    def update_overlay(self):
+        if not self.history:
+            return
+        if self.overlay is None:
+            from meshes.overlay_mesh import OverlayMesh # Only needed once the overlay is shown
+            self.overlay = OverlayMesh(self.engine)
+        self.overlay.set_text(self.get_report_lines())
+        self.overlay_time = time.perf_counter()
+
+    def render(self):
+        if self.show_overlay and self.overlay:
+            self.overlay.render()
+
+    def save_trace(self, folder=FRAME_TRACE_DIR) -> str:
+        """Save the recorded frames as a Chrome trace (.json) and a CSV (.csv), returns the path without extension."""
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, time.strftime('frames_%Y%m%d_%H%M%S'))
+        to_us = lambda seconds: round(seconds * 1e6, 1)
+
+        events = []
+        for index, (start, seconds, stages, counters) in enumerate(self.recorded_frames):
+            events.append({'name': 'frame', 'ph': 'X', 'pid': 0, 'tid': 0, 'ts': to_us(start - self.record_start),
+                           'dur': to_us(seconds), 'args': {'frame': index}})
+            for stage, (stage_start, stage_seconds) in stages.items():
+                events.append({'name': stage, 'ph': 'X', 'pid': 0, 'tid': 0, 'ts': to_us(stage_start - self.record_start),
+                               'dur': to_us(stage_seconds)})
+            for counter, value in counters.items():
+                events.append({'name': counter, 'ph': 'C', 'pid': 0, 'ts': to_us(start - self.record_start), 'args': {'value': value}})
+        with open(path + '.json', 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+        stage_names = list(dict.fromkeys(stage for _, _, stages, _ in self.recorded_frames for stage in stages))
+        counter_names = list(dict.fromkeys(counter for _, _, _, counters in self.recorded_frames for counter in counters))
+        with open(path + '.csv', 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['frame', 'start_ms', 'frame_ms'] + [f'{stage}_ms' for stage in stage_names] + counter_names)
+            for index, (start, seconds, stages, counters) in enumerate(self.recorded_frames):
+                writer.writerow([index, round((start - self.record_start) * 1000, 3), round(seconds * 1000, 3)]
+                                + [round(stages[stage][1] * 1000, 3) if stage in stages else '' for stage in stage_names]
+                                + [counters.get(counter, 0) for counter in counter_names])
+
+        print(f'Saved {len(self.recorded_frames)} frames to {path}.json and {path}.csv')
+        return path
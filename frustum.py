@@ -1,4 +1,9 @@
 from settings import *
+from chunk_table import UNLOADED
+from meshes.chunk_mesh_builder import ALL_FACES_CONNECTED, get_chunk_index
+
+# Chunk coordinates of the neighbour across each face of a chunk (same order as the face ids: top, bottom, right, left, back, front)
+FACE_STEPS = ((0, 1, 0), (0, -1, 0), (1, 0, 0), (-1, 0, 0), (0, 0, -1), (0, 0, 1))
 
 class Frustum:
     def __init__(self, camera):
@@ -10,27 +15,154 @@ class Frustum:
         self.factor_x = 1.0 / math.cos(half_x := H_FOV * 0.5)
         self.tan_x = math.tan(half_x)
 
-    def is_on_frustum(self, chunk):
-        """Method that checks whether a certain chunk is inside of frustum or not."""
+        self.visible = np.empty(0, dtype='int32') # Rows of the visible chunks (reused between frames)
+        self.search = get_search_scratch(0) # Scratch of cull_occluded_chunks (reused between frames, grown with the box of the search)
+
+    def get_visible_chunks(self, chunk_coords, mesh_vertices, chunk_visibility=None) -> np.array:
+        """
+        Get the rows of the chunk table whose chunk has something to draw and is inside of the frustum (one pass over all of them).
+        With chunk_visibility (faces of each chunk connected through air) only the ones the camera can see through air are kept.
+        """
+        if len(self.visible) < len(chunk_coords):
+            self.visible = np.empty(len(chunk_coords), dtype='int32')
+
+        camera = tuple(self.cam.position), tuple(self.cam.forward), tuple(self.cam.up), tuple(self.cam.right)
+        if chunk_visibility is None:
+            count = cull_chunks(chunk_coords, mesh_vertices, *camera, self.factor_x, self.tan_x, self.factor_y, self.tan_y, self.visible)
+        else:
+            count = cull_occluded_chunks(chunk_coords, mesh_vertices, chunk_visibility, *camera,
+                                         self.factor_x, self.tan_x, self.factor_y, self.tan_y, self.visible, *self.search)
+            if count < 0: # The box of the search got bigger than the scratch arrays (room to grow a bit more before allocating again)
+                self.search = get_search_scratch(-2 * count)
+                count = cull_occluded_chunks(chunk_coords, mesh_vertices, chunk_visibility, *camera,
+                                             self.factor_x, self.tan_x, self.factor_y, self.tan_y, self.visible, *self.search)
+        return self.visible[:count]
+
+@njit(cache=True)
+def is_chunk_on_frustum(chunk_x, chunk_y, chunk_z, position, forward, up, right, factor_x, tan_x, factor_y, tan_y) -> bool:
+    """Whether the bounding sphere of a chunk (found from its chunk coordinates) is inside the frustum of the camera."""
+    # vector to sphere center
+    vx = (chunk_x + 0.5) * CHUNK_SIZE - position[0]
+    vy = (chunk_y + 0.5) * CHUNK_SIZE - position[1]
+    vz = (chunk_z + 0.5) * CHUNK_SIZE - position[2]
+
+    # outside the NEAR and FAR planes?
+    sz = vx * forward[0] + vy * forward[1] + vz * forward[2]
+    if not (NEAR - CHUNK_SPHERE_RADIUS <= sz <= FAR + CHUNK_SPHERE_RADIUS):
+        return False
+
+    # outside the TOP and BOTTOM planes?
+    sy = vx * up[0] + vy * up[1] + vz * up[2]
+    dist = factor_y * CHUNK_SPHERE_RADIUS + sz * tan_y
+    if not (-dist <= sy <= dist):
+        return False
+
+    # outside the LEFT and RIGHT planes?
+    sx = vx * right[0] + vy * right[1] + vz * right[2]
+    dist = factor_x * CHUNK_SPHERE_RADIUS + sz * tan_x
+    return -dist <= sx <= dist
+
+@njit(cache=True)
+def cull_chunks(chunk_coords, mesh_vertices, position, forward, up, right, factor_x, tan_x, factor_y, tan_y, visible) -> int:
+    """
+    Same test as is_chunk_on_frustum for every row of the chunk table.
+    The rows of the visible chunks are written to visible, returns how many they are.
+    """
+    count = 0
+    for i in range(len(chunk_coords)):
+        if mesh_vertices[i] == 0 or chunk_coords[i, 0] == UNLOADED: # Nothing to draw
+            continue
+        if is_chunk_on_frustum(chunk_coords[i, 0], chunk_coords[i, 1], chunk_coords[i, 2], position, forward, up, right, factor_x, tan_x, factor_y, tan_y):
+            visible[count] = i
+            count += 1
+    return count
+
+def get_search_scratch(cells) -> tuple:
+    """Arrays used by cull_occluded_chunks for a box of the given number of chunks: entered, queue_cells, queue_faces, queue_steps."""
+    return (np.zeros(cells, dtype=np.uint8), np.empty(cells * 7, dtype=np.int64), np.empty(cells * 7, dtype=np.int8), np.empty(cells * 7, dtype=np.uint8))
+
+@njit(cache=True)
+def get_search_box(chunk_coords) -> tuple:
+    """Box of the search of cull_occluded_chunks (chunk coordinates, ends included): the loaded chunks and a layer of air around them."""
+    low = np.full(3, 2 ** 30, dtype=np.int64)
+    high = np.full(3, -2 ** 30, dtype=np.int64)
+    for i in range(len(chunk_coords)):
+        if chunk_coords[i, 0] != UNLOADED:
+            for axis in range(3):
+                low[axis] = min(low[axis], chunk_coords[i, axis] - 1)
+                high[axis] = max(high[axis], chunk_coords[i, axis] + 1)
+    if low[0] > high[0]: # Nothing loaded
+        high[:] = low - 1
+    return low, high
 
-        # vector to sphere center
-        sphere_vec = chunk.center - self.cam.position
+@njit(cache=True)
+def cull_occluded_chunks(chunk_coords, mesh_vertices, chunk_visibility, position, forward, up, right, factor_x, tan_x, factor_y, tan_y,
+                         visible, entered, queue_cells, queue_faces, queue_steps) -> int:
+    """
+    Breadth-first search of the chunks from the one of the camera, a chunk is entered through a face and left through
+    the faces connected to it by air (chunk_visibility, consult get_face_connections), so the chunks behind solid terrain
+    are never reached while caves are followed. The search never steps in the direction opposite to one it already took
+    (the view goes away from the camera) and only enters the chunks in the frustum.
+    The space around the loaded chunks is air: the search covers them and one chunk around them, a camera further away
+    starts from the nearest chunk of that layer. Writes the rows of the chunks reached with something to draw to visible,
+    returns how many they are.
+    The other arrays are scratch reused every frame (consult get_search_scratch), if they are smaller than the box of the
+    search (consult get_search_box) nothing is done and minus the chunks of the box is returned. Their content:
+    entered holds the faces each chunk was entered through (bit 6: reached at all), a chunk is queued at most once per face
+    (and once as the start) with the face it is entered through (queue_faces, -1: the start) and the directions (face ids)
+    taken to reach it (queue_steps).
+    """
+    low, high = get_search_box(chunk_coords)
+    if low[0] > high[0]: # Nothing loaded
+        return 0
+    size_x, size_y, size_z = high[0] - low[0] + 1, high[1] - low[1] + 1, high[2] - low[2] + 1
+    if len(entered) < size_x * size_y * size_z:
+        return -size_x * size_y * size_z
+    entered[:size_x * size_y * size_z] = 0
 
-        # outside the NEAR and FAR planes?
-        sz = glm.dot(sphere_vec, self.cam.forward)
-        if not (NEAR - CHUNK_SPHERE_RADIUS <= sz <= FAR + CHUNK_SPHERE_RADIUS):
-            return False
+    # Chunk of the camera (in the box), the search starts from it
+    cx = min(max(math.floor(position[0] / CHUNK_SIZE), low[0]), high[0]) - low[0]
+    cy = min(max(math.floor(position[1] / CHUNK_SIZE), low[1]), high[1]) - low[1]
+    cz = min(max(math.floor(position[2] / CHUNK_SIZE), low[2]), high[2]) - low[2]
+    queue_cells[0] = cx + size_x * (cz + size_z * cy)
+    queue_faces[0] = -1
+    queue_steps[0] = 0
+    head, tail = 0, 1
 
-        # outside the TOP and BOTTOM planes?
-        sy = glm.dot(sphere_vec, self.cam.up)
-        dist = self.factor_y * CHUNK_SPHERE_RADIUS + sz * self.tan_y
-        if not (-dist <= sy <= dist):
-            return False
+    count = 0
+    while head < tail:
+        cell, face, steps = queue_cells[head], queue_faces[head], queue_steps[head]
+        head += 1
+        y, rest = divmod(cell, size_x * size_z)
+        z, x = divmod(rest, size_x)
+        chunk_x, chunk_y, chunk_z = x + low[0], y + low[1], z + low[2]
 
-        # outside the LEFT and RIGHT planes?
-        sx = glm.dot(sphere_vec, self.cam.right)
-        dist = self.factor_x * CHUNK_SPHERE_RADIUS + sz * self.tan_x
-        if not (-dist <= sx <= dist):
-            return False
+        chunk_index = get_chunk_index((chunk_x * CHUNK_SIZE, chunk_y * CHUNK_SIZE, chunk_z * CHUNK_SIZE), chunk_coords)
+        connections = ALL_FACES_CONNECTED if chunk_index == -1 else chunk_visibility[chunk_index]
+        if not entered[cell] & 64: # First time the chunk is reached
+            entered[cell] |= 64
+            if chunk_index != -1 and mesh_vertices[chunk_index]:
+                visible[count] = chunk_index
+                count += 1
 
-        return True
+        for exit_face in range(6):
+            if steps >> (exit_face ^ 1) & 1: # Back towards the camera
+                continue
+            if face != -1 and not connections >> (6 * face + exit_face) & 1: # No air between the two faces
+                continue
+            dx, dy, dz = FACE_STEPS[exit_face]
+            nx, ny, nz = x + dx, y + dy, z + dz
+            if not (0 <= nx < size_x and 0 <= ny < size_y and 0 <= nz < size_z):
+                continue
+            neighbour = nx + size_x * (nz + size_z * ny)
+            entry_face = exit_face ^ 1 # The neighbour is entered through its opposite face
+            if entered[neighbour] >> entry_face & 1:
+                continue
+            if not is_chunk_on_frustum(nx + low[0], ny + low[1], nz + low[2], position, forward, up, right, factor_x, tan_x, factor_y, tan_y):
+                continue
+            entered[neighbour] |= 1 << entry_face
+            queue_cells[tail] = neighbour
+            queue_faces[tail] = entry_face
+            queue_steps[tail] = steps | 1 << exit_face
+            tail += 1
+    return count
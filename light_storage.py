@@ -0,0 +1,151 @@
+from settings import *
+from voxel_storage import UNIFORM, DENSE
+
+# Compact light storage: every chunk of the chunk table has a slot (int64) that describes how its light is stored, like the
+# slots of voxel_storage.py (the light byte of a voxel is sky light << 4 | block light, consult lighting.py)
+#   uniform  all the voxels have the same light   slot = light << 8
+#   dense    one byte a voxel                     slot = page << 8 | 8, pages[page] is the light of the chunk
+# Most chunks are uniform: the air above the terrain is all under the open sky and the stone under it all in the dark.
+# The flood fills of lighting.py change the light voxel by voxel, so there is no palette: a uniform chunk takes a page the
+# first time one of its voxels gets another light (set_light) and gives it back once it is uniform again (shrink_chunk).
+# The free pages are a stack: free[0] is how many there are, free[1:free[0] + 1] their indices. When there is none left the
+# arrays are replaced by bigger copies, so meshes built on other threads keep reading the old ones (maybe an older light,
+# but the chunks whose light changed are meshed again anyway). A page given back goes to the retired stack (same layout)
+# instead: a mesh built on another thread may have read the old slot and still be reading the page, and a section outside
+# the changed box isn't meshed again, so the page can't hold the light of another chunk yet. The retired pages are only
+# free again once no mesh is being built (consult LightStorage.recycle_pages).
+
+@njit(cache=True)
+def get_light(world_light, chunk_index, voxel_index):
+    """Get the light of a voxel of the chunk in the given row of the chunk table (world_light is LightStorage.arrays)."""
+    slots, pages, _, _ = world_light
+    slot = slots[chunk_index]
+    if slot & 15 == UNIFORM:
+        return (slot >> 8) & 255
+    return pages[slot >> 8, voxel_index]
+
+@njit(nogil=True, cache=True)
+def decode_light_box(world_light, chunk_index, x0, x1, y0, y1, z0, z1, light, start, row, area):
+    """Write the light of a box of a chunk into light, in the layout of decode_box in voxel_storage.py."""
+    slots, pages, _, _ = world_light
+    slot = slots[chunk_index]
+    for y in range(y0, y1):
+        for z in range(z0, z1):
+            i = CHUNK_SIZE * z + CHUNK_AREA * y
+            j = start + row * (z - z0) + area * (y - y0)
+            if slot & 15 == UNIFORM:
+                light[j:j + x1 - x0] = (slot >> 8) & 255
+            else:
+                light[j:j + x1 - x0] = pages[slot >> 8, i + x0:i + x1]
+
+@njit(cache=True)
+def get_page(world_light) -> tuple:
+    """
+    Take a free page, when there is none the arrays are replaced by copies with twice the pages (like push in lighting.py).
+    Returns (world_light, page).
+    """
+    slots, pages, free, retired = world_light
+    if free[0] == 0:
+        bigger = np.empty((max(2 * len(pages), 16), CHUNK_VOL), dtype=np.uint8)
+        bigger[:len(pages)] = pages
+        bigger_free = np.empty(len(bigger) + 1, dtype=np.int64) # Room for all the pages
+        bigger_free[0] = len(bigger) - len(pages)
+        bigger_free[1:len(bigger) - len(pages) + 1] = np.arange(len(bigger) - 1, len(pages) - 1, -1) # The first new page on top
+        bigger_retired = np.zeros(len(bigger) + 1, dtype=np.int64)
+        bigger_retired[:retired[0] + 1] = retired[:retired[0] + 1]
+        slots, pages, free, retired = slots.copy(), bigger, bigger_free, bigger_retired
+        world_light = slots, pages, free, retired
+
+    page = free[free[0]]
+    free[0] -= 1
+    return world_light, page
+
+@njit(cache=True)
+def free_page(world_light, chunk_index, light):
+    """Make a dense chunk uniform with the given light, its page goes to the retired pages (see above)."""
+    slots, _, _, retired = world_light
+    retired[0] += 1
+    retired[retired[0]] = slots[chunk_index] >> 8
+    slots[chunk_index] = np.int64(light) << 8
+
+@njit(cache=True)
+def set_light(world_light, chunk_index, voxel_index, light) -> tuple:
+    """Change the light of a voxel, a uniform chunk takes a page first if it changes. Returns world_light (consult get_page)."""
+    slot = world_light[0][chunk_index]
+    if slot & 15 == UNIFORM:
+        uniform_light = (slot >> 8) & 255
+        if light == uniform_light:
+            return world_light
+        world_light, page = get_page(world_light)
+        world_light[1][page] = uniform_light
+        world_light[0][chunk_index] = page << 8 | DENSE
+        slot = world_light[0][chunk_index]
+    world_light[1][slot >> 8, voxel_index] = light
+    return world_light
+
+@njit(cache=True)
+def store_light(world_light, chunk_index, chunk_light) -> tuple:
+    """Store the light of a whole chunk (CHUNK_VOL uint8), uniform if it can be. Returns world_light (consult get_page)."""
+    slot = world_light[0][chunk_index]
+    light = chunk_light[0]
+    if np.all(chunk_light == light):
+        if slot & 15 == DENSE:
+            free_page(world_light, chunk_index, light)
+        else:
+            world_light[0][chunk_index] = np.int64(light) << 8
+        return world_light
+
+    if slot & 15 == UNIFORM:
+        world_light, page = get_page(world_light)
+        world_light[0][chunk_index] = page << 8 | DENSE
+        slot = world_light[0][chunk_index]
+    world_light[1][slot >> 8] = chunk_light
+    return world_light
+
+@njit(cache=True)
+def shrink_chunk(world_light, chunk_index):
+    """Make a dense chunk uniform if all its voxels have the same light again."""
+    slot = world_light[0][chunk_index]
+    if slot & 15 == UNIFORM:
+        return
+    page = world_light[1][slot >> 8]
+    light = page[0]
+    for voxel_index in range(CHUNK_VOL):
+        if page[voxel_index] != light:
+            return
+    free_page(world_light, chunk_index, light)
+
+class LightStorage:
+    """
+    Light of all the chunks of the chunk table, uniform or dense (see above).
+    The njit functions take arrays and return it, replaced as a whole when they need more pages: store it back in arrays.
+    """
+
+    def __init__(self, num_chunks):
+        self.arrays = (np.zeros(num_chunks, dtype='int64'), # Slots, every chunk starts uniform and dark
+                       np.empty((0, CHUNK_VOL), dtype='uint8'), # Pages, allocated by the first dense chunks
+                       np.zeros(1, dtype='int64'), # Free pages (none)
+                       np.zeros(1, dtype='int64')) # Retired pages (none)
+
+    def recycle_pages(self):
+        """Make the retired pages free again, only call it when no mesh is being built (they may still be reading them)."""
+        _, _, free, retired = self.arrays
+        count = retired[0]
+        free[free[0] + 1:free[0] + count + 1] = retired[1:count + 1]
+        free[0] += count
+        retired[0] = 0
+
+    def get_report(self, chunk_indices) -> dict:
+        """Memory used by the light of the given chunks compared to storing each of them in CHUNK_VOL bytes."""
+        slots, pages, free, retired = self.arrays
+        dense = int(np.sum(slots[chunk_indices] & 15 == DENSE))
+        report = {
+            'chunks': len(chunk_indices),
+            'uniform': len(chunk_indices) - dense,
+            'dense': dense,
+            'dense_bytes': len(chunk_indices) * CHUNK_VOL,
+            'bytes': len(chunk_indices) * slots.itemsize + dense * CHUNK_VOL,
+            'allocated_bytes': slots.nbytes + pages.nbytes + free.nbytes + retired.nbytes, # Including the free and retired pages
+        }
+        report['saved_bytes'] = report['dense_bytes'] - report['bytes']
+        return report
@@ -0,0 +1,304 @@
+from settings import *
+from meshes.chunk_mesh_builder import FULL_LIGHT, get_chunk_index
+from voxel_storage import get_voxel, decode_chunk
+from light_storage import LightStorage, get_light, set_light, store_light, shrink_chunk
+
+# Light of a voxel: one byte, sky light in the high 4 bits and block light (lamps) in the low 4 bits, each 0 to MAX_LIGHT.
+# The two channels are flood filled apart, a channel is chosen by its shift in the byte.
+SKY = 4
+BLOCK = 0
+
+LIGHT_EMISSION = np.zeros(256, dtype='uint8') # Block light emitted by every voxel id
+LIGHT_EMISSION[LAMP] = LAMP_LIGHT
+
+STEPS = np.array([[0, 1, 0], [0, -1, 0], [1, 0, 0], [-1, 0, 0], [0, 0, -1], [0, 0, 1]]) # Neighbours in the order of the face ids (top, bottom, right, left, back, front)
+DOWN = 1 # Step of the neighbour below, the sky light goes down it without getting darker
+
+class Lighting:
+    """
+    Light of every voxel of the chunk table (one byte per voxel, row i of the storage holds the chunk in row i of the chunk table),
+    stored like the voxels: a chunk whose voxels all have the same light only takes its slot (consult light_storage.py).
+    Light only goes through air: the sky light comes down the columns open to the sky at MAX_LIGHT, the lamps emit
+    LAMP_LIGHT, and both spread to the neighbours losing a level per voxel (breadth first flood fill, consult spread_light).
+    A loaded column is lit once (consult light_columns), then every edit only updates the voxels whose light it changes
+    (consult update_voxel), so its cost depends on the light around the edit and not on the size of the world.
+    The mesh builders pack the light of the void voxel in front of every face into the mesh (consult get_padded_light).
+    """
+
+    def __init__(self, world):
+        self.world = world
+        self.light = LightStorage(CHUNK_TABLE_VOL) if LIGHTING else None # None: every face gets FULL_LIGHT
+
+    def get_arrays(self):
+        """What the mesh builders read (consult get_padded_chunk_light), None without lighting."""
+        return None if self.light is None else self.light.arrays
+
+    def recycle_pages(self):
+        """Free the pages the chunks gave back if no mesh is being built, a build may still read them (consult light_storage.py)."""
+        if not self.world.engine.mesh_scheduler.in_flight:
+            self.light.recycle_pages()
+
+    def light_columns(self, chunks):
+        """Light the chunks of the chunk columns just loaded, with the light coming in from the loaded columns around them."""
+        if self.light is None or not chunks:
+            return
+        self.recycle_pages()
+        chunk_indices = np.array([chunk.index for chunk in chunks], dtype='int64')
+        self.light.arrays = light_chunks(chunk_indices, self.light.arrays, self.world.voxels.arrays, self.world.chunk_coords)
+
+    def update_voxel(self, voxel_world_pos):
+        """
+        Update the light after the voxel at the given world position changed (it is already in the voxel storage).
+        Returns the world positions of the first and last corners of the box of the voxels whose light changed, None if none did.
+        """
+        if self.light is None:
+            return None
+        world = self.world
+        x, y, z = voxel_world_pos
+        chunk_index = get_chunk_index((x, y, z), world.chunk_coords)
+        if chunk_index == -1:
+            return None
+
+        self.recycle_pages()
+        box = get_empty_box()
+        self.light.arrays = update_light(chunk_index, x % CHUNK_SIZE + CHUNK_SIZE * (z % CHUNK_SIZE) + CHUNK_AREA * (y % CHUNK_SIZE),
+                                         self.light.arrays, world.voxels.arrays, world.chunk_coords, box)
+        if box[0] > box[3]:
+            return None
+        return glm.ivec3(box[0], box[1], box[2]), glm.ivec3(box[3], box[4], box[5])
+
+def get_empty_box() -> np.array:
+    """Box (first corner, last corner) that grows with add_to_box, the first corner is after the last one until then."""
+    return np.array([1 << 30] * 3 + [-(1 << 30)] * 3, dtype='int64')
+
+@njit(cache=True)
+def get_neighbour(chunk_index, voxel_index, step, chunk_coords) -> tuple:
+    """Row and voxel index of the neighbour of a voxel along one of STEPS, the row is -1 if its chunk isn't loaded."""
+    y, rest = divmod(voxel_index, CHUNK_AREA)
+    z, x = divmod(rest, CHUNK_SIZE)
+    x, y, z = x + STEPS[step, 0], y + STEPS[step, 1], z + STEPS[step, 2]
+    if 0 <= x < CHUNK_SIZE and 0 <= y < CHUNK_SIZE and 0 <= z < CHUNK_SIZE: # Same chunk
+        return chunk_index, x + CHUNK_SIZE * z + CHUNK_AREA * y
+
+    cx, cy, cz = chunk_coords[chunk_index]
+    neighbour = get_chunk_index((cx * CHUNK_SIZE + x, cy * CHUNK_SIZE + y, cz * CHUNK_SIZE + z), chunk_coords)
+    return neighbour, x % CHUNK_SIZE + CHUNK_SIZE * (z % CHUNK_SIZE) + CHUNK_AREA * (y % CHUNK_SIZE)
+
+@njit(cache=True)
+def add_to_box(box, chunk_index, voxel_index, chunk_coords):
+    """Grow the box (consult get_empty_box) to the world position of a voxel."""
+    y, rest = divmod(voxel_index, CHUNK_AREA)
+    z, x = divmod(rest, CHUNK_SIZE)
+    position = chunk_coords[chunk_index, 0] * CHUNK_SIZE + x, chunk_coords[chunk_index, 1] * CHUNK_SIZE + y, chunk_coords[chunk_index, 2] * CHUNK_SIZE + z
+    for axis in range(3):
+        box[axis] = min(box[axis], position[axis])
+        box[axis + 3] = max(box[axis + 3], position[axis])
+
+@njit(cache=True)
+def push(queue, count, value) -> tuple:
+    """Append a value to a queue (its first count entries are used), doubling it when it is full. Returns (queue, count)."""
+    if count == len(queue):
+        bigger = np.empty(2 * len(queue), dtype=queue.dtype)
+        bigger[:count] = queue
+        queue = bigger
+    queue[count] = value
+    return queue, count + 1
+
+@njit(cache=True)
+def spread_light(queue, count, shift, world_light, world_voxels, chunk_coords, box) -> tuple:
+    """
+    Flood fill a channel (SKY or BLOCK) from the voxels in the queue (entries chunk_index * CHUNK_VOL + voxel_index),
+    each lights the air around it at its level - 1 (the sky light at MAX_LIGHT goes down at MAX_LIGHT), unless it is
+    already brighter. A voxel is queued again whenever its light goes up, so the result doesn't depend on the order.
+    Returns world_light (LightStorage.arrays, replaced when it needs more pages, consult get_page in light_storage.py).
+    """
+    keep = 0xF0 >> shift # Bits of the other channel
+    head = 0
+    while head < count:
+        chunk_index, voxel_index = divmod(queue[head], CHUNK_VOL)
+        head += 1
+        level = get_light(world_light, chunk_index, voxel_index) >> shift & 15
+        if level <= 1:
+            continue
+
+        for step in range(6):
+            neighbour, neighbour_index = get_neighbour(chunk_index, voxel_index, step, chunk_coords)
+            if neighbour == -1:
+                continue
+            new_level = level if shift == SKY and step == DOWN and level == MAX_LIGHT else level - 1
+            value = get_light(world_light, neighbour, neighbour_index)
+            if value >> shift & 15 >= new_level or get_voxel(world_voxels, neighbour, neighbour_index): # Already as bright, or solid
+                continue
+            world_light = set_light(world_light, neighbour, neighbour_index, value & keep | new_level << shift)
+            add_to_box(box, neighbour, neighbour_index, chunk_coords)
+            queue, count = push(queue, count, neighbour * CHUNK_VOL + neighbour_index)
+    return world_light
+
+@njit(cache=True)
+def remove_light(removed, count, shift, world_light, world_voxels, chunk_coords, box) -> tuple:
+    """
+    Darken a channel from the voxels in removed (entries (chunk_index * CHUNK_VOL + voxel_index) << 4 | the level they had,
+    already set to 0): the neighbours lit by them (a lower level, or the sky light going down) are set to 0 and removed
+    in turn. The neighbours with a light of their own (a brighter level or a lamp) are returned as (queue, count),
+    spreading them again with spread_light fills the darkened voxels back with the light that still reaches them.
+    Returns (queue, count, world_light).
+    """
+    keep = 0xF0 >> shift
+    respread, respread_count = np.empty(64, dtype='int64'), 0
+    head = 0
+    while head < count:
+        entry, level = removed[head] >> 4, removed[head] & 15
+        chunk_index, voxel_index = divmod(entry, CHUNK_VOL)
+        head += 1
+
+        for step in range(6):
+            neighbour, neighbour_index = get_neighbour(chunk_index, voxel_index, step, chunk_coords)
+            if neighbour == -1:
+                continue
+            value = get_light(world_light, neighbour, neighbour_index)
+            neighbour_level = value >> shift & 15
+            if not neighbour_level:
+                continue
+
+            lit_by_voxel = neighbour_level < level or (shift == SKY and step == DOWN and level == MAX_LIGHT)
+            emits = shift == BLOCK and LIGHT_EMISSION[get_voxel(world_voxels, neighbour, neighbour_index)] >= neighbour_level
+            if lit_by_voxel and not emits:
+                world_light = set_light(world_light, neighbour, neighbour_index, value & keep)
+                add_to_box(box, neighbour, neighbour_index, chunk_coords)
+                removed, count = push(removed, count, (neighbour * CHUNK_VOL + neighbour_index) << 4 | neighbour_level)
+            else:
+                respread, respread_count = push(respread, respread_count, neighbour * CHUNK_VOL + neighbour_index)
+    return respread, respread_count, world_light
+
+@njit(cache=True)
+def update_light(chunk_index, voxel_index, world_light, world_voxels, chunk_coords, box) -> tuple:
+    """
+    Update both channels after a voxel changed: the light it had is removed (consult remove_light), then the light of
+    the voxels around spreads into it if it is air now, and its own light spreads if it is a lamp. Only the voxels whose
+    light changes are visited, box grows to all of them (consult add_to_box). The chunks in the box that are lit
+    uniformly again give their page back. Returns world_light.
+    """
+    voxel_id = get_voxel(world_voxels, chunk_index, voxel_index)
+    entry = chunk_index * CHUNK_VOL + voxel_index
+    for shift in (SKY, BLOCK):
+        value = get_light(world_light, chunk_index, voxel_index)
+        level = value >> shift & 15
+        world_light = set_light(world_light, chunk_index, voxel_index, value & (0xF0 >> shift))
+
+        removed, count = np.empty(64, dtype='int64'), 0
+        if level:
+            removed, count = push(removed, count, entry << 4 | level)
+            add_to_box(box, chunk_index, voxel_index, chunk_coords)
+        queue, queue_count, world_light = remove_light(removed, count, shift, world_light, world_voxels, chunk_coords, box)
+
+        if voxel_id == 0: # The light around comes in
+            for step in range(6):
+                neighbour, neighbour_index = get_neighbour(chunk_index, voxel_index, step, chunk_coords)
+                if neighbour != -1:
+                    queue, queue_count = push(queue, queue_count, neighbour * CHUNK_VOL + neighbour_index)
+                elif shift == SKY and step == 0: # Top of the world, right under the sky
+                    world_light = set_light(world_light, chunk_index, voxel_index, get_light(world_light, chunk_index, voxel_index) | MAX_LIGHT << SKY)
+                    add_to_box(box, chunk_index, voxel_index, chunk_coords)
+                    queue, queue_count = push(queue, queue_count, entry)
+        elif shift == BLOCK and LIGHT_EMISSION[voxel_id]:
+            world_light = set_light(world_light, chunk_index, voxel_index, get_light(world_light, chunk_index, voxel_index) | LIGHT_EMISSION[voxel_id])
+            add_to_box(box, chunk_index, voxel_index, chunk_coords)
+            queue, queue_count = push(queue, queue_count, entry)
+        world_light = spread_light(queue, queue_count, shift, world_light, world_voxels, chunk_coords, box)
+
+    for cy in range(box[1] // CHUNK_SIZE, box[4] // CHUNK_SIZE + 1): # Empty if no light changed
+        for cz in range(box[2] // CHUNK_SIZE, box[5] // CHUNK_SIZE + 1):
+            for cx in range(box[0] // CHUNK_SIZE, box[3] // CHUNK_SIZE + 1):
+                box_chunk = get_chunk_index((cx * CHUNK_SIZE, cy * CHUNK_SIZE, cz * CHUNK_SIZE), chunk_coords)
+                if box_chunk != -1:
+                    shrink_chunk(world_light, box_chunk)
+    return world_light
+
+@njit(cache=True)
+def light_chunks(chunk_indices, world_light, world_voxels, chunk_coords) -> tuple:
+    """
+    Light the chunks in the given rows of the chunk table, whole columns of WORLD_H chunks (ordered by column, any height order).
+    Every column of voxels gets the sky light from the top down to its first solid voxel and the lamps their light, then
+    the voxels next to darker air (and the light at the borders of the loaded columns around) are spread with spread_light.
+    The direct light of a chunk is built in a scratch array and stored at once, uniform if it can be (consult store_light),
+    and the chunks still lit uniformly after the spread give their page back. Returns world_light.
+    """
+    in_batch = np.zeros(len(chunk_coords), dtype='bool')
+    in_batch[chunk_indices] = True
+    voxels = np.empty(CHUNK_VOL, dtype='uint8')
+    chunk_light = np.empty(CHUNK_VOL, dtype='uint8')
+    num_columns = len(chunk_indices) // WORLD_H
+    column_rows = np.empty((num_columns, WORLD_H), dtype='int64') # Row of the chunk at every height of each column
+    sky_heights = np.zeros((num_columns, CHUNK_AREA), dtype='int64') # Lowest world y open to the sky of every column of voxels
+    sky_queue, sky_count = np.empty(1024, dtype='int64'), 0
+    block_queue, block_count = np.empty(64, dtype='int64'), 0
+
+    # direct light, top down along every column of chunks
+    for column in range(num_columns):
+        for chunk_index in chunk_indices[column * WORLD_H:(column + 1) * WORLD_H]:
+            column_rows[column, chunk_coords[chunk_index, 1]] = chunk_index
+        heights = sky_heights[column]
+        is_open = np.ones(CHUNK_AREA, dtype='bool')
+        for cy in range(WORLD_H - 1, -1, -1):
+            chunk_index = column_rows[column, cy]
+            decode_chunk(world_voxels, chunk_index, voxels)
+            for y in range(CHUNK_SIZE - 1, -1, -1):
+                for i in range(CHUNK_AREA):
+                    voxel_index = i + CHUNK_AREA * y
+                    voxel_id = voxels[voxel_index]
+                    if voxel_id == 0 and is_open[i]:
+                        chunk_light[voxel_index] = FULL_LIGHT
+                        continue
+                    if is_open[i]:
+                        is_open[i] = False
+                        heights[i] = cy * CHUNK_SIZE + y + 1
+                    chunk_light[voxel_index] = LIGHT_EMISSION[voxel_id]
+                    if LIGHT_EMISSION[voxel_id]:
+                        block_queue, block_count = push(block_queue, block_count, chunk_index * CHUNK_VOL + voxel_index)
+            world_light = store_light(world_light, chunk_index, chunk_light)
+
+    # the sky light only has to spread sideways from the open voxels next to a closed one: the ones of a column of voxels
+    # below the sky height of a neighbour (the neighbours in other columns of chunks are checked voxel by voxel)
+    for column in range(num_columns):
+        heights = sky_heights[column]
+        for z in range(CHUNK_SIZE):
+            for x in range(CHUNK_SIZE):
+                i = x + CHUNK_SIZE * z
+                top = heights[i]
+                for step in range(2, 6):
+                    neighbour_x, neighbour_z = x + STEPS[step, 0], z + STEPS[step, 2]
+                    if 0 <= neighbour_x < CHUNK_SIZE and 0 <= neighbour_z < CHUNK_SIZE:
+                        top = max(top, heights[neighbour_x + CHUNK_SIZE * neighbour_z])
+                        continue
+                    for y in range(heights[i], WORLD_H * CHUNK_SIZE):
+                        chunk_index, voxel_index = column_rows[column, y // CHUNK_SIZE], i + CHUNK_AREA * (y % CHUNK_SIZE)
+                        neighbour, neighbour_index = get_neighbour(chunk_index, voxel_index, step, chunk_coords)
+                        if neighbour != -1 and get_light(world_light, neighbour, neighbour_index) >> SKY < MAX_LIGHT - 1:
+                            sky_queue, sky_count = push(sky_queue, sky_count, chunk_index * CHUNK_VOL + voxel_index)
+                for y in range(heights[i], top):
+                    sky_queue, sky_count = push(sky_queue, sky_count, column_rows[column, y // CHUNK_SIZE] * CHUNK_VOL + i + CHUNK_AREA * (y % CHUNK_SIZE))
+
+    # the light of the loaded chunks around comes in from the layer that touches the batch
+    for chunk_index in chunk_indices:
+        cx, cy, cz = chunk_coords[chunk_index]
+        for step in range(2, 6):
+            neighbour = get_chunk_index(((cx + STEPS[step, 0]) * CHUNK_SIZE, cy * CHUNK_SIZE, (cz + STEPS[step, 2]) * CHUNK_SIZE), chunk_coords)
+            if neighbour == -1 or in_batch[neighbour]:
+                continue
+            for y in range(CHUNK_SIZE):
+                for j in range(CHUNK_SIZE):
+                    # layer x = 0 or CHUNK_SIZE - 1 (along z) for the neighbours along x, z = 0 or CHUNK_SIZE - 1 for the ones along z
+                    layer = 0 if STEPS[step, 0] + STEPS[step, 2] > 0 else CHUNK_SIZE - 1
+                    voxel_index = (layer + CHUNK_SIZE * j if step < 4 else j + CHUNK_SIZE * layer) + CHUNK_AREA * y
+                    value = get_light(world_light, neighbour, voxel_index)
+                    if value >> SKY > 1:
+                        sky_queue, sky_count = push(sky_queue, sky_count, neighbour * CHUNK_VOL + voxel_index)
+                    if value & 15 > 1:
+                        block_queue, block_count = push(block_queue, block_count, neighbour * CHUNK_VOL + voxel_index)
+
+    box = np.empty(6, dtype='int64') # Not needed, the new chunks and the ones around are meshed again anyway
+    world_light = spread_light(sky_queue, sky_count, SKY, world_light, world_voxels, chunk_coords, box)
+    world_light = spread_light(block_queue, block_count, BLOCK, world_light, world_voxels, chunk_coords, box)
+    for chunk_index in chunk_indices:
+        shrink_chunk(world_light, chunk_index)
+    return world_light
@@ -1,48 +1,44 @@
-try:
-    from settings import *
-    import moderngl as mgl
-    import os
-    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "1" #Hide pygame support prompt
-    import pygame as pg
-    del os
-    import sys
-    from shader_program import ShaderProgram
-    from scene import Scene
-    from player import Player
-    from textures import Textures
-except ImportError as e:
-    import os
-    os.system('pip install -r requirements.txt')
-    from settings import *
-    import moderngl as mgl
-    import os
-    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "1" #Hide pygame support prompt
-    import pygame as pg
-    del os
-    import sys
-    from shader_program import ShaderProgram
-    from scene import Scene
-    from player import Player
-    from textures import Textures
+import time
+START_TIME = time.perf_counter() # Start of the launch, for the startup profiler
+
+from settings import *
+import moderngl as mgl
+import os
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "1" #Hide pygame support prompt
+import pygame as pg
+del os
+import sys
+from shader_program import ShaderProgram
+from scene import Scene
+from player import Player
+from textures import Textures
+from meshes.mesh_scheduler import MeshScheduler
+from meshes.mesh_cache import MeshCache
+from startup_profiler import StartupProfiler
+from frame_profiler import FrameProfiler
 
 class VoxelEngine:
     def __init__(self):
-        pg.init()
+        self.startup_profiler = StartupProfiler(START_TIME)
+        self.startup_profiler.add('imports', time.perf_counter() - START_TIME)
 
-        #Define API version
-        pg.display.gl_set_attribute(pg.GL_CONTEXT_MAJOR_VERSION, MAJOR_VER) 
-        pg.display.gl_set_attribute(pg.GL_CONTEXT_MINOR_VERSION, MINOR_VER)
+        with self.startup_profiler.section('GL setup'):
+            pg.init()
+
+            #Define API version
+            pg.display.gl_set_attribute(pg.GL_CONTEXT_MAJOR_VERSION, MAJOR_VER) 
+            pg.display.gl_set_attribute(pg.GL_CONTEXT_MINOR_VERSION, MINOR_VER)
         
-        pg.display.gl_set_attribute(pg.GL_CONTEXT_PROFILE_MASK, pg.GL_CONTEXT_PROFILE_CORE) #Set core profile (remove deprecated functions)
-        pg.display.gl_set_attribute(pg.GL_DEPTH_SIZE, DEPTH_SIZE) #Set depth size (precision of depth buffer, used to handle depth calculations)
-        pg.display.gl_set_attribute(pg.GL_MULTISAMPLESAMPLES, NUM_SAMPLES) #Set number of samples for multisampling (antialiasing)
+            pg.display.gl_set_attribute(pg.GL_CONTEXT_PROFILE_MASK, pg.GL_CONTEXT_PROFILE_CORE) #Set core profile (remove deprecated functions)
+            pg.display.gl_set_attribute(pg.GL_DEPTH_SIZE, DEPTH_SIZE) #Set depth size (precision of depth buffer, used to handle depth calculations)
+            pg.display.gl_set_attribute(pg.GL_MULTISAMPLESAMPLES, NUM_SAMPLES) #Set number of samples for multisampling (antialiasing)
 
-        pg.display.set_mode(WIN_RES, flags=pg.OPENGL | pg.DOUBLEBUF) #Create pygame window
-        self.ctx = mgl.create_context() #Create ModernGL context
+            pg.display.set_mode(WIN_RES, flags=pg.OPENGL | pg.DOUBLEBUF) #Create pygame window
+            self.ctx = mgl.create_context() #Create ModernGL context
 
-        self.ctx.enable(flags=mgl.DEPTH_TEST | mgl.CULL_FACE | mgl.BLEND) #Enable flags inside of the context just created (depth test: pixels closer to the camera obscure the ones farther away)
-        self.ctx.gc_mode = 'auto' #Set garbage collection to auto                                                           cull face: only render visible faces of objects
-                                                                                                                          # blend: mix colors of objects based on alpha value (enable transparency)
+            self.ctx.enable(flags=mgl.DEPTH_TEST | mgl.CULL_FACE | mgl.BLEND) #Enable flags inside of the context just created (depth test: pixels closer to the camera obscure the ones farther away)
+            self.ctx.gc_mode = 'auto' #Set garbage collection to auto                                                           cull face: only render visible faces of objects
+                                                                                                                              # blend: mix colors of objects based on alpha value (enable transparency)
         self.clock = pg.time.Clock() # Pygame clock object to track time
         self.delta_time = 0 #Time between frames
         self.time = 0 #Time for the start of the program
@@ -56,9 +52,14 @@ class VoxelEngine:
     def on_init(self): 
         """Method that initializes all the necessary objects."""
 
-        self.textures = Textures(self)
-        self.player = Player(self)
-        self.shader_program = ShaderProgram(self)
+        self.frame_profiler = FrameProfiler(self) # Off until the overlay is shown (consult frame_profiler.py for more information)
+        with self.startup_profiler.section('textures'):
+            self.textures = Textures(self)
+        with self.startup_profiler.section('player and shaders'):
+            self.player = Player(self)
+            self.shader_program = ShaderProgram(self)
+        self.mesh_scheduler = MeshScheduler(self)
+        self.mesh_cache = MeshCache() if MESH_CACHE else None
         self.scene = Scene(self)
 
     def update(self):
@@ -67,20 +68,37 @@ class VoxelEngine:
         Should be called each frame.
         """
 
+        profiler = self.frame_profiler
         self.player.update() # Update player position and camera
+        profiler.mark('player.update')
         self.shader_program.update() # Update shaders
+        profiler.mark('shader_program.update')
         self.scene.update() # Update objects in scene
+        profiler.mark('scene.update')
+        if BACKGROUND_MESHING:
+            self.mesh_scheduler.upload() # Upload the meshes built since the last frame (within MESH_UPLOAD_BUDGET_MS)
+            profiler.count('meshes uploaded', self.mesh_scheduler.uploads)
+            profiler.count('mesh bytes uploaded', self.mesh_scheduler.uploaded_bytes)
+            profiler.mark('mesh_scheduler.upload')
 
         self.delta_time = self.clock.tick(MAX_FPS) # Limit FPS
+        profiler.mark('clock.tick (fps limit)')
         self.time = pg.time.get_ticks() * 0.001 # Get current time in seconds
-        pg.display.set_caption(f'{self.clock.get_fps() :.0f}') # Update caption with FPS
+        caption = f'{self.clock.get_fps() :.0f}' # Update caption with FPS
+        if BACKGROUND_MESHING: # and the meshing metrics
+            caption += f' | mesh queue: {self.mesh_scheduler.queue_depth}  upload: {self.mesh_scheduler.upload_time:.2f} ms'
+        pg.display.set_caption(caption)
 
     def render(self):
         """Method that clears the context buffer and renders all objects inside of scene."""
         
         self.ctx.clear(color=BG_COLOR) # Clear the context buffer
-        self.scene.render() # Render the scene
+        self.frame_profiler.mark('ctx.clear')
+        self.scene.render() # Render the scene (marks its own stages)
+        self.frame_profiler.render() # Overlay with the frame timings (if shown)
+        self.frame_profiler.mark('overlay render')
         pg.display.flip() # Swap the buffers
+        self.frame_profiler.mark('pg.display.flip')
 
     def handle_events(self):
         """Method that handles all the events in the game."""
@@ -89,16 +107,25 @@ class VoxelEngine:
             if event.type == pg.QUIT or (event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE):
                 self.is_running = False
             self.player.handle_event(event=event)
+            self.frame_profiler.handle_event(event=event)
 
     def run(self):
         """Method that runs the game loop."""
         while self.is_running:
+            self.frame_profiler.begin_frame()
             self.handle_events()
+            self.frame_profiler.mark('handle_events')
             self.update()
             self.render()
+            self.frame_profiler.end_frame()
+            if not self.startup_profiler.is_finished:
+                self.startup_profiler.finish() # The first frame is on screen
+        if SAVE_ON_EXIT:
+            self.scene.world.save() # Keep the edits for the next launch
         pg.quit()
         sys.exit()
 
 if __name__ == '__main__':
+    remove_stale_jit_caches() # The compiled functions of older sources
     engine = VoxelEngine()
     engine.run()
\ No newline at end of file
@@ -17,7 +17,14 @@ class BaseMesh:
 
     def get_vao(self):
         vertex_data = self.get_vertex_data()
-        vbo = self.ctx.buffer(vertex_data)
+        return self.create_vao(vertex_data)
+
+    def create_vao(self, vertex_data):
+        """Upload the vertex data to the GPU and create the vertex array object (must run on the main thread)."""
+        if len(vertex_data):
+            vbo = self.ctx.buffer(vertex_data)
+        else: # Meshes without visible faces still need a (non empty) buffer, it's smaller than one vertex so nothing is drawn
+            vbo = self.ctx.buffer(reserve=vertex_data.itemsize)
         vao = self.ctx.vertex_array(
             self.program, [(vbo, self.vbo_format, *self.attrs)], skip_errors=True
         )
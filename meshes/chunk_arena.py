@@ -0,0 +1,216 @@
+import bisect
+import moderngl as mgl
+from settings import *
+from meshes.chunk_mesh_builder import FACE_SIZE
+
+BLOCKS_PER_ROW = 64 # Width of the offset texture (one texel per block)
+FACES_PER_ROW = BLOCKS_PER_ROW * ARENA_BLOCK # Width of the face texture (one texel per face), blocks never straddle two rows
+COMMAND_SIZE = 5 # uint32 per indirect command, moderngl reads them with a stride of 20 bytes (count, instances, first, base instance, unused)
+
+class ChunkArena:
+    """
+    Storage shared by the meshes of all the chunks, so the visible chunks are drawn with one vertex array
+    and a single multi-draw call (or one call per run of chunks stored one after the other).
+    The packed faces (consult pack_face in chunk_mesh_builder.py) are the texels of an integer texture: there is no
+    vertex buffer, the vertex shader reads the face of every 6 vertices with gl_VertexID and builds its two triangles.
+    The texture is split into blocks of ARENA_BLOCK faces and every row of the chunk table owns a run of them.
+    The world offset of each block is in a second texture, so no uniform is written between chunks.
+    Freed runs are merged with their free neighbours, when no free run is big enough the meshes are packed
+    into a new texture (twice as big if the arena is more than half full).
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.ctx = engine.ctx
+        self.program = engine.shader_program.chunk
+
+        self.block_bytes = ARENA_BLOCK * FACE_SIZE * 4
+
+        # Block runs of the rows of the chunk table (blocks == 0: the row has nothing on the GPU)
+        self.first_block = np.zeros(CHUNK_TABLE_VOL, dtype='int32')
+        self.blocks = np.zeros(CHUNK_TABLE_VOL, dtype='int32')
+        self.used_blocks = 0
+
+        self.use_indirect = MULTI_DRAW_INDIRECT and self.ctx.version_code >= 430 # glMultiDrawArraysIndirect
+        self.commands = np.zeros([CHUNK_TABLE_VOL, COMMAND_SIZE], dtype='uint32') # At most one command per row
+        self.indirect_buffer = self.ctx.buffer(reserve=self.commands.nbytes) if self.use_indirect else None
+
+        capacity = -(-CHUNK_ARENA_MB * 2 ** 20 // self.block_bytes)
+        self.allocate_textures(-(-capacity // BLOCKS_PER_ROW) * BLOCKS_PER_ROW)
+        self.free_runs = [(0, self.capacity)] # Free runs of blocks (first block, blocks), sorted by first block
+
+    def allocate_textures(self, capacity):
+        """Create the face texture, the vertex array and the offset texture for the given number of blocks."""
+        self.capacity = capacity
+        self.face_texture = self.ctx.texture((FACES_PER_ROW, capacity // BLOCKS_PER_ROW), FACE_SIZE, dtype='u4')
+        self.face_texture.filter = (mgl.NEAREST, mgl.NEAREST) # Integer textures can't be interpolated
+        self.face_framebuffer = self.ctx.framebuffer(color_attachments=[self.face_texture]) # Reads parts of the texture back
+        self.vao = self.ctx.vertex_array(self.program, []) # The vertices have no attributes
+
+        self.block_offsets = np.zeros([capacity, 4], dtype='int32') # World position of the chunk that owns each block
+        self.offset_texture = self.ctx.texture((BLOCKS_PER_ROW, capacity // BLOCKS_PER_ROW), 4, dtype='i4')
+        self.offset_texture.filter = (mgl.NEAREST, mgl.NEAREST) # Integer textures can't be interpolated
+
+    def upload(self, chunk_index, chunk_position, face_data):
+        """Replace the mesh of a row of the chunk table with the packed faces (on the main thread)."""
+        self.release(chunk_index)
+        faces = len(face_data) // FACE_SIZE
+        if not faces:
+            return
+
+        blocks = -(-faces // ARENA_BLOCK)
+        first_block = self.allocate(blocks)
+        self.first_block[chunk_index] = first_block
+        self.blocks[chunk_index] = blocks
+
+        # The faces are written as they are (no staging copy, e.g. a mesh read from the mesh cache goes straight to the texture),
+        # then the end of the last block is zeroed: a zero face has no size, so runs of chunks can be drawn at once
+        self.write_faces(first_block, face_data.reshape(faces, FACE_SIZE))
+        if faces < blocks * ARENA_BLOCK:
+            self.write_faces(first_block, np.zeros([blocks * ARENA_BLOCK - faces, FACE_SIZE], dtype='uint32'), first_face=faces)
+
+        self.block_offsets[first_block:first_block + blocks, :3] = np.array(chunk_position) * CHUNK_SIZE
+        self.write_offsets(first_block, first_block + blocks)
+
+    def release(self, chunk_index):
+        """Give the blocks of a row back to the arena (its chunk was unloaded or is being replaced)."""
+        blocks = int(self.blocks[chunk_index])
+        if not blocks:
+            return
+        self.free(int(self.first_block[chunk_index]), blocks)
+        self.blocks[chunk_index] = 0
+
+    def allocate(self, blocks) -> int:
+        """Take the smallest free run that fits the blocks, packing or growing the arena if none does. Returns the first block."""
+        best = None
+        for i, (first, size) in enumerate(self.free_runs):
+            if size >= blocks and (best is None or size < self.free_runs[best][1]):
+                best = i
+                if size == blocks:
+                    break
+
+        if best is None:
+            capacity = self.capacity
+            while self.used_blocks + blocks > capacity // 2: # Leave room to grow so the arena isn't packed again right away
+                capacity *= 2
+            self.repack(capacity)
+            best = len(self.free_runs) - 1 # After packing the only free run is at the end
+
+        first, size = self.free_runs[best]
+        if size == blocks:
+            del self.free_runs[best]
+        else:
+            self.free_runs[best] = (first + blocks, size - blocks)
+        self.used_blocks += blocks
+        return first
+
+    def free(self, first, blocks):
+        """Add a run of blocks to the free runs, merged with the free runs right before and after it."""
+        self.used_blocks -= blocks
+        i = bisect.bisect(self.free_runs, (first, 0))
+        if i < len(self.free_runs) and self.free_runs[i][0] == first + blocks: # Merge with the next run
+            blocks += self.free_runs.pop(i)[1]
+        if i > 0 and sum(self.free_runs[i - 1]) == first: # Merge with the previous run
+            first, size = self.free_runs.pop(i - 1)
+            blocks += size
+            i -= 1
+        self.free_runs.insert(i, (first, blocks))
+
+    def repack(self, capacity):
+        """Copy the meshes one after the other at the start of a new texture of the given number of blocks (no free run in between)."""
+        old_resources = self.vao, self.face_framebuffer, self.face_texture, self.offset_texture
+        old_offsets = self.block_offsets
+        read_faces = self.read_faces # Reads the old texture
+        self.allocate_textures(capacity)
+
+        block = 0
+        rows = np.flatnonzero(self.blocks)
+        for chunk_index in rows[np.argsort(self.first_block[rows])]: # Same order as before so runs of chunks stay together
+            first, blocks = int(self.first_block[chunk_index]), int(self.blocks[chunk_index])
+            self.write_faces(block, read_faces(first, blocks)) # One mesh at a time, so memory doesn't grow with the arena
+            self.block_offsets[block:block + blocks] = old_offsets[first:first + blocks]
+            self.first_block[chunk_index] = block
+            block += blocks
+
+        self.free_runs = [(block, capacity - block)] if block < capacity else []
+        self.write_offsets(0, capacity)
+        for resource in old_resources:
+            resource.release()
+
+    def read_faces(self, first_block, blocks) -> np.array:
+        """Read the faces of a run of blocks back from the texture."""
+        faces = np.empty([blocks * ARENA_BLOCK, FACE_SIZE], dtype='uint32')
+        first_face = first_block * ARENA_BLOCK
+        for start, end, column, row in get_row_segments(first_face, len(faces)):
+            data = self.face_framebuffer.read(viewport=(column, row, end - start, 1), components=FACE_SIZE, dtype='u4')
+            faces[start:end] = np.frombuffer(data, dtype='uint32').reshape(-1, FACE_SIZE)
+        return faces
+
+    def write_faces(self, first_block, faces, first_face=0):
+        """Upload faces to a run of blocks (from its face first_face on), one write for each row of the texture it spans."""
+        for start, end, column, row in get_row_segments(first_block * ARENA_BLOCK + first_face, len(faces)):
+            self.face_texture.write(faces[start:end], viewport=(column, row, end - start, 1))
+
+    def write_offsets(self, start, end):
+        """Upload the offsets of the blocks from start to end (whole rows of the texture)."""
+        first_row, last_row = start // BLOCKS_PER_ROW, (end - 1) // BLOCKS_PER_ROW
+        rows = self.block_offsets[first_row * BLOCKS_PER_ROW:(last_row + 1) * BLOCKS_PER_ROW]
+        self.offset_texture.write(rows, viewport=(0, first_row, BLOCKS_PER_ROW, last_row - first_row + 1))
+
+    def render(self, visible, mesh_vertices) -> int:
+        """Draw the meshes of the visible rows of the chunk table. Returns the number of draw calls."""
+        commands = get_draw_commands(visible, self.first_block, self.blocks, mesh_vertices, self.commands)
+        if not commands:
+            return 0
+
+        self.face_texture.use(location=4)
+        self.offset_texture.use(location=5)
+        if self.use_indirect:
+            self.indirect_buffer.write(self.commands[:commands])
+            self.vao.render_indirect(self.indirect_buffer, count=commands)
+            return 1
+        for vertices, _, first, _, _ in self.commands[:commands].tolist():
+            self.vao.render(vertices=vertices, first=first)
+        return commands
+
+    def get_report(self) -> dict:
+        """Size of the arena and how much of it is in use."""
+        return {
+            'capacity_mb': self.capacity * self.block_bytes / 2 ** 20, # The face texture
+            'used_mb': self.used_blocks * self.block_bytes / 2 ** 20,
+            'free_runs': len(self.free_runs),
+        }
+
+def get_row_segments(first_face, faces):
+    """Split a run of faces into the parts that are in the same row of the face texture: (start, end, column, row)."""
+    start = 0
+    while start < faces:
+        row, column = divmod(first_face + start, FACES_PER_ROW)
+        end = min(faces, start + FACES_PER_ROW - column)
+        yield start, end, column, row
+        start = end
+
+@njit(cache=True)
+def get_draw_commands(visible, first_block, blocks, mesh_vertices, commands) -> int:
+    """
+    Fill commands with the ranges of vertices (vertices, 1, first vertex, 0, 0) that draw the visible rows of the chunk table.
+    Rows whose blocks follow each other in the arena are drawn by the same command. Returns the number of commands.
+    """
+    block_vertices = ARENA_BLOCK * 6 # 6 vertices per face
+    order = np.argsort(first_block[visible])
+    num_commands = 0
+    end_block = -1 # End of the blocks drawn by the last command
+    for i in order:
+        chunk_index = visible[i]
+        first = first_block[chunk_index]
+        if first == end_block: # Right after the last command: extend it (the zeroed faces in between draw nothing)
+            command = commands[num_commands - 1]
+            command[0] = (first - command[2] // block_vertices) * block_vertices + mesh_vertices[chunk_index]
+        else:
+            command = commands[num_commands]
+            command[0] = mesh_vertices[chunk_index]
+            command[1] = 1
+            command[2] = first * block_vertices
+            num_commands += 1
+        end_block = first + blocks[chunk_index]
+    return num_commands
@@ -1,5 +1,8 @@
+import threading
+import numpy as np
 from meshes.base_mesh import BaseMesh
-from meshes.chunk_mesh_builder import build_chunk_mesh
+from settings import GREEDY_MESHING, BACKGROUND_MESHING, MESH_CACHE, SECTION_SIZE, CHUNK_SECTIONS_W, CHUNK_SECTIONS
+from meshes.chunk_mesh_builder import FACE_SIZE, ALL_FACES_CONNECTED, build_chunk_mesh, build_chunk_mesh_greedy, build_faces, build_lod_faces, get_chunk_rows, get_padded_chunk, get_padded_chunk_light, get_visibility
 
 class ChunkMesh(BaseMesh):
     def __init__(self, chunk):
@@ -9,23 +12,103 @@ class ChunkMesh(BaseMesh):
         self.ctx = self.engine.ctx
         self.program = self.engine.shader_program.chunk
 
-        self.vbo_format = '1u4'
-        self.format_size = sum(int(fmt[:1]) for fmt in self.vbo_format.split())
-        self.attrs = ('packed_data',) # ('packed_data', self.vbo_format) ??? 
-        self.vao = self.get_vao()
+        # Both builders pack every face (or greedy quad) into FACE_SIZE uint32, the vertex shader makes its two triangles
+        self.mesh_builder = build_chunk_mesh_greedy if GREEDY_MESHING else build_chunk_mesh
 
-    def rebuild(self):
-        """Rebuild the mesh data."""
+        # Every section keeps its faces, the mesh in the chunk arena is their concatenation
+        self.section_data = [np.empty(0, dtype='uint32') for _ in range(CHUNK_SECTIONS)]
+        self.dirty_sections = set(range(CHUNK_SECTIONS)) # Sections whose vertex data is out of date
+        self.dirty_lock = threading.Lock() # Guards dirty_sections (edits add to it while a worker takes it)
+        self.build_lock = threading.Lock() # Builds of the same mesh can't overlap, they share section_data
+        self.visibility = ALL_FACES_CONNECTED # Faces connected through air, found by every build and copied to World.chunk_visibility with the mesh
 
-        self.vao = self.get_vao()
+        # Background meshing state (consult mesh_scheduler.py for more information)
+        self.job_pending = False # A job for this mesh is queued and didn't start yet
+        self.requested_version = 0 # Version of the last requested mesh
+        self.uploaded_version = 0 # Version of the mesh on the GPU
+
+        self.rebuild()
+
+    def rebuild(self, sections=None):
+        """
+        Rebuild the mesh data of the given sections (indices, see get_section_index), all of them by default.
+        An empty list of sections only builds the mesh again, e.g. after its level of detail changed (World.update_lods).
+        """
+        with self.dirty_lock:
+            self.dirty_sections.update(range(CHUNK_SECTIONS) if sections is None else sections)
+
+        profiler = self.engine.frame_profiler
+        profiler.count('remeshes')
+        if BACKGROUND_MESHING: # The old mesh stays in the arena until the scheduler uploads the new one
+            self.engine.mesh_scheduler.request(self)
+        else:
+            face_data = self.get_vertex_data()
+            self.upload(face_data)
+            profiler.count('meshes uploaded')
+            profiler.count('mesh bytes uploaded', face_data.nbytes)
+
+    def upload(self, face_data):
+        """Copy the faces into the chunk arena (on the main thread) and write the vertices to draw in the chunk table, used to cull the chunks."""
+        world = self.chunk.world
+        if world.chunks[self.chunk.index] is not self.chunk: # The row holds another chunk, this one was unloaded meanwhile
+            return
+        world.arena.upload(self.chunk.index, self.chunk.position, face_data)
+        world.mesh_vertices[self.chunk.index] = len(face_data) // FACE_SIZE * 6
+        world.chunk_visibility[self.chunk.index] = self.visibility
 
     def get_vertex_data(self):
-        """Get the vertex data for the mesh."""
+        """Get the packed faces of the mesh, only the dirty sections are meshed again."""
+        with self.build_lock:
+            world = self.chunk.world
+            world_voxels = world.voxels.arrays # Same arrays for the whole build, even if they are reallocated meanwhile
+            # The builders read the chunk and the layer of voxels around it from a padded copy, made once per build
+            padded_voxels = get_padded_chunk(self.chunk.position, world_voxels, world.chunk_coords)
+            self.visibility = get_visibility(padded_voxels) # For the occlusion culling (consult frustum.py)
+
+            lod = int(world.chunk_lods[self.chunk.index])
+            if lod: # Far chunk: the whole chunk at a lower resolution, the sections stay dirty until it is near again
+                return build_lod_faces(padded_voxels, lod)
+
+            with self.dirty_lock:
+                sections, self.dirty_sections = self.dirty_sections, set()
+            if not sections:
+                return np.concatenate(self.section_data)
 
-        mesh = build_chunk_mesh( # Numpy array (not explicitly declared because it would require that numpy is imported which is not needed in this file)
-            chunk_voxels=self.chunk.voxels,
-            format_size=self.format_size,
-            chunk_pos=self.chunk.position,
-            world_voxels=self.chunk.world.voxels
+            padded_light = get_padded_chunk_light(self.chunk.position, world.lighting.get_arrays(), world.chunk_coords)
+            cache_key = None
+            if MESH_CACHE and len(sections) == CHUNK_SECTIONS: # Whole chunk: its mesh may be in the cache
+                cache_key = self.engine.mesh_cache.get_key(padded_voxels, padded_light)
+                cached = self.engine.mesh_cache.get(cache_key)
+                if cached:
+                    face_data, self.section_data = cached
+                    return face_data
+
+            solid_rows = get_chunk_rows(padded_voxels) # Shared by the sections
+            for section in sections:
+                self.section_data[section] = self.build_section(section, padded_voxels, solid_rows, padded_light)
+            if cache_key:
+                self.engine.mesh_cache.put(cache_key, self.section_data)
+            return np.concatenate(self.section_data)
+
+    def build_section(self, section, padded_voxels, solid_rows, padded_light) -> np.array:
+        """Mesh a single section of the chunk."""
+        x, y, z = get_section_pos(section)
+
+        return build_faces( # Built in the scratch buffer of the thread, the result is exactly the faces
+            self.mesh_builder,
+            padded_voxels=padded_voxels,
+            solid_rows=solid_rows,
+            padded_light=padded_light,
+            section_pos=(x * SECTION_SIZE, y * SECTION_SIZE, z * SECTION_SIZE),
+            section_size=SECTION_SIZE
         )
-        return mesh
+
+def get_section_index(x, y, z) -> int:
+    """Get the index of the section at the given section coordinates (same order as the voxels of a chunk)."""
+    return x + CHUNK_SECTIONS_W * z + CHUNK_SECTIONS_W * CHUNK_SECTIONS_W * y
+
+def get_section_pos(section) -> tuple:
+    """Get the section coordinates (x, y, z) of the section with the given index."""
+    y, rest = divmod(section, CHUNK_SECTIONS_W * CHUNK_SECTIONS_W)
+    z, x = divmod(rest, CHUNK_SECTIONS_W)
+    return x, y, z
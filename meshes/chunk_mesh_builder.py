@@ -1,225 +1,671 @@
+import threading
 from settings import *
 from numba import uint8
+from chunk_table import get_table_index
+from voxel_storage import decode_box
+from light_storage import decode_light_box
 
-@njit # Use numba to accelerate this function that mainly contains calculations
-def get_ao(local_pos: glm.vec3, world_pos: glm.vec3, world_voxels: np.array, plane: str) -> tuple[int, int, int, int]:
+MESHER_VERSION = 3 # Change it when the output of the builders changes, so the meshes in the cache are built again
+FACE_SIZE = 2 # uint32 per face of a mesh (consult pack_face for more information)
+
+# Voxels read by the builders: the chunk and the layer of voxels around it (also used as the key of the mesh cache)
+PADDED_SIZE = CHUNK_SIZE + 2
+PADDED_AREA = PADDED_SIZE * PADDED_SIZE
+UNLOADED_VOXEL = 255 # Voxels of the chunks that aren't loaded (never void, so no face is built against them)
+FULL_LIGHT = MAX_LIGHT << 4 # Light of a voxel under the open sky (sky light << 4 | block light, consult lighting.py)
+
+@njit(cache=True) # Use numba to accelerate this function that mainly contains calculations
+def get_ao(voxels: np.array, size: int, i: int, plane: str) -> tuple[int, int, int, int]:
     """Generate ambient occlusion values for a voxel face.
 
     Args:
-        local_pos (glm.vec3): Local voxel position.
-        world_pos (glm.vec3): Global voxel position.
-        world_voxels (np array): Voxel data of the world.
+        voxels (np array): Padded cube of voxels (consult get_padded_voxels), the neighbours of a voxel are at fixed offsets.
+        size (int): Voxels along each side of the cube (PADDED_SIZE, or get_lod_size for a downsampled chunk).
+        i (int): Index of the void voxel in front of the face.
         plane (str): Plane of the face. 
 
     Returns:
         tuple: Tuple or four ambient occlusion values (integers) that determine whether ambient occlusion should be applied to that corner or not. 
     """
 
-    x, y, z = local_pos
-    wx, wy, wz = world_pos
+    row, area = size, size * size # Offsets of the next voxel along z and y (along x it's 1)
 
     if plane == 'Y': # Y plane
-        a = is_void((x    , y, z - 1), (wx    , wy, wz - 1), world_voxels)
-        b = is_void((x - 1, y, z - 1), (wx - 1, wy, wz - 1), world_voxels)
-        c = is_void((x - 1, y, z    ), (wx - 1, wy, wz    ), world_voxels)
-        d = is_void((x - 1, y, z + 1), (wx - 1, wy, wz + 1), world_voxels)
-        e = is_void((x    , y, z + 1), (wx    , wy, wz + 1), world_voxels)
-        f = is_void((x + 1, y, z + 1), (wx + 1, wy, wz + 1), world_voxels)
-        g = is_void((x + 1, y, z    ), (wx + 1, wy, wz    ), world_voxels)
-        h = is_void((x + 1, y, z - 1), (wx + 1, wy, wz - 1), world_voxels)
+        a = not voxels[i     - row]
+        b = not voxels[i - 1 - row]
+        c = not voxels[i - 1      ]
+        d = not voxels[i - 1 + row]
+        e = not voxels[i     + row]
+        f = not voxels[i + 1 + row]
+        g = not voxels[i + 1      ]
+        h = not voxels[i + 1 - row]
 
     elif plane == 'X': # X plane
-        a = is_void((x, y    , z - 1), (wx, wy    , wz - 1), world_voxels)
-        b = is_void((x, y - 1, z - 1), (wx, wy - 1, wz - 1), world_voxels)
-        c = is_void((x, y - 1, z    ), (wx, wy - 1, wz    ), world_voxels)
-        d = is_void((x, y - 1, z + 1), (wx, wy - 1, wz + 1), world_voxels)
-        e = is_void((x, y    , z + 1), (wx, wy    , wz + 1), world_voxels)
-        f = is_void((x, y + 1, z + 1), (wx, wy + 1, wz + 1), world_voxels)
-        g = is_void((x, y + 1, z    ), (wx, wy + 1, wz    ), world_voxels)
-        h = is_void((x, y + 1, z - 1), (wx, wy + 1, wz - 1), world_voxels)
+        a = not voxels[i - row       ]
+        b = not voxels[i - row - area]
+        c = not voxels[i       - area]
+        d = not voxels[i + row - area]
+        e = not voxels[i + row       ]
+        f = not voxels[i + row + area]
+        g = not voxels[i       + area]
+        h = not voxels[i - row + area]
 
     else:  # Z plane
-        a = is_void((x - 1, y    , z), (wx - 1, wy    , wz), world_voxels)
-        b = is_void((x - 1, y - 1, z), (wx - 1, wy - 1, wz), world_voxels)
-        c = is_void((x    , y - 1, z), (wx    , wy - 1, wz), world_voxels)
-        d = is_void((x + 1, y - 1, z), (wx + 1, wy - 1, wz), world_voxels)
-        e = is_void((x + 1, y    , z), (wx + 1, wy    , wz), world_voxels)
-        f = is_void((x + 1, y + 1, z), (wx + 1, wy + 1, wz), world_voxels)
-        g = is_void((x    , y + 1, z), (wx    , wy + 1, wz), world_voxels)
-        h = is_void((x - 1, y + 1, z), (wx - 1, wy + 1, wz), world_voxels)
+        a = not voxels[i - 1       ]
+        b = not voxels[i - 1 - area]
+        c = not voxels[i     - area]
+        d = not voxels[i + 1 - area]
+        e = not voxels[i + 1       ]
+        f = not voxels[i + 1 + area]
+        g = not voxels[i     + area]
+        h = not voxels[i - 1 + area]
 
     ao: tuple[int, int, int, int] = (a + b + c), (g + h + a), (e + f + g), (c + d + e)
     return ao
 
 
-@njit
-def pack_data(x, y, z, voxel_id, face_id, ao_id, flipped):
+@njit(cache=True)
+def pack_face(x, y, z, voxel_id, face_id, ao, flipped, width=1, height=1, light=FULL_LIGHT):
     """
-    Function to pack voxel data.
+    Function to pack a face (or a greedy quad) into two uint32, the vertex shader builds its 6 vertices from them.
+    (x, y, z) is its first corner (corner 0 of build_chunk_mesh), width and height its size in voxels along the texture u and v axes.
+    light is the light of the void voxel in front of the face.
     """
 
-    # x: 6bit  y: 6bit  z: 6bit  voxel_id: 8bit  face_id: 3bit  ao_id: 2bit  flipped: 1bit (boolean)
-    a, b, c, d, e, f, g = x, y, z, voxel_id, face_id, ao_id, flipped
-
-    b_bit, c_bit, d_bit, e_bit, f_bit, g_bit = 6, 6, 8, 3, 2, 1
-    fg_bit = f_bit + g_bit
-    efg_bit = e_bit + fg_bit
-    defg_bit = d_bit + efg_bit
-    cdefg_bit = c_bit + defg_bit
-    bcdefg_bit = b_bit + cdefg_bit
-
-    packed_data = (
-        a << bcdefg_bit |
-        b << cdefg_bit |
-        c << defg_bit |
-        d << efg_bit |
-        e << fg_bit |
-        f << g_bit | g
-    )
-    return packed_data
+    # x: 6bit  y: 6bit  z: 6bit  voxel_id: 8bit  face_id: 3bit  flipped: 1bit (boolean)
+    face = x << 24 | y << 18 | z << 12 | voxel_id << 4 | face_id << 1 | flipped
+    # light: 8bit (sky: 4bit  block: 4bit)  ao: 4 x 2bit (one per corner)  width: 6bit  height: 6bit
+    shape = light << 20 | ao[0] << 18 | ao[1] << 16 | ao[2] << 14 | ao[3] << 12 | width << 6 | height
+    return face, shape
 
-@njit
-def get_chunk_index(world_voxel_pos):
+@njit(cache=True)
+def get_chunk_index(world_voxel_pos, chunk_coords):
     wx, wy, wz = world_voxel_pos
-    cx = wx // CHUNK_SIZE
+    cx = wx // CHUNK_SIZE # Floor division, works with negative coordinates too
     cy = wy // CHUNK_SIZE
     cz = wz // CHUNK_SIZE
-    if not (0 <= cx < WORLD_W and 0 <= cy < WORLD_H and 0 <= cz < WORLD_D):
+
+    if not STREAMING_WORLD: # The chunk table is the whole world: a bounds check is enough (and much faster than wrapping the coordinates)
+        if not (0 <= cx < WORLD_W and 0 <= cy < WORLD_H and 0 <= cz < WORLD_D):
+            return -1
+        return cx + WORLD_W * cz + WORLD_AREA * cy
+
+    if not 0 <= cy < WORLD_H:
         return -1
 
-    index = cx + WORLD_W * cz + WORLD_AREA * cy
+    index = get_table_index(cx, cy, cz)
+    if chunk_coords[index, 0] != cx or chunk_coords[index, 2] != cz: # The row holds another chunk (or none)
+        return -1
     return index
 
-@njit
-def is_void(local_voxel_pos, world_voxel_pos, world_voxels):
-    chunk_index = get_chunk_index(world_voxel_pos)
-    if chunk_index == -1:
-        return False
-    chunk_voxels = world_voxels[chunk_index]
+@njit(cache=True)
+def get_halo_box(dx, dy, dz) -> tuple:
+    """
+    Local box (x0, x1, y0, y1, z0, z1, ends excluded) of the neighbour at chunk offset (dx, dy, dz) that touches the chunk
+    (all of it for the chunk itself) and the padded index of its first voxel (consult get_padded_voxels).
+    """
+    x0, x1 = (CHUNK_SIZE - 1, CHUNK_SIZE) if dx < 0 else ((0, 1) if dx > 0 else (0, CHUNK_SIZE))
+    y0, y1 = (CHUNK_SIZE - 1, CHUNK_SIZE) if dy < 0 else ((0, 1) if dy > 0 else (0, CHUNK_SIZE))
+    z0, z1 = (CHUNK_SIZE - 1, CHUNK_SIZE) if dz < 0 else ((0, 1) if dz > 0 else (0, CHUNK_SIZE))
+    start = (x0 + 1 + dx * CHUNK_SIZE) + PADDED_SIZE * (z0 + 1 + dz * CHUNK_SIZE) + PADDED_AREA * (y0 + 1 + dy * CHUNK_SIZE)
+    return x0, x1, y0, y1, z0, z1, start
+
+@njit(nogil=True, cache=True)
+def get_halo(chunk_pos, chunk_coords) -> list:
+    """
+    The chunk and the layer of each of its 26 neighbours that touches it, as (chunk index (-1 if not loaded), x0, x1, y0, y1,
+    z0, z1, start) with the box and padded index of get_halo_box. The chunk table is only looked up here, once per neighbour,
+    so the padded copies of the voxels and of the light (get_padded_voxels, get_padded_light) walk the same boxes.
+    """
+    cx, cy, cz = chunk_pos
+    halo = []
+    for dy in range(-1, 2):
+        for dz in range(-1, 2):
+            for dx in range(-1, 2):
+                # the chunk itself (d = 0) or the layer of the neighbour that touches it
+                chunk_index = get_chunk_index(((cx + dx) * CHUNK_SIZE, (cy + dy) * CHUNK_SIZE, (cz + dz) * CHUNK_SIZE), chunk_coords)
+                x0, x1, y0, y1, z0, z1, start = get_halo_box(dx, dy, dz)
+                halo.append((int(chunk_index), x0, x1, y0, y1, z0, z1, start))
+    return halo
+
+@njit(nogil=True, cache=True)
+def fill_box(padded, x0, x1, y0, y1, z0, z1, start, value):
+    """Fill a box of a padded copy (layout of get_padded_voxels) with value, for the neighbours that aren't loaded."""
+    for y in range(y1 - y0):
+        for z in range(z1 - z0):
+            j = start + PADDED_SIZE * z + PADDED_AREA * y
+            padded[j:j + x1 - x0] = value
+
+@njit(nogil=True, cache=True)
+def get_padded_voxels(chunk_pos, world_voxels, chunk_coords, padded_voxels):
+    """
+    Copy the voxels of the chunk and the layer of voxels of the 26 neighbours that touch it into padded_voxels
+    (PADDED_SIZE ** 3 uint8), the voxel at local position (x, y, z) goes to (x + 1) + PADDED_SIZE * (z + 1) + PADDED_AREA * (y + 1).
+    The builders find the neighbours of a voxel (in the chunk or not) at fixed offsets. The neighbours that aren't loaded
+    get UNLOADED_VOXEL.
+    """
+    for chunk_index, x0, x1, y0, y1, z0, z1, start in get_halo(chunk_pos, chunk_coords):
+        if chunk_index != -1:
+            decode_box(world_voxels, chunk_index, x0, x1, y0, y1, z0, z1, padded_voxels, start, PADDED_SIZE, PADDED_AREA)
+        else:
+            fill_box(padded_voxels, x0, x1, y0, y1, z0, z1, start, UNLOADED_VOXEL)
+
+@njit(nogil=True, cache=True)
+def get_padded_light(chunk_pos, world_light, chunk_coords, padded_light):
+    """
+    Copy the light of the chunk and of the layer around it (world_light is LightStorage.arrays, consult light_storage.py)
+    into padded_light, in the layout of get_padded_voxels. The chunks that aren't loaded get FULL_LIGHT.
+    """
+    for chunk_index, x0, x1, y0, y1, z0, z1, start in get_halo(chunk_pos, chunk_coords):
+        if chunk_index != -1:
+            decode_light_box(world_light, chunk_index, x0, x1, y0, y1, z0, z1, padded_light, start, PADDED_SIZE, PADDED_AREA)
+        else:
+            fill_box(padded_light, x0, x1, y0, y1, z0, z1, start, FULL_LIGHT)
+
+@njit(cache=True)
+def add_face(face_data, index, x, y, z, voxel_id, face_id, ao, flipped, width=1, height=1, light=FULL_LIGHT):
+    face_data[index], face_data[index + 1] = pack_face(x, y, z, voxel_id, face_id, ao, flipped, width, height, light)
+    return index + FACE_SIZE
+
+def get_ao_table(plane) -> np.array:
+    """
+    Ambient occlusion of a face for every combination of solid voxels around the void voxel in front of it (consult get_ao):
+    bit u + 3 * v of the index is the voxel at (u - 1, v - 1) along the two axes of the plane, x and z for the Y plane,
+    z and y for the X plane, x and y for the Z plane. Entries are the ao bits of the second uint32 of a packed face
+    (consult pack_face) with the flipped flag in bit 0.
+    """
+    table = np.empty(512, dtype='uint32')
+    voxels = np.zeros(27, dtype='uint8') # 3 x 3 x 3 voxels, the void voxel in the middle (index 13, get_ao doesn't read it)
+    for index in range(512):
+        for v in range(3):
+            for u in range(3):
+                solid = index >> (u + 3 * v) & 1
+                if plane == 'Y':
+                    voxels[u + 3 * v + 9] = solid
+                elif plane == 'X':
+                    voxels[1 + 3 * u + 9 * v] = solid
+                else:
+                    voxels[u + 3 + 9 * v] = solid
+        ao = get_ao(voxels, 3, 13, plane)
+        flipped = ao[1] + ao[3] > ao[0] + ao[2]
+        table[index] = pack_face(0, 0, 0, 0, 0, ao, flipped, 0, 0, 0)[1] | flipped
+    return table
+
+AO_TABLES = np.stack([get_ao_table(plane) for plane in ('Y', 'X', 'Z')]) # Indexed [plane (Y, X, Z), neighbourhood]
+
+FACE_OFFSETS = np.array([PADDED_AREA, -PADDED_AREA, 1, -1, -PADDED_SIZE, PADDED_SIZE]) # Padded index of the voxel in front of each face, from the voxel
+
+# Constants of get_solid_rows (8 voxels are read at once as the bytes of a uint64)
+BYTE_LOW_BITS = np.uint64(0x0101010101010101) # Bit 0 of every byte
+GATHER_BYTES = np.uint64(0x0102040810204080) # Multiplying by it moves bit 0 of byte n to bit 56 + n
+SOLID_WORDS = PADDED_SIZE ** 3 // 64 + 2 # uint64 holding a bit per padded voxel, and a word more for the reads of the last row
+
+@njit(cache=True)
+def get_trailing_zeros(bits) -> int:
+    """Index of the lowest set bit (bits != 0), the lowest bit alone is a power of two so its log2 is exact."""
+    return int(math.log2(bits & -bits))
+
+@njit(nogil=True, cache=True)
+def get_solid_rows(padded_voxels, solid_bits, solid_rows):
+    """
+    Fill solid_rows (PADDED_AREA int64) with a bitmask of the solid voxels of every row along x of padded_voxels:
+    bit x of solid_rows[y * PADDED_SIZE + z] is the voxel at padded_voxels[x + PADDED_SIZE * z + PADDED_AREA * y]
+    (so a row is its padded index // PADDED_SIZE, the rows next to it along z and y are 1 and PADDED_SIZE away).
+    The voxels are first packed into solid_bits (SOLID_WORDS uint64), 8 voxels at a time: the bytes of a uint64 are folded
+    into their bit 0 and gathered into 8 bits with a multiplication. PADDED_SIZE must be at most 63 (CHUNK_SIZE 61).
+    """
+    words = padded_voxels.view(np.uint64) # PADDED_SIZE is even, so the padded voxels are whole uint64 (little endian)
+    solid_bytes = solid_bits.view(np.uint8)
+    for k in range(len(words)):
+        word = words[k]
+        word |= word >> np.uint64(4) # Bit 0 of a byte is set if any bit of the byte is set
+        word |= word >> np.uint64(2)
+        word |= word >> np.uint64(1)
+        solid_bytes[k] = ((word & BYTE_LOW_BITS) * GATHER_BYTES) >> np.uint64(56)
+
+    row_mask = (1 << PADDED_SIZE) - 1
+    for row in range(PADDED_AREA):
+        start = row * PADDED_SIZE
+        word, shift = start >> 6, np.uint64(start & 63)
+        bits = solid_bits[word] >> shift
+        if shift: # The row starts inside a word and ends in the next one
+            bits |= solid_bits[word + 1] << (np.uint64(64) - shift)
+        solid_rows[row] = np.int64(bits) & row_mask
+
+@njit(cache=True)
+def get_face_ao(solid_rows, row, x, face_id) -> int:
+    """Entry of AO_TABLES of a face of the voxel at the padded position x of a row of get_solid_rows."""
+    if face_id < 2: # Y plane: the layer above (below), 3 bits along x from each of the rows z - 1, z and z + 1
+        row += PADDED_SIZE if face_id == 0 else -PADDED_SIZE
+        index = (solid_rows[row - 1] >> (x - 1) & 7) | (solid_rows[row] >> (x - 1) & 7) << 3 | (solid_rows[row + 1] >> (x - 1) & 7) << 6
+        return AO_TABLES[0, index]
+    if face_id < 4: # X plane: one bit (the voxel after or before) from each of the 9 rows around
+        x += 1 if face_id == 2 else -1
+        index = 0
+        for v in range(3):
+            for u in range(3):
+                index |= (solid_rows[row + (v - 1) * PADDED_SIZE + u - 1] >> x & 1) << (u + 3 * v)
+        return AO_TABLES[1, index]
+    # Z plane: the row behind (in front), 3 bits along x from each of the layers y - 1, y and y + 1
+    row += -1 if face_id == 4 else 1
+    index = (solid_rows[row - PADDED_SIZE] >> (x - 1) & 7) | (solid_rows[row] >> (x - 1) & 7) << 3 | (solid_rows[row + PADDED_SIZE] >> (x - 1) & 7) << 6
+    return AO_TABLES[2, index]
+
+@njit(cache=True)
+def get_exposed_faces(solid_rows, row) -> tuple:
+    """Bitmasks of the solid voxels of a row of get_solid_rows whose top, bottom, right, left, back and front face is void."""
+    solid = solid_rows[row]
+    return (solid & ~solid_rows[row + PADDED_SIZE], solid & ~solid_rows[row - PADDED_SIZE], solid & ~(solid >> 1),
+            solid & ~(solid << 1), solid & ~solid_rows[row - 1], solid & ~solid_rows[row + 1])
+
+@njit(nogil=True, cache=True) # Releases the GIL so chunks can be meshed on several threads at once
+def build_chunk_mesh(padded_voxels, solid_rows, padded_light, face_data, section_pos=(0, 0, 0), section_size=CHUNK_SIZE) -> int:
+    """
+    Build the mesh of the cube of section_size voxels starting at the local position section_pos (the whole chunk by default).
+    The voxels are read from padded_voxels (the chunk with the layer of its neighbours, consult get_padded_voxels)
+    and from its bitmasks of solid voxels solid_rows (consult get_solid_rows), computed once for all the sections.
+    Every face gets the light of the void voxel in front of it from padded_light (consult get_padded_light).
+    The void faces of a whole row are found with a few shifts and ANDs of the bitmasks, so only the voxels with a void face
+    are visited, and the ambient occlusion of a face is read from AO_TABLES with the 3 x 3 voxels around it.
+    The packed faces (FACE_SIZE uint32 each) are written at the start of face_data (at least get_scratch_size(section_size) uint32),
+    returns the number of uint32 written. Consult build_faces for a copy of exactly the faces.
+    """
+    index: int = 0
+    sx, sy, sz = section_pos
+    inside = ((1 << section_size) - 1) << (sx + 1) # Bits of the voxels of the section in a row
+
+    for y in range(sy, sy + section_size):
+        for z in range(sz, sz + section_size):
+            row = (y + 1) * PADDED_SIZE + z + 1
+            faces = get_exposed_faces(solid_rows, row)
+            exposed = (faces[0] | faces[1] | faces[2] | faces[3] | faces[4] | faces[5]) & inside
+
+            while exposed: # Voxels with a void face, along the row
+                i = get_trailing_zeros(exposed) # Padded x
+                exposed &= exposed - 1
+                x = i - 1
+                voxel_id = padded_voxels[i + PADDED_SIZE * row]
+
+                # format: first corner, voxel_id, face_id, light, ao of the corners, flipped (consult pack_face, the ao and flipped bits come from AO_TABLES)
+                for face_id in range(6):
+                    if faces[face_id] >> i & 1:
+                        ao = get_face_ao(solid_rows, row, i, face_id)
+                        light = padded_light[i + PADDED_SIZE * row + FACE_OFFSETS[face_id]]
+                        fx, fy, fz = x + (face_id == 2), y + (face_id == 0), z + (face_id == 5)
+                        face_data[index] = fx << 24 | fy << 18 | fz << 12 | voxel_id << 4 | face_id << 1 | (ao & 1)
+                        face_data[index + 1] = light << 20 | (ao & ~1) | 1 << 6 | 1
+                        index += FACE_SIZE
 
-    x, y, z = local_voxel_pos
-    voxel_index = x % CHUNK_SIZE + z % CHUNK_SIZE * CHUNK_SIZE + y % CHUNK_SIZE * CHUNK_AREA
+    return index
 
-    if chunk_voxels[voxel_index]:
-        return False
-    return True
+@njit(cache=True)
+def get_face_voxel(face_id, s, u, v):
+    """Convert the (slice, u, v) coordinates of a face plane into local voxel coordinates."""
+    if face_id < 2: # Y faces: u along x, v along z
+        return u, s, v
+    elif face_id < 4: # X faces: u along z, v along y
+        return s, v, u
+    else: # Z faces: u along x, v along y
+        return u, v, s
+
+@njit(cache=True)
+def add_greedy_quad(face_data, index, x, y, z, width, height, face_id, key):
+    """Add a quad that covers width x height voxel faces starting from voxel (x, y, z)."""
+    light = key >> 17
+    voxel_id = (key >> 9) & 255
+    ao = (key >> 7) & 3, (key >> 5) & 3, (key >> 3) & 3, (key >> 1) & 3
+    flipped = key & 1
+
+    # first corner like in build_chunk_mesh
+    if face_id < 2:
+        y += 1 - face_id
+    elif face_id < 4:
+        x += 3 - face_id
+    else:
+        z += face_id - 4
+    return add_face(face_data, index, x, y, z, voxel_id, face_id, ao, flipped, width, height, light)
+
+@njit(nogil=True, cache=True)
+def build_chunk_mesh_greedy(padded_voxels, solid_rows, padded_light, face_data, section_pos=(0, 0, 0), section_size=CHUNK_SIZE) -> int:
+    """
+    Greedy version of build_chunk_mesh: coplanar faces with the same voxel id, light and ambient occlusion are merged into larger quads.
+    Every quad also carries its size so that the texture can be tiled. Quads don't cross the borders of the section.
+    """
+    sx, sy, sz = section_pos
+    face_keys = np.zeros((6, section_size, section_size, section_size), dtype='int32') # indexed [face_id, slice, u, v] relative to the section
+
+    inside = ((1 << section_size) - 1) << (sx + 1)
+
+    # collect the keys of all the visible faces (only the voxels with a void face are visited, consult build_chunk_mesh)
+    for y in range(sy, sy + section_size):
+        for z in range(sz, sz + section_size):
+            row = (y + 1) * PADDED_SIZE + z + 1
+            faces = get_exposed_faces(solid_rows, row)
+            exposed = (faces[0] | faces[1] | faces[2] | faces[3] | faces[4] | faces[5]) & inside
+
+            while exposed:
+                i = get_trailing_zeros(exposed)
+                exposed &= exposed - 1
+                voxel_id = padded_voxels[i + PADDED_SIZE * row]
+                lx, ly, lz = i - 1 - sx, y - sy, z - sz # Position in the section
+
+                # face keys are stored in [face_id, slice, u, v] order (see get_face_voxel)
+                for face_id in range(6):
+                    if faces[face_id] >> i & 1:
+                        ao = get_face_ao(solid_rows, row, i, face_id)
+                        light = padded_light[i + PADDED_SIZE * row + FACE_OFFSETS[face_id]]
+                        key = light << 17 | voxel_id << 9 | ao >> 11 | (ao & 1) # light: 8bit  voxel_id: 8bit  ao: 4 x 2bit  flipped: 1bit
+                        if face_id < 2:
+                            face_keys[face_id, ly, lx, lz] = key
+                        elif face_id < 4:
+                            face_keys[face_id, lx, lz, ly] = key
+                        else:
+                            face_keys[face_id, lz, lx, ly] = key
+
+    return merge_face_keys(face_keys, face_data, section_pos, section_size)
+
+@njit(nogil=True, cache=True)
+def merge_face_keys(face_keys, face_data, section_pos, section_size) -> int:
+    """
+    Merge the faces collected by build_chunk_mesh_greedy (face_keys, indexed [face_id, slice, u, v], 0 where there is no face)
+    into quads and write them to face_data, returns the number of uint32 written. face_keys is cleared.
+    """
+    index: int = 0
+    sx, sy, sz = section_pos
+
+    for face_id in range(6):
+        # corner that is one step along u from corner 0 (see the corners in shaders/chunk.vert)
+        u_corner = 1 if face_id < 2 else 3
+        v_corner = 4 - u_corner
+
+        for s in range(section_size):
+            mask = face_keys[face_id, s]
+
+            # merge them into quads
+            for v in range(section_size):
+                for u in range(section_size):
+                    key = mask[u, v]
+                    if not key:
+                        continue
+
+                    # only grow along an axis if the ao does not change along it (the shading stays the same)
+                    ao = (key >> 7) & 3, (key >> 5) & 3, (key >> 3) & 3, (key >> 1) & 3
+                    grow_u = ao[0] == ao[u_corner] and ao[v_corner] == ao[2]
+                    grow_v = ao[0] == ao[v_corner] and ao[u_corner] == ao[2]
+
+                    width = 1
+                    if grow_u:
+                        while u + width < section_size and mask[u + width, v] == key:
+                            width += 1
+
+                    height = 1
+                    if grow_v:
+                        while v + height < section_size:
+                            row_matches = True
+                            for iu in range(width):
+                                if mask[u + iu, v + height] != key:
+                                    row_matches = False
+                                    break
+                            if not row_matches:
+                                break
+                            height += 1
+
+                    # mark the merged faces as done
+                    for iu in range(width):
+                        for iv in range(height):
+                            mask[u + iu, v + iv] = 0
+
+                    x, y, z = get_face_voxel(face_id, s, u, v)
+                    x, y, z = x + sx, y + sy, z + sz # back to chunk coordinates
+                    index = add_greedy_quad(face_data, index, x, y, z, width, height, face_id, key)
 
-@njit
-def add_data(vertex_data, index, *vertices):
-    for vertex in vertices:
-        vertex_data[index] = vertex
-        index += 1
     return index
 
-@njit
-def build_chunk_mesh(chunk_voxels, format_size, chunk_pos, world_voxels) -> np.array:
-    vertex_data: np.array = np.empty(CHUNK_VOL * 18 * format_size, dtype='uint32')
+@njit(cache=True)
+def get_lod_size(lod) -> int:
+    """Cells along each side of a chunk downsampled to the given level of detail, with the layer of its neighbours."""
+    return (CHUNK_SIZE >> lod) + 2
+
+@njit(cache=True)
+def get_cell_range(cell, cells, scale) -> tuple:
+    """Local voxels (start, end) along an axis of a cell of a downsampled chunk (cells -1 and cells are the layer of the neighbours)."""
+    if cell < 0:
+        return -1, 0
+    if cell >= cells:
+        return CHUNK_SIZE, CHUNK_SIZE + 1
+    return cell * scale, cell * scale + scale
+
+@njit(cache=True)
+def get_top_voxel(padded_voxels, x0, x1, y0, y1, z0, z1) -> int:
+    """Id of the highest solid voxel of a box of padded_voxels (local coordinates), 0 if they are all air."""
+    for y in range(y1 - 1, y0 - 1, -1):
+        for z in range(z0, z1):
+            for x in range(x0, x1):
+                voxel_id = padded_voxels[(x + 1) + PADDED_SIZE * (z + 1) + PADDED_AREA * (y + 1)]
+                if voxel_id:
+                    return voxel_id
+    return 0
+
+@njit(cache=True)
+def is_filled(padded_voxels, x0, x1, y0, y1, z0, z1) -> bool:
+    """Check if all the voxels of a box of padded_voxels (local coordinates) are solid."""
+    for y in range(y0, y1):
+        for z in range(z0, z1):
+            for x in range(x0, x1):
+                if not padded_voxels[(x + 1) + PADDED_SIZE * (z + 1) + PADDED_AREA * (y + 1)]:
+                    return False
+    return True
+
+@njit(nogil=True, cache=True)
+def downsample_voxels(padded_voxels, lod, lod_voxels):
+    """
+    Downsample the voxels of a chunk (padded_voxels, consult get_padded_voxels) into cubes of 2 ** lod voxels.
+    lod_voxels gets them with a layer of cells around the chunk, like padded_voxels (get_lod_size(lod) ** 3 uint8).
+    A cube is solid if any of its voxels is, so the mesh covers everything the full resolution one does, and takes the id
+    of its highest voxel (the one seen from above). A cell of the neighbours is solid only if all their voxels that touch
+    it are: a face on the border of the chunk is hidden only where the neighbour covers it at every level of detail,
+    so there are no holes between chunks of different levels and a mesh doesn't depend on the level of its neighbours.
+    """
+    cells, scale, size = CHUNK_SIZE >> lod, 1 << lod, get_lod_size(lod)
+    for cy in range(-1, cells + 1):
+        y0, y1 = get_cell_range(cy, cells, scale)
+        for cz in range(-1, cells + 1):
+            z0, z1 = get_cell_range(cz, cells, scale)
+            for cx in range(-1, cells + 1):
+                x0, x1 = get_cell_range(cx, cells, scale)
+                if 0 <= cx < cells and 0 <= cy < cells and 0 <= cz < cells:
+                    voxel_id = get_top_voxel(padded_voxels, x0, x1, y0, y1, z0, z1)
+                else: # The layer of voxels of the neighbour
+                    voxel_id = UNLOADED_VOXEL if is_filled(padded_voxels, x0, x1, y0, y1, z0, z1) else 0
+                lod_voxels[(cx + 1) + size * (cz + 1) + size * size * (cy + 1)] = voxel_id
+
+@njit(nogil=True, cache=True)
+def build_lod_mesh(lod_voxels, lod, face_data) -> int:
+    """
+    Build the mesh of a downsampled chunk (lod_voxels, consult downsample_voxels): one quad of 2 ** lod x 2 ** lod voxels
+    per visible face of a cube, in the same packed format as build_chunk_mesh. Returns the number of uint32 written.
+    """
     index: int = 0
+    cells, scale, size = CHUNK_SIZE >> lod, 1 << lod, get_lod_size(lod)
+    area = size * size
+
+    for x in range(1, cells + 1): # Padded coordinates
+        for y in range(1, cells + 1):
+            for z in range(1, cells + 1):
+                i = x + size * z + area * y
+                voxel_id = lod_voxels[i]
+                if not voxel_id:
+                    continue
+
+                # Local position of the first voxel of the cube
+                lx, ly, lz = (x - 1) * scale, (y - 1) * scale, (z - 1) * scale
+
+                if not lod_voxels[i + area]: # top face
+                    ao = get_ao(lod_voxels, size, i + area, 'Y')
+                    index = add_face(face_data, index, lx, ly + scale, lz, voxel_id, 0, ao, ao[1] + ao[3] > ao[0] + ao[2], scale, scale)
+
+                if not lod_voxels[i - area]: # bottom face
+                    ao = get_ao(lod_voxels, size, i - area, 'Y')
+                    index = add_face(face_data, index, lx, ly, lz, voxel_id, 1, ao, ao[1] + ao[3] > ao[0] + ao[2], scale, scale)
 
-    for x in range(CHUNK_SIZE):
-        for y in range(CHUNK_SIZE):
-            for z in range(CHUNK_SIZE):
-                voxel_id = chunk_voxels[x + CHUNK_SIZE * z + CHUNK_AREA * y]
+                if not lod_voxels[i + 1]: # right face
+                    ao = get_ao(lod_voxels, size, i + 1, 'X')
+                    index = add_face(face_data, index, lx + scale, ly, lz, voxel_id, 2, ao, ao[1] + ao[3] > ao[0] + ao[2], scale, scale)
 
-                if not voxel_id: # Skip if the voxel is empty
+                if not lod_voxels[i - 1]: # left face
+                    ao = get_ao(lod_voxels, size, i - 1, 'X')
+                    index = add_face(face_data, index, lx, ly, lz, voxel_id, 3, ao, ao[1] + ao[3] > ao[0] + ao[2], scale, scale)
+
+                if not lod_voxels[i - size]: # back face
+                    ao = get_ao(lod_voxels, size, i - size, 'Z')
+                    index = add_face(face_data, index, lx, ly, lz, voxel_id, 4, ao, ao[1] + ao[3] > ao[0] + ao[2], scale, scale)
+
+                if not lod_voxels[i + size]: # front face
+                    ao = get_ao(lod_voxels, size, i + size, 'Z')
+                    index = add_face(face_data, index, lx, ly, lz + scale, voxel_id, 5, ao, ao[1] + ao[3] > ao[0] + ao[2], scale, scale)
+
+    return index
+
+ALL_FACES_CONNECTED = (1 << 36) - 1 # Visibility of a chunk made only of air (consult get_face_connections)
+
+@njit(cache=True)
+def fill_runs(seeds, bits) -> int:
+    """Grow the seeds (a subset of bits) to the whole runs of consecutive set bits of bits they are in, in 6 doubling steps."""
+    up, down = seeds, seeds
+    up_bits, down_bits = bits, bits # Bits with a run of set bits below (above) them as long as the current step
+    for shift in (1, 2, 4, 8, 16, 32):
+        up |= up_bits & (up << shift)
+        up_bits &= up_bits << shift
+        down |= down_bits & (down >> shift)
+        down_bits &= down_bits >> shift
+    return up | down
+
+@njit(nogil=True, cache=True)
+def get_face_connections(padded_voxels, air, visited, pending, queued, stack) -> int:
+    """
+    Find which faces of the chunk are connected through its air voxels, for the occlusion culling (consult frustum.py):
+    a flood fill from every air voxel not reached yet collects the faces its pocket of air touches, so caves count.
+    Bit 6 * a + b of the result is set if air on face a reaches air on face b (faces numbered like the face ids:
+    top, bottom, right, left, back, front).
+    The fill works on rows of voxels along x, as bitmasks: a row grows its seeds to whole runs of air (fill_runs) and
+    passes them to the 4 rows next to it with an AND. A row waits in the stack at most once, its seeds add up in pending.
+    air, visited and pending (CHUNK_AREA int64), queued (CHUNK_AREA uint8) and stack (CHUNK_AREA int32) are scratch,
+    rows are indexed z + CHUNK_SIZE * y.
+    """
+    for y in range(CHUNK_SIZE):
+        for z in range(CHUNK_SIZE):
+            i = 1 + PADDED_SIZE * (z + 1) + PADDED_AREA * (y + 1)
+            bits = 0
+            for x in range(CHUNK_SIZE):
+                if not padded_voxels[i + x]:
+                    bits |= 1 << x
+            air[z + CHUNK_SIZE * y] = bits
+    visited[:] = 0
+    pending[:] = 0
+    queued[:] = 0
+
+    connections = 0
+    for start in range(CHUNK_AREA):
+        while air[start] & ~visited[start]:
+            seeds = air[start] & ~visited[start]
+            pending[start] = seeds & -seeds # A single voxel starts a pocket of air
+            queued[start] = 1
+            stack[0] = start
+            top = 1
+            faces = 0 # Faces touched by this pocket of air
+            while top:
+                top -= 1
+                row = stack[top]
+                queued[row] = 0
+                free = air[row] & ~visited[row]
+                seeds = pending[row] & free
+                pending[row] = 0
+                if not seeds:
                     continue
+                bits = fill_runs(seeds, free)
+                visited[row] |= bits
+
+                y, z = divmod(row, CHUNK_SIZE)
+                faces |= (y == CHUNK_SIZE - 1) | (y == 0) << 1 | (bits >> (CHUNK_SIZE - 1) & 1) << 2 | (bits & 1) << 3 | (z == 0) << 4 | (z == CHUNK_SIZE - 1) << 5
+                for next_row, inside in ((row + CHUNK_SIZE, y < CHUNK_SIZE - 1), (row - CHUNK_SIZE, y > 0), (row - 1, z > 0), (row + 1, z < CHUNK_SIZE - 1)):
+                    if inside and bits & air[next_row] & ~visited[next_row]:
+                        pending[next_row] |= bits
+                        if not queued[next_row]:
+                            queued[next_row] = 1
+                            stack[top] = next_row
+                            top += 1
+
+            for face in range(6):
+                if faces >> face & 1:
+                    connections |= faces << (6 * face)
+    return connections
+
+def get_scratch_size(section_size) -> int:
+    """uint32 needed by the builders to mesh a cube of section_size voxels (every voxel with its 6 faces, more than can be visible)."""
+    return section_size ** 3 * 6 * FACE_SIZE
+
+scratch = threading.local() # Scratch buffers of each meshing thread, reused by all the meshes it builds
+
+def get_padded_chunk(chunk_pos, world_voxels, chunk_coords) -> np.array:
+    """
+    Copy a chunk and the layer of voxels around it into the scratch buffer of the calling thread (consult get_padded_voxels).
+    The copy is valid until the thread pads another chunk.
+    """
+    if getattr(scratch, 'padded_voxels', None) is None:
+        scratch.padded_voxels = np.empty(PADDED_SIZE ** 3, dtype='uint8')
+    get_padded_voxels(chunk_pos, world_voxels, chunk_coords, scratch.padded_voxels)
+    return scratch.padded_voxels
 
-                # voxel world position
-                cx, cy, cz = chunk_pos
-                wx = x + cx * CHUNK_SIZE
-                wy = y + cy * CHUNK_SIZE
-                wz = z + cz * CHUNK_SIZE
-
-                # top face
-                if is_void((x, y + 1, z), (wx, wy + 1, wz), world_voxels):
-                    # get ao values
-                    ao = get_ao((x, y + 1, z), (wx, wy + 1, wz), world_voxels, plane='Y')
-                    flipped = ao[1] + ao[3] > ao[0] + ao[2] # Determine if the face should be flipped
-
-                    # format: x, y, z, voxel_id, face_id, ao_id, flipped
-                    v0 = pack_data(x    , y + 1, z    , voxel_id, 0, ao[0], flipped)
-                    v1 = pack_data(x + 1, y + 1, z    , voxel_id, 0, ao[1], flipped)
-                    v2 = pack_data(x + 1, y + 1, z + 1, voxel_id, 0, ao[2], flipped)
-                    v3 = pack_data(x    , y + 1, z + 1, voxel_id, 0, ao[3], flipped)
-
-                    if flipped:
-                        index = add_data(vertex_data, index, v1, v0, v3, v1, v3, v2)
-                    else:
-                        index = add_data(vertex_data, index, v0, v3, v2, v0, v2, v1)
-
-                # bottom face
-                if is_void((x, y - 1, z), (wx, wy - 1, wz), world_voxels):
-                    ao = get_ao((x, y - 1, z), (wx, wy - 1, wz), world_voxels, plane='Y')
-                    flipped = ao[1] + ao[3] > ao[0] + ao[2]
-
-                    v0 = pack_data(x    , y, z    , voxel_id, 1, ao[0], flipped)
-                    v1 = pack_data(x + 1, y, z    , voxel_id, 1, ao[1], flipped)
-                    v2 = pack_data(x + 1, y, z + 1, voxel_id, 1, ao[2], flipped)
-                    v3 = pack_data(x    , y, z + 1, voxel_id, 1, ao[3], flipped)
-
-                    if flipped:
-                        index = add_data(vertex_data, index, v1, v3, v0, v1, v2, v3)
-                    else:
-                        index = add_data(vertex_data, index, v0, v2, v3, v0, v1, v2)
-
-                # right face
-                if is_void((x + 1, y, z), (wx + 1, wy, wz), world_voxels):
-                    ao = get_ao((x + 1, y, z), (wx + 1, wy, wz), world_voxels, plane='X')
-                    flipped = ao[1] + ao[3] > ao[0] + ao[2]
-
-                    v0 = pack_data(x + 1, y    , z    , voxel_id, 2, ao[0], flipped)
-                    v1 = pack_data(x + 1, y + 1, z    , voxel_id, 2, ao[1], flipped)
-                    v2 = pack_data(x + 1, y + 1, z + 1, voxel_id, 2, ao[2], flipped)
-                    v3 = pack_data(x + 1, y    , z + 1, voxel_id, 2, ao[3], flipped)
-
-                    if flipped:
-                        index = add_data(vertex_data, index, v3, v0, v1, v3, v1, v2)
-                    else:
-                        index = add_data(vertex_data, index, v0, v1, v2, v0, v2, v3)
-
-                # left face
-                if is_void((x - 1, y, z), (wx - 1, wy, wz), world_voxels):
-                    ao = get_ao((x - 1, y, z), (wx - 1, wy, wz), world_voxels, plane='X')
-                    flipped = ao[1] + ao[3] > ao[0] + ao[2]
-
-                    v0 = pack_data(x, y    , z    , voxel_id, 3, ao[0], flipped)
-                    v1 = pack_data(x, y + 1, z    , voxel_id, 3, ao[1], flipped)
-                    v2 = pack_data(x, y + 1, z + 1, voxel_id, 3, ao[2], flipped)
-                    v3 = pack_data(x, y    , z + 1, voxel_id, 3, ao[3], flipped)
-
-                    if flipped:
-                        index = add_data(vertex_data, index, v3, v1, v0, v3, v2, v1)
-                    else:
-                        index = add_data(vertex_data, index, v0, v2, v1, v0, v3, v2)
-
-                # back face
-                if is_void((x, y, z - 1), (wx, wy, wz - 1), world_voxels):
-                    ao = get_ao((x, y, z - 1), (wx, wy, wz - 1), world_voxels, plane='Z')
-                    flipped = ao[1] + ao[3] > ao[0] + ao[2]
-
-                    v0 = pack_data(x,     y,     z, voxel_id, 4, ao[0], flipped)
-                    v1 = pack_data(x,     y + 1, z, voxel_id, 4, ao[1], flipped)
-                    v2 = pack_data(x + 1, y + 1, z, voxel_id, 4, ao[2], flipped)
-                    v3 = pack_data(x + 1, y,     z, voxel_id, 4, ao[3], flipped)
-
-                    if flipped:
-                        index = add_data(vertex_data, index, v3, v0, v1, v3, v1, v2)
-                    else:
-                        index = add_data(vertex_data, index, v0, v1, v2, v0, v2, v3)
-
-                # front face
-                if is_void((x, y, z + 1), (wx, wy, wz + 1), world_voxels):
-                    ao = get_ao((x, y, z + 1), (wx, wy, wz + 1), world_voxels, plane='Z')
-                    flipped = ao[1] + ao[3] > ao[0] + ao[2]
-
-                    v0 = pack_data(x    , y    , z + 1, voxel_id, 5, ao[0], flipped)
-                    v1 = pack_data(x    , y + 1, z + 1, voxel_id, 5, ao[1], flipped)
-                    v2 = pack_data(x + 1, y + 1, z + 1, voxel_id, 5, ao[2], flipped)
-                    v3 = pack_data(x + 1, y    , z + 1, voxel_id, 5, ao[3], flipped)
-
-                    if flipped:
-                        index = add_data(vertex_data, index, v3, v1, v0, v3, v2, v1)
-                    else:
-                        index = add_data(vertex_data, index, v0, v2, v1, v0, v3, v2)
-
-    return vertex_data[:index + 1]
\ No newline at end of file
+def get_padded_chunk_light(chunk_pos, world_light, chunk_coords) -> np.array:
+    """
+    Copy the light of a chunk and of the layer around it (consult get_padded_light) into the scratch buffer of the calling thread,
+    valid until the thread pads another chunk. Without light (None, LIGHTING is off) every voxel has FULL_LIGHT.
+    """
+    if getattr(scratch, 'padded_light', None) is None:
+        scratch.padded_light = np.full(PADDED_SIZE ** 3, FULL_LIGHT, dtype='uint8')
+    if world_light is not None:
+        get_padded_light(chunk_pos, world_light, chunk_coords, scratch.padded_light)
+    return scratch.padded_light
+
+def get_chunk_rows(padded_voxels) -> np.array:
+    """Bitmasks of the solid voxels of a padded chunk (consult get_solid_rows) in the scratch buffers of the calling thread, valid until it is called again."""
+    if getattr(scratch, 'solid_rows', None) is None:
+        scratch.solid_bits = np.zeros(SOLID_WORDS, dtype='uint64')
+        scratch.solid_rows = np.empty(PADDED_AREA, dtype='int64')
+    get_solid_rows(padded_voxels, scratch.solid_bits, scratch.solid_rows)
+    return scratch.solid_rows
+
+def get_face_data(size) -> np.array:
+    """Scratch buffer of the calling thread for at least size uint32 of faces (it grows once, to the biggest cube meshed by the thread)."""
+    face_data = getattr(scratch, 'face_data', None)
+    if face_data is None or len(face_data) < size:
+        face_data = scratch.face_data = np.empty(size, dtype='uint32')
+    return face_data
+
+def build_faces(mesh_builder, padded_voxels, solid_rows, padded_light, section_pos=(0, 0, 0), section_size=CHUNK_SIZE) -> np.array:
+    """
+    Run a builder (build_chunk_mesh or build_chunk_mesh_greedy) on a padded chunk, its solid rows and its light (consult
+    get_padded_chunk, get_chunk_rows and get_padded_chunk_light) in the scratch buffer of the calling thread.
+    Returns a copy of exactly the faces it built, so the mesh doesn't keep the scratch buffer alive.
+    """
+    face_data = get_face_data(get_scratch_size(section_size))
+    count = mesh_builder(padded_voxels, solid_rows, padded_light, face_data, section_pos, section_size)
+    return face_data[:count].copy()
+
+def build_lod_faces(padded_voxels, lod) -> np.array:
+    """Mesh a whole padded chunk downsampled to the given level of detail (1 to 3, consult downsample_voxels) in the scratch buffers of the calling thread."""
+    face_data = get_face_data(get_scratch_size(CHUNK_SIZE >> lod))
+    if getattr(scratch, 'lod_voxels', None) is None:
+        scratch.lod_voxels = np.empty(get_lod_size(1) ** 3, dtype='uint8') # Big enough for every level
+
+    downsample_voxels(padded_voxels, lod, scratch.lod_voxels)
+    count = build_lod_mesh(scratch.lod_voxels, lod, face_data)
+    return face_data[:count].copy()
+
+def get_visibility(padded_voxels) -> int:
+    """Faces of a padded chunk connected through air (consult get_face_connections), using the scratch buffers of the calling thread."""
+    if getattr(scratch, 'air', None) is None:
+        scratch.air, scratch.visited, scratch.pending = (np.empty(CHUNK_AREA, dtype='int64') for _ in range(3))
+        scratch.queued = np.empty(CHUNK_AREA, dtype='uint8')
+        scratch.stack = np.empty(CHUNK_AREA, dtype='int32')
+    return get_face_connections(padded_voxels, scratch.air, scratch.visited, scratch.pending, scratch.queued, scratch.stack)
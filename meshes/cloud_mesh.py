@@ -1,86 +1,117 @@
 from settings import *
 from meshes.base_mesh import BaseMesh
+from meshes.chunk_mesh_builder import get_trailing_zeros
 from noise import *
 
 class CloudMesh(BaseMesh):
+    """
+    The cloud layer is split into square tiles of CLOUD_TILE_SIZE cells and only the tiles around the player are meshed
+    (CLOUD_TILE_RADIUS in every direction, enough to reach the far plane), so its cost doesn't depend on the size of the world.
+    The tiles share one buffer with a slot for each of them, sized for the biggest mesh of a tile: when the player enters
+    another tile the new tiles are built into the slots of the ones that got out of range and only those slots are uploaded.
+    The cells are scaled by CLOUD_SCALE around the world center in the vertex shader (consult shaders/clouds.vert).
+    """
+
     def __init__(self, engine):
         super().__init__()
         self.engine = engine
 
         self.ctx = self.engine.ctx
         self.program = self.engine.shader_program.clouds
-        self.vbo_format = '3u2'
+        self.vbo_format = '3i4' # Cell coordinates can be negative in a streaming world
         self.attrs = ('in_position',)
-        self.vao = self.get_vao()
-
-    def get_vertex_data(self):
-        cloud_data = np.zeros(WORLD_AREA * CHUNK_SIZE ** 2, dtype='uint8')
-        self.gen_clouds(cloud_data)
-
-        return self.build_mesh(cloud_data)
-
-    @staticmethod
-    @njit
-    def gen_clouds(cloud_data):
-        for x in range(WORLD_W * CHUNK_SIZE):
-            for z in range(WORLD_D * CHUNK_SIZE):
-
-                if noise2(0.13 * x, 0.13 * z) < 0.2:
-                    continue
-                cloud_data[x + WORLD_W * CHUNK_SIZE * z] = 1
-
-    @staticmethod
-    @njit
-    def build_mesh(cloud_data):
-        mesh = np.empty(WORLD_AREA * CHUNK_AREA * 6 * 3, dtype='uint16')
-        index = 0
-        width = WORLD_W * CHUNK_SIZE
-        depth = WORLD_D * CHUNK_SIZE
-
-        y = CLOUD_HEIGHT
-        visited = set()
-
-        for z in range(depth):
-            for x in range(width):
-
-                idx = x + width * z
-                if not cloud_data[idx] or idx in visited:
-                    continue
-
-                # find number of continuous quads along x
-                x_count = 1
-                idx = (x + x_count) + width * z
-                while x + x_count < width and cloud_data[idx] and idx not in visited:
-                    x_count += 1
-                    idx = (x + x_count) + width * z
-
-                # find the number of continuous quads along z for each x
-                z_count_list = []
-                for ix in range(x_count):
-                    z_count = 1
-                    idx = (x + ix) + width * (z + z_count)
-                    while (z + z_count) < depth and cloud_data[idx] and idx not in visited:
-                        z_count += 1
-                        idx = (x + ix) + width * (z + z_count)
-                    z_count_list.append(z_count)
-
-                # find min count z to form a large quad
-                z_count = min(z_count_list) if z_count_list else 1
-
-                # mark all unit quads of the large quad as visited
-                for ix in range(x_count):
-                    for iz in range(z_count):
-                        visited.add((x + ix) + width * (z + iz))
-
-                v0 = x, y, z
-                v1 = x + x_count, y, z + z_count
-                v2 = x + x_count, y, z
-                v3 = x, y, z + z_count
-
-                for vertex in (v0, v1, v2, v0, v3, v1):
-                    for attr in vertex:
-                        mesh[index] = attr
-                        index += 1
 
-        mesh = mesh[:index + 1]
-        return mesh
\ No newline at end of file
+        self.rows, self.scratch = get_tile_scratch()
+        self.slot_vertices = len(self.scratch) // 3
+        self.tiles = {} # (tile x, tile z) -> (slot, vertices of its mesh)
+        self.free_slots = list(range((2 * CLOUD_TILE_RADIUS + 1) ** 2))
+        self.vbo = self.ctx.buffer(reserve=len(self.free_slots) * self.scratch.nbytes)
+        self.vao = self.ctx.vertex_array(self.program, [(self.vbo, self.vbo_format, *self.attrs)], skip_errors=True)
+        self.center_tile = get_player_tile(self.engine.player.position)
+        self.update_tiles()
+
+    def update(self):
+        tile = get_player_tile(self.engine.player.position)
+        if tile != self.center_tile:
+            self.center_tile = tile
+            self.update_tiles()
+
+    def update_tiles(self):
+        """Drop the tiles out of range and build the missing ones, each written in a free slot of the buffer."""
+        center_x, center_z = self.center_tile
+        tiles = {(x, z) for x in range(center_x - CLOUD_TILE_RADIUS, center_x + CLOUD_TILE_RADIUS + 1)
+                 for z in range(center_z - CLOUD_TILE_RADIUS, center_z + CLOUD_TILE_RADIUS + 1)}
+        for tile in [tile for tile in self.tiles if tile not in tiles]:
+            self.free_slots.append(self.tiles.pop(tile)[0])
+
+        for tile in tiles - self.tiles.keys():
+            slot = self.free_slots.pop()
+            mesh = build_tile(*tile, self.rows, self.scratch)
+            if len(mesh):
+                self.vbo.write(mesh, offset=slot * self.scratch.nbytes)
+            self.tiles[tile] = slot, len(mesh) // 3
+
+    def render(self):
+        for slot, vertices in self.tiles.values():
+            if vertices:
+                self.vao.render(first=slot * self.slot_vertices, vertices=vertices)
+
+def get_player_tile(position) -> tuple:
+    """Tile of the cloud cell above the position (the inverse of the scaling of the vertex shader)."""
+    cell_x = (position.x - CENTER_XZ) / CLOUD_SCALE + CENTER_XZ
+    cell_z = (position.z - CENTER_XZ) / CLOUD_SCALE + CENTER_XZ
+    return int(cell_x // CLOUD_TILE_SIZE), int(cell_z // CLOUD_TILE_SIZE)
+
+def get_tile_scratch() -> tuple:
+    """Buffers reused by build_tile: the rows of a tile and room for its biggest mesh (a checkerboard, half a quad per cell)."""
+    rows = np.zeros(CLOUD_TILE_SIZE, dtype='int64')
+    scratch = np.empty(CLOUD_TILE_SIZE * ((CLOUD_TILE_SIZE + 1) // 2) * 6 * 3, dtype='int32')
+    return rows, scratch
+
+def build_tile(tile_x, tile_z, rows, scratch) -> np.array:
+    """Generate the clouds of a tile and return its mesh (a view of scratch with exactly the vertices it has)."""
+    gen_tile(tile_x, tile_z, rows, noise_tables)
+    return scratch[:build_tile_mesh(rows, tile_x, tile_z, scratch)]
+
+@njit(cache=True)
+def gen_tile(tile_x, tile_z, rows, noise_tables):
+    """Fill rows with the clouds of the tile: bit x of rows[z] is set if the cell (x, z) of the tile is a cloud."""
+    start_x, start_z = tile_x * CLOUD_TILE_SIZE, tile_z * CLOUD_TILE_SIZE
+    for z in range(CLOUD_TILE_SIZE):
+        bits = 0
+        for x in range(CLOUD_TILE_SIZE):
+            if noise2(0.13 * (start_x + x), 0.13 * (start_z + z), noise_tables) >= 0.2:
+                bits |= 1 << x
+        rows[z] = bits
+
+@njit(cache=True)
+def build_tile_mesh(rows, tile_x, tile_z, mesh) -> int:
+    """
+    Greedy mesh of the clouds of a tile (rows is cleared): the run of clouds starting at the lowest set bit of a row is grown
+    along z while the next row has all its bits, then it is removed from the rows it covers. A whole run is found and tested
+    with a few operations on the bitmasks instead of cell by cell. Fills mesh with 6 vertices per quad (cell coordinates)
+    and returns the number of values written.
+    """
+    start_x, start_z = tile_x * CLOUD_TILE_SIZE, tile_z * CLOUD_TILE_SIZE
+    y = CLOUD_HEIGHT
+    index = 0
+    for z in range(CLOUD_TILE_SIZE):
+        while rows[z]:
+            x = get_trailing_zeros(rows[z])
+            x_count = get_trailing_zeros(~(rows[z] >> x)) # Length of the run of set bits from x
+            run = ((1 << x_count) - 1) << x
+
+            z_count = 1
+            while z + z_count < CLOUD_TILE_SIZE and rows[z + z_count] & run == run:
+                z_count += 1
+            for iz in range(z, z + z_count):
+                rows[iz] &= ~run
+
+            x0, z0 = start_x + x, start_z + z
+            x1, z1 = x0 + x_count, z0 + z_count
+            for vx, vz in ((x0, z0), (x1, z1), (x1, z0), (x0, z0), (x0, z1), (x1, z1)):
+                mesh[index] = vx
+                mesh[index + 1] = y
+                mesh[index + 2] = vz
+                index += 3
+    return index
@@ -0,0 +1,87 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from settings import MESH_CACHE_DIR, MESH_CACHE_SIZE_MB, GREEDY_MESHING, CHUNK_SIZE, SECTION_SIZE, CHUNK_SECTIONS
+from meshes.chunk_mesh_builder import MESHER_VERSION
+
+class MeshCache:
+    """
+    Chunk meshes saved on disk, keyed by a hash of everything the mesh builders read (the chunk and the voxels around it, and their light).
+    A file holds the offsets of the sections (CHUNK_SECTIONS + 1 uint32) followed by the packed faces, so it is read
+    with a single np.fromfile and the faces are written to the chunk arena texture from that array, without another copy.
+    This is one copy from the page cache rather than zero-copy: a memory map would keep the file open as long as the
+    sections of the mesh are kept, and a mapped file can't be replaced or deleted on Windows (consult put).
+    The least recently used files are deleted when the cache is bigger than MESH_CACHE_SIZE_MB.
+    """
+
+    def __init__(self, path=MESH_CACHE_DIR, max_size=MESH_CACHE_SIZE_MB * 2 ** 20):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock() # Meshes are built (and looked up) on several threads
+        os.makedirs(path, exist_ok=True)
+
+        # Anything that changes the output of the builders for the same voxels
+        self.version = f'{MESHER_VERSION}-{int(GREEDY_MESHING)}-{CHUNK_SIZE}-{SECTION_SIZE}'.encode()
+
+        # key -> file size, least recently used first (file modification times keep the order between runs)
+        files = [entry for entry in os.scandir(path) if entry.name.endswith('.mesh')]
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        self.entries = OrderedDict((entry.name[:-5], entry.stat().st_size) for entry in files)
+        self.size = sum(self.entries.values())
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, padded_voxels, padded_light) -> str:
+        """Key of the mesh of a chunk: a hash of everything the builders read, its padded voxels and light (consult get_padded_chunk and get_padded_chunk_light)."""
+        key = hashlib.blake2b(padded_voxels, digest_size=16, key=self.version)
+        key.update(padded_light)
+        return key.hexdigest()
+
+    def get_file(self, key) -> str:
+        return os.path.join(self.path, key + '.mesh')
+
+    def get(self, key):
+        """Get (faces, section data list) of a cached mesh, None if it isn't in the cache. Both are views of the array read from the file."""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+        try:
+            data = np.fromfile(self.get_file(key), dtype='uint32')
+            os.utime(self.get_file(key)) # Most recently used
+        except OSError: # Deleted meanwhile
+            return None
+
+        offsets = data[:CHUNK_SECTIONS + 1] + CHUNK_SECTIONS + 1
+        face_data = data[CHUNK_SECTIONS + 1:]
+        section_data = [data[offsets[i]:offsets[i + 1]] for i in range(CHUNK_SECTIONS)] # Views, no copy
+        return face_data, section_data
+
+    def put(self, key, section_data):
+        """Save a mesh (the faces of its sections) and delete the least recently used ones if the cache is too big."""
+        offsets = np.cumsum([0] + [len(data) for data in section_data], dtype='uint32')
+        file_path = self.get_file(key)
+        temp_path = f'{file_path}.{threading.get_ident()}.tmp' # Written apart so a reader never sees half a file
+        with open(temp_path, 'wb') as file:
+            file.write(offsets.tobytes())
+            for data in section_data:
+                file.write(data.tobytes())
+        os.replace(temp_path, file_path)
+
+        with self.lock:
+            self.size += os.path.getsize(file_path) - self.entries.pop(key, 0)
+            self.entries[key] = os.path.getsize(file_path)
+
+            while self.size > self.max_size and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.size -= old_size
+                try:
+                    os.remove(self.get_file(old_key))
+                except OSError:
+                    pass
@@ -0,0 +1,77 @@
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from settings import MESH_THREADS, MESH_UPLOAD_BUDGET_MS
+
+class MeshScheduler:
+    """
+    Builds meshes on worker threads (the numba mesh builders release the GIL) and uploads them on the main thread.
+    Finished meshes wait in a completion queue that is drained every frame within a time budget.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers=MESH_THREADS or os.cpu_count(), thread_name_prefix='mesher')
+        self.completed = queue.Queue() # Futures of the finished jobs, in completion order
+        self.in_flight = 0 # Jobs submitted and not uploaded (or discarded) yet
+
+        # Metrics of the last upload
+        self.upload_time = 0.0 # Milliseconds spent uploading during the last frame
+        self.uploads = 0 # Meshes uploaded during the last frame
+        self.uploaded_bytes = 0 # Bytes of packed faces uploaded during the last frame
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of meshes requested but not on the GPU yet."""
+        return self.in_flight
+
+    def request(self, mesh):
+        """Ask for the mesh to be rebuilt from the current voxels, the old one keeps being rendered until the new one is uploaded."""
+        if mesh.job_pending: # A job that didn't start yet will already read the latest voxels
+            return
+
+        mesh.job_pending = True
+        mesh.requested_version += 1
+        self.in_flight += 1
+        future = self.executor.submit(self.build, mesh, mesh.requested_version)
+        future.add_done_callback(self.completed.put)
+
+    @staticmethod
+    def build(mesh, version):
+        """Build the vertex data of the mesh (runs on a worker thread)."""
+        mesh.job_pending = False # From now on edits need a new job
+        return mesh, version, mesh.get_vertex_data()
+
+    def upload(self, budget_ms=MESH_UPLOAD_BUDGET_MS):
+        """
+        Create the vertex buffers of the finished meshes until budget_ms milliseconds are spent.
+        At least one mesh is uploaded per call so the queue can't stall.
+        """
+        start = time.perf_counter()
+        self.uploads = 0
+        self.uploaded_bytes = 0
+
+        while not self.completed.empty():
+            if self.uploads and (time.perf_counter() - start) * 1000 >= budget_ms:
+                break
+            self.upload_job(self.completed.get())
+
+        self.upload_time = (time.perf_counter() - start) * 1000
+
+    def flush(self):
+        """Wait for all the requested meshes and upload them (used while loading, when there is no frame to keep smooth)."""
+        while self.in_flight:
+            self.upload_job(self.completed.get()) # Blocks until the next job is done
+
+    def upload_job(self, future):
+        """Upload the mesh built by a finished job, unless a newer version of it is already on the GPU."""
+        mesh, version, face_data = future.result() # Re-raises the errors of the worker
+        self.in_flight -= 1
+        if version < mesh.uploaded_version:
+            return
+
+        mesh.upload(face_data) # Replaces the old mesh in the chunk arena
+        mesh.uploaded_version = version
+        self.uploads += 1
+        self.uploaded_bytes += face_data.nbytes
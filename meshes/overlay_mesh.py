@@ -0,0 +1,53 @@
+from settings import *
+import moderngl as mgl
+from meshes.base_mesh import BaseMesh
+
+class OverlayMesh(BaseMesh):
+    """Lines of text drawn over the top left corner of the screen (used by the frame profiler)."""
+
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+        self.ctx = self.engine.ctx
+        self.program = self.engine.shader_program.overlay
+
+        self.vbo_format = '2u1'
+        self.attrs = ('in_position',)
+        self.vao = self.get_vao()
+
+        self.font = pg.font.SysFont('consolas,dejavusansmono,couriernew,monospace', OVERLAY_FONT_SIZE)
+        self.texture = None
+
+    def get_vertex_data(self):
+        # Corners of the quad, (0, 0) is the top left corner of the text
+        return np.array([(0, 0), (0, 1), (1, 1), (0, 0), (1, 1), (1, 0)], dtype='uint8')
+
+    def set_text(self, lines):
+        """Draw the lines into the texture of the overlay."""
+        rows = [self.font.render(line, True, (255, 255, 255)) for line in lines]
+        margin = 4
+        width = max(row.get_width() for row in rows) + 2 * margin
+        height = sum(row.get_height() for row in rows) + 2 * margin
+
+        surface = pg.Surface((width, height), pg.SRCALPHA)
+        surface.fill((0, 0, 0, 160)) # Translucent background so the text can be read over the sky
+        y = margin
+        for row in rows:
+            surface.blit(row, (margin, y))
+            y += row.get_height()
+
+        if self.texture is None or self.texture.size != (width, height):
+            if self.texture:
+                self.texture.release()
+            self.texture = self.ctx.texture((width, height), components=4)
+            self.texture.filter = (mgl.NEAREST, mgl.NEAREST)
+        self.texture.write(pg.image.tostring(surface, 'RGBA'))
+        self.program['u_size'] = 2 * width / WIN_RES.x, 2 * height / WIN_RES.y # Size in normalized device coordinates
+
+    def render(self):
+        if not self.texture:
+            return
+        self.texture.use(location=3)
+        self.ctx.disable(mgl.DEPTH_TEST | mgl.CULL_FACE) # Always on top
+        self.vao.render()
+        self.ctx.enable(mgl.DEPTH_TEST | mgl.CULL_FACE)
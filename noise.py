@@ -2,13 +2,17 @@ from settings import SEED
 from numba import njit
 from opensimplex.internals import _noise2, _noise3, _init
 
-perm, perm_grad_index3 = _init(seed=SEED)
+# Permutation tables of the seed. The kernels take them as an argument instead of reading them as globals:
+# numba freezes global arrays into the compiled code, so a kernel loaded from the cache would keep the seed it was compiled with
+noise_tables = perm, perm_grad_index3 = _init(seed=SEED)
 
 @njit(cache=True)
-def noise2(x, y):
+def noise2(x, y, noise_tables):
+    perm, _ = noise_tables
     return _noise2(x, y, perm)
 
 
 @njit(cache=True)
-def noise3(x, y, z):
+def noise3(x, y, z, noise_tables):
+    perm, perm_grad_index3 = noise_tables
     return _noise3(x, y, z, perm, perm_grad_index3)
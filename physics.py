@@ -0,0 +1,117 @@
+from numba import prange
+from settings import *
+from meshes.chunk_mesh_builder import get_chunk_index
+from voxel_storage import get_voxel
+
+EPSILON = 1e-6 # Boxes that only touch a voxel don't overlap it
+
+class Physics:
+    """
+    Runs the simulation at PHYSICS_TICK_RATE steps per second whatever the frame rate: every frame the time since the
+    last one is added to an accumulator and as many fixed steps as it holds are run (at most MAX_PHYSICS_STEPS).
+    The bodies are axis aligned boxes (position: center of the bottom face, size: width, height, depth) moved by
+    swept collision against the voxels (consult move_box), so a fast body can't go through a wall at any frame rate.
+    """
+
+    def __init__(self, world):
+        self.world = world
+        self.accumulator = 0.0 # Seconds not simulated yet
+        self.alpha = 0.0 # How far the frame is between the last two steps (0 to 1), to interpolate what is drawn
+
+    def get_steps(self, delta_time) -> int:
+        """Add the time of the frame (delta_time in milliseconds) and return the number of steps to run."""
+        self.accumulator += delta_time * 0.001
+        steps = int(self.accumulator * PHYSICS_TICK_RATE)
+        if steps > MAX_PHYSICS_STEPS: # After a stall the simulation slows down instead of trying to catch up
+            steps = MAX_PHYSICS_STEPS
+            self.accumulator = steps * PHYSICS_STEP
+        self.accumulator -= steps * PHYSICS_STEP
+        self.alpha = self.accumulator * PHYSICS_TICK_RATE
+        return steps
+
+    def move_bodies(self, positions, velocities, sizes, gravity=GRAVITY_STRENGTH) -> np.array:
+        """
+        Run one step for the bodies in the rows of positions, velocities and sizes (n x 3 float64, updated in place),
+        on all the cores. Returns the axes each body was stopped on (bit 0: x, bit 1: y, bit 2: z).
+        """
+        blocked = np.empty(len(positions), dtype='uint8')
+        move_bodies(positions, velocities, sizes, gravity, PHYSICS_STEP, self.world.voxels.arrays, self.world.chunk_coords, blocked)
+        return blocked
+
+@njit(cache=True)
+def is_solid(x, y, z, world_voxels, chunk_coords) -> bool:
+    """Check if the voxel at the world position is not air (the chunks that aren't loaded are air)."""
+    chunk_index = get_chunk_index((x, y, z), chunk_coords)
+    if chunk_index == -1:
+        return False
+    return get_voxel(world_voxels, chunk_index, x % CHUNK_SIZE + CHUNK_SIZE * (z % CHUNK_SIZE) + CHUNK_AREA * (y % CHUNK_SIZE)) != 0
+
+@njit(cache=True)
+def sweep_axis(box_min, box_max, axis, distance, world_voxels, chunk_coords) -> float:
+    """
+    Move the box (min and max corners, updated in place) by distance along an axis, stopping against the first layer of
+    voxels in the way. Every voxel the box would go through is checked, so the distance can be any length.
+    Returns the distance actually moved.
+    """
+    a, b = (axis + 1) % 3, (axis + 2) % 3 # The two other axes
+    a_start, a_end = math.floor(box_min[a] + EPSILON), math.ceil(box_max[a] - EPSILON) # Voxels the box overlaps on them
+    b_start, b_end = math.floor(box_min[b] + EPSILON), math.ceil(box_max[b] - EPSILON)
+
+    if distance > 0: # Layers in front of the max face, from the first one it enters to the last one
+        first, last, step = math.ceil(box_max[axis] - EPSILON), math.ceil(box_max[axis] + distance) - 1, 1
+    else: # Layers behind the min face
+        first, last, step = math.floor(box_min[axis] + EPSILON) - 1, math.floor(box_min[axis] + distance), -1
+
+    for layer in range(first, last + step, step):
+        for i in range(a_start, a_end):
+            for j in range(b_start, b_end):
+                # World position of the voxel (layer on the axis, i and j on the other two)
+                if axis == 0:
+                    x, y, z = layer, i, j
+                elif axis == 1:
+                    x, y, z = j, layer, i
+                else:
+                    x, y, z = i, j, layer
+                if is_solid(x, y, z, world_voxels, chunk_coords):
+                    # Stop touching the layer (never backwards, a box already inside a voxel can still leave it)
+                    distance = max(layer - box_max[axis], 0.0) if step > 0 else min(layer + 1 - box_min[axis], 0.0)
+                    box_min[axis] += distance
+                    box_max[axis] += distance
+                    return distance
+
+    box_min[axis] += distance
+    box_max[axis] += distance
+    return distance
+
+@njit(cache=True)
+def move_box(position, velocity, size, gravity, dt, world_voxels, chunk_coords) -> int:
+    """
+    One step of a body (position and velocity are updated in place): gravity is added to the velocity and the box
+    is swept one axis at a time, vertical first so the body lands before sliding. The velocity along an axis where the
+    box hit a voxel is zeroed. Returns the blocked axes (bit 0: x, bit 1: y, bit 2: z).
+    """
+    if gravity:
+        velocity[1] = max(velocity[1] - gravity * dt, -MAX_FALL_SPEED)
+
+    box_min = np.array([position[0] - size[0] * 0.5, position[1], position[2] - size[2] * 0.5])
+    box_max = box_min + size
+
+    blocked = 0
+    for axis in (1, 0, 2):
+        distance = velocity[axis] * dt
+        if distance == 0:
+            continue
+        if sweep_axis(box_min, box_max, axis, distance, world_voxels, chunk_coords) != distance:
+            velocity[axis] = 0.0
+            blocked |= 1 << axis
+
+    position[0] = box_min[0] + size[0] * 0.5
+    position[1] = box_min[1]
+    position[2] = box_min[2] + size[2] * 0.5
+    return blocked
+
+@njit(parallel=True, cache=True)
+def move_bodies(positions, velocities, sizes, gravity, dt, world_voxels, chunk_coords, blocked):
+    """Run move_box for every row of positions, velocities and sizes on all the cores, blocked gets its results."""
+    for i in prange(len(positions)):
+        blocked[i] = move_box(positions[i], velocities[i], sizes[i], gravity, dt, world_voxels, chunk_coords)
@@ -1,17 +1,19 @@
 import pygame as pg
 from camera import Camera
-from collision_manager import CollisionManager
 from settings import *
+from physics import move_box
 
 class Player(Camera):
     def __init__(self, engine, position=PLAYER_POS, yaw=-90, pitch=0):
         super().__init__(position, yaw, pitch)
         self.engine = engine
-        self.collision_manager = CollisionManager()
 
-        # standardized vectors
-        self.one_block_above = glm.vec3(0, -1, 0)  # Define vector for one block above
-        self.one_block_below = glm.vec3(0, 1, 0)  # Define vector for one block below
+        # Bounding box moved by the physics (position: center of its bottom face), the camera is PLAYER_EYE_HEIGHT above it
+        self.size = np.array([PLAYER_WIDTH, PLAYER_HEIGTH, PLAYER_DEPTH], dtype='float64')
+        self.body_position = np.zeros(3)
+        self.previous_body_position = np.zeros(3) # Before the last step
+        self.velocity = np.zeros(3) # Voxels per second
+        self.set_body_position(self.position)
 
         # Previous yaw and pitch values (if the player flips the camera, the movement will be inverted)
         self.previous_yaw = yaw
@@ -20,15 +22,12 @@ class Player(Camera):
     def update(self):
         """Method that updates the player position and camera."""
         
-        self.keyboard_control() # Handle keyboard input
-        if GRAVITY_ENABLED:
-            print("Gravity enabled")
-            self.apply_gravity() # Apply gravity to the player
+        self.keyboard_control() # Handle keyboard input and move the player (gravity and collisions included)
         self.mouse_control() # handle mouse input
         super().update() # Update viewing matrices and vectors
 
     def handle_event(self, event):
-        """Handles mouse clicks."""
+        """Handles mouse clicks and the key that switches the block to place."""
 
         # adding and removing voxels with clicks
         if event.type == pg.MOUSEBUTTONDOWN:
@@ -37,6 +36,8 @@ class Player(Camera):
                 voxel_handler.set_voxel()
             if event.button == 3:
                 voxel_handler.switch_mode()
+        if event.type == pg.KEYDOWN and event.key == SWITCH_BLOCK_KEY:
+            self.engine.scene.world.voxel_handler.switch_block()
 
     def mouse_control(self):
         """Handle mouse motion input."""
@@ -54,124 +55,56 @@ class Player(Camera):
             self.previous_pitch = self.pitch
 
     def keyboard_control(self):
-        """Handle keyboard input for player movement."""
+        """Handle keyboard input for player movement, the player is moved by the physics steps of the frame."""
 
         key_state = pg.key.get_pressed()
-        vel = PLAYER_SPEED * self.engine.delta_time # Calculate velocity based on player speed and delta time
-
-        if key_state[FORWARD_KEY]:  # Move the player forward
-            bound_box = self.get_bound_box(self.position + self.forward * vel)  # Get player bounding box
-            collides = False  # Define flag for collision
-            blocks_infront_pos: list[glm.ivec3] = [glm.ivec3(self.position + self.forward), glm.ivec3(self.position + self.forward + self.one_block_above)]  # Define list of blocks in front of the player (assumes that the height of the player is 2)
-            for block_pos in blocks_infront_pos:
-                voxel_id = self.get_voxel_id(world_pos=block_pos)
-                if voxel_id == 0: continue  # If the voxel is air, skip the iteration
-
-                block_infront_bound_box = self.get_voxel_bounds(world_pos=block_pos)
-                if self.collision_manager.check_collision(bound_box, block_infront_bound_box):  # Check if player collides with any of the blocks
-                    collides = True  # Set collision flag to True
-                    break
-
-            if not collides:  # If player does not collide with any of the blocks
-                self.move_forward(vel)  # If player does not collide with any of the blocks, move the player forward
-
-        if key_state[BACKWARD_KEY]:  # Move the player backwards
-            bound_box = self.get_bound_box(self.position - self.forward * vel)  # Get player bounding box
-            collides = False  # Define flag for collision
-            blocks_behind_pos: list[glm.ivec3] = [glm.ivec3(self.position - self.forward), glm.ivec3(self.position - self.forward + self.one_block_above)]  # Define list of blocks behind the player (assumes that the height of the player is 2)
-            for block_pos in blocks_behind_pos:
-                voxel_id = self.get_voxel_id(world_pos=block_pos)
-                if voxel_id == 0:  continue # If the voxel is air, skip the iteration
-
-                block_behind_bound_box = self.get_voxel_bounds(world_pos=block_pos)
-                if self.collision_manager.check_collision(bound_box, block_behind_bound_box):  # Check if player collides with any of the blocks
-                    collides = True  # Set collision flag to True
-                    break  # Break the loop
-
-            if not collides:  # If player does not collide with any of the blocks
-                self.move_back(vel)  # If player does not collide with any of the blocks, move the player backwards
-
-        if not (key_state[RIGHT_KEY] and key_state[LEFT_KEY]):  # Only allow player to left or right, not both at the same time
-            if key_state[RIGHT_KEY]:  # Move the player to the right
-                bound_box = self.get_bound_box(self.position + self.right * vel)  # Get player bounding box
-                collides = False  # Define flag for collision
-                blocks_to_the_right_pos: list[glm.ivec3] = [glm.ivec3(self.position + self.right), glm.ivec3(self.position + self.right + self.one_block_above)]  # Initialize list of blocks to the right of the player (assumes that the height of the player is 2)
-                for block_pos in blocks_to_the_right_pos:
-                    voxel_id = self.get_voxel_id(world_pos=block_pos)
-                    if voxel_id == 0: continue # If the voxel is air, skip the iteration
-
-                    block_bound_box = self.get_voxel_bounds(world_pos=block_pos)
-                    if self.collision_manager.check_collision(bound_box, block_bound_box):  # Check if player collides with any of the blocks
-                        collides = True  # Set collision flag to True
-                        break
-
-                if not collides:  # If player does not collide with any of the blocks
-                    self.move_right(vel)  # If player does not collide with any of the blocks, move the player to the right
-
-            if key_state[LEFT_KEY]:  # Move the player to the left
-                bound_box = self.get_bound_box(self.position - self.right * vel)  # Get player bounding box
-                collides = False  # Define flag for collision
-                blocks_to_the_left_pos: list[glm.ivec3] = [glm.ivec3(self.position - self.right), glm.ivec3(self.position - self.right + self.one_block_above)]  # Define list of blocks to the left of the player
-                for block_pos in blocks_to_the_left_pos:
-                    voxel_id = self.get_voxel_id(world_pos=block_pos)
-                    if voxel_id == 0: continue  # If the voxel is air, skip the iteration
-
-                    block_bound_box = self.get_voxel_bounds(world_pos=block_pos)
-                    if self.collision_manager.check_collision(bound_box, block_bound_box):  # Check if player collides with any of the blocks
-                        collides = True  # Set collision flag to True
-                        break  # Break the loop
-
-                if not collides:  # If player does not collide with any of the blocks
-                    self.move_left(vel)  # If player does not collide with any of the blocks, move the player to the left
-        
-        if not (key_state[UP_KEY] and key_state[DOWN_KEY]) and ALLOW_FLIGHT: # If player is not pressing both up and down keys and the player can fly
-            if key_state[UP_KEY]:  # Move the player up
-                bound_box = self.get_bound_box(self.position + self.up * vel)
-                block_above_world_pos: glm.ivec3 = glm.ivec3(self.position + self.up)  # Define block above the player (assumes that the height of the player is 2)
-                voxel_id = self.get_voxel_id(world_pos=block_above_world_pos)
-                if voxel_id == 0 or not self.collision_manager.check_collision(bound_box, self.get_voxel_bounds(world_pos=block_above_world_pos)):
-                    self.move_up(vel)
-
-            if key_state[DOWN_KEY]:  # Move the player down
-                bound_box = self.get_bound_box(self.position - self.up * vel)
-                block_below_pos: glm.ivec3 = glm.ivec3(self.position - self.up) # Define block below the player
-                
-                voxel_id = self.get_voxel_id(world_pos=block_below_pos)
-                
-                if voxel_id == 0 or not self.collision_manager.check_collision(bound_box, self.get_voxel_bounds(world_pos=block_below_pos)):
-                    self.move_down(vel)
-
-    def apply_gravity(self):
-        """Apply gravity to the player."""
-        downwards = glm.vec3(0, -1, 0)  # Define vector pointing downwards
-        bound_box = self.get_bound_box(self.position + downwards * GRAVITY_STRENGTH)  # Get player bounding box
-        block_below_world_pos = glm.ivec3(self.position + downwards)  # Get block below the player (ivec means integer vector needed to get proper voxel world position)
-        voxel_id = self.get_voxel_id(world_pos=block_below_world_pos)
-        
-        # Check for collision and move down if no collision
-        if voxel_id == 0 or not self.collision_manager.check_collision(bound_box, self.get_voxel_bounds(world_pos=block_below_world_pos)):
-            self.position += downwards * GRAVITY_STRENGTH
-
-    def get_bound_box(self, desired_position):
-        """Returns player bounding box."""
-
-        x, y, z = desired_position
-
-        min_x = round(x - PLAYER_WIDTH / 2, 4) # round method is used to simplify the calculations
-        max_x = round(x + PLAYER_WIDTH / 2, 4)
-        min_y = round(y, 4)
-        max_y = round(y + PLAYER_HEIGTH, 4)
-        min_z = round(z - PLAYER_DEPTH / 2, 4)
-        max_z = round(z + PLAYER_DEPTH / 2, 4)
-
-        #print(f"Player position: {desired_position}")
-        #print(f"Bounding box: min_x={min_x}, max_x={max_x}, min_y={min_y}, max_y={max_y}, min_z={min_z}, max_z={max_z}")
-        #print()
-
-        return min_x, max_x, min_y, max_y, min_z, max_z
-    
-    def get_voxel_bounds(self, world_pos):
-        return self.engine.scene.world.get_voxel_bounds(world_pos)
-    
-    def get_voxel_id(self, world_pos):
-        return self.engine.scene.world.get_voxel_id(world_pos)
\ No newline at end of file
+        direction = glm.vec3(0)
+        horizontal_forward = glm.normalize(glm.vec3(self.forward.x, 0, self.forward.z)) # Walk on the horizontal plane even when looking up or down
+
+        if key_state[FORWARD_KEY]:
+            direction += horizontal_forward
+        if key_state[BACKWARD_KEY]:
+            direction -= horizontal_forward
+        if key_state[RIGHT_KEY]: # Pressing both right and left keys cancels out
+            direction += self.right
+        if key_state[LEFT_KEY]:
+            direction -= self.right
+        if ALLOW_FLIGHT: # Same for up and down
+            if key_state[UP_KEY]:
+                direction.y += 1
+            if key_state[DOWN_KEY]:
+                direction.y -= 1
+
+        self.move(direction)
+
+    def move(self, direction):
+        """Run the physics steps of the frame (consult physics.py) with the player going along direction at PLAYER_SPEED."""
+        if self.position != self.drawn_position: # Moved from outside of the physics (e.g. placed by the benchmarks), the body follows
+            self.set_body_position(self.position)
+
+        world = self.engine.scene.world
+        speed = PLAYER_SPEED * 1000 # Voxels per second
+        gravity = GRAVITY_STRENGTH if GRAVITY_ENABLED else 0.0
+        for _ in range(world.physics.get_steps(self.engine.delta_time)):
+            self.previous_body_position[:] = self.body_position
+            self.velocity[0], self.velocity[2] = direction.x * speed, direction.z * speed
+            if direction.y or not gravity: # Flying overrides the fall
+                self.velocity[1] = direction.y * speed
+
+            if ALLOW_COLLISION:
+                move_box(self.body_position, self.velocity, self.size, gravity, PHYSICS_STEP, world.voxels.arrays, world.chunk_coords)
+            else: # Go through the voxels
+                self.velocity[1] = max(self.velocity[1] - gravity * PHYSICS_STEP, -MAX_FALL_SPEED)
+                self.body_position += self.velocity * PHYSICS_STEP
+
+        # Draw the player between the last two steps, so the camera moves smoothly at any frame rate
+        x, y, z = self.previous_body_position + (self.body_position - self.previous_body_position) * world.physics.alpha
+        self.position = glm.vec3(x, y + PLAYER_EYE_HEIGHT, z)
+        self.drawn_position = glm.vec3(self.position)
+
+    def set_body_position(self, position):
+        """Put the bounding box of the player under the camera at the given position."""
+        self.body_position[:] = position.x, position.y - PLAYER_EYE_HEIGHT, position.z
+        self.previous_body_position[:] = self.body_position
+        self.velocity[:] = 0
+        self.drawn_position = glm.vec3(position)
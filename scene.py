@@ -10,8 +10,9 @@ class Scene:
         self.engine = engine
         self.world = World(self.engine)
         self.voxel_marker = VoxelMarker(self.world.voxel_handler)
-        self.water = Water(engine)
-        self.clouds = Clouds(engine)
+        with engine.startup_profiler.section('water and clouds'):
+            self.water = Water(engine)
+            self.clouds = Clouds(engine)
 
     def update(self):
         self.world.update()
@@ -19,14 +20,19 @@ class Scene:
         self.clouds.update()
 
     def render(self):
+        profiler = self.engine.frame_profiler
+
         # Render chunks
         self.world.render()
+        profiler.mark('world.render')
 
         # Render clouds and water without face culling because they are not fully opaque (not rendered faces will be visible if we use face culling)
         self.engine.ctx.disable(mgl.CULL_FACE)
         self.clouds.render()
         self.water.render()
         self.engine.ctx.enable(mgl.CULL_FACE) # Renable face culling
+        profiler.mark('clouds and water render')
 
         # Voxel Selection Outline
         self.voxel_marker.render()
+        profiler.mark('voxel_marker.render')
@@ -1,19 +1,22 @@
-try:
-    from numba import njit
-    from random import randint
-    import numpy as np
-    import glm
-    import math
-    import pygame as pg
-except ImportError as e:
-    import os
-    os.system('pip install -r requirements.txt')
-    from numba import njit
-    from random import randint
-    import numpy as np
-    import glm
-    import math
-    import pygame as pg
+import numba
+from numba import njit
+from random import randint
+import hashlib
+import json
+import os
+import re
+import shutil
+import numpy as np
+import glm
+import math
+import pygame as pg
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def get_override(name, default):
+    """Value of the setting from the environment variable VOXEL_<name> (JSON) if it is set, used to run the benchmarks with other settings."""
+    value = os.environ.get(f'VOXEL_{name}')
+    return default if value is None else json.loads(value)
 
 # OpenGL settings
 MAJOR_VER, MINOR_VER = 3, 3
@@ -34,10 +37,19 @@ RESOLUTIONS = {
 }
 WIN_RES = RESOLUTIONS["Full HD"]
 
+# World saving settings
+SAVE_DIR = 'saves/world' # Folder of the saved world (world.json and the region files)
+LOAD_SAVED_WORLD = get_override('LOAD_SAVED_WORLD', True) # Load the edits saved in SAVE_DIR over the generated chunks (the world keeps its seed)
+SAVE_ON_EXIT = get_override('SAVE_ON_EXIT', True) # Save the edits of the loaded chunks when the game is closed
+REGION_SIZE = 8 # Chunk columns along each side of a region file
+
 # Seed for world gen (noise algorithm)
-SEED = randint(0, 1000)
+SEED = get_override('SEED', randint(0, 1000))
+if LOAD_SAVED_WORLD and os.path.isfile(os.path.join(SAVE_DIR, 'world.json')): # A saved world has to be generated with its own seed
+    with open(os.path.join(SAVE_DIR, 'world.json')) as file:
+        SEED = json.load(file)['seed']
 
-# Max raycasting distance
+# Max raycasting distance (the ray cast is compiled, consult voxel_handler.py, so longer rays only cost a few more microseconds)
 MAX_RAY_DIST = 6
 
 # chunk
@@ -47,16 +59,81 @@ CHUNK_AREA = CHUNK_SIZE * CHUNK_SIZE
 CHUNK_VOL = CHUNK_AREA * CHUNK_SIZE
 CHUNK_SPHERE_RADIUS = H_CHUNK_SIZE * math.sqrt(3)
 
+# chunk sections (cubes of voxels meshed on their own, an edit only rebuilds the sections around the voxel)
+SECTION_SIZE = 16 # Must divide CHUNK_SIZE
+CHUNK_SECTIONS_W = CHUNK_SIZE // SECTION_SIZE # Sections along each side of a chunk
+CHUNK_SECTIONS = CHUNK_SECTIONS_W ** 3
+
 # World dimnesions
-WORLD_W, WORLD_H = 20, 2
+WORLD_W, WORLD_H = get_override('WORLD_W', 20), get_override('WORLD_H', 2)
 WORLD_D = WORLD_W
 WORLD_AREA = WORLD_W * WORLD_D
 WORLD_VOL = WORLD_AREA * WORLD_H
 
+# Streaming world settings
+STREAMING_WORLD = False # Generate and release chunks around the player instead of building a fixed island of WORLD_W x WORLD_D chunks
+STREAM_RADIUS = 6 # Number of chunk columns loaded in every horizontal direction around the player
+STREAM_COLUMNS_PER_FRAME = 2 # Max number of chunk columns generated each frame while the player moves
+
+# Chunk table (rows of World.chunks and World.voxels, consult chunk_table.py for more information)
+CHUNK_TABLE_W = 2 * STREAM_RADIUS + 1 if STREAMING_WORLD else WORLD_W
+CHUNK_TABLE_D = CHUNK_TABLE_W if STREAMING_WORLD else WORLD_D
+CHUNK_TABLE_AREA = CHUNK_TABLE_W * CHUNK_TABLE_D
+CHUNK_TABLE_VOL = CHUNK_TABLE_AREA * WORLD_H
+
 # World center coordinates
 CENTER_XZ = WORLD_W * H_CHUNK_SIZE
 CENTER_Y = WORLD_H * H_CHUNK_SIZE
 
+# Meshing settings
+GREEDY_MESHING = get_override('GREEDY_MESHING', False) # Merge coplanar faces with the same voxel id and ambient occlusion into bigger quads (False to use one quad per face)
+
+# Lighting settings (consult lighting.py for more information)
+LIGHTING = get_override('LIGHTING', True) # Flood fill the sky light and the light of the lamps through the air, so caves are dark (False to light every face like the open sky)
+MAX_LIGHT = 15 # Light level of the open sky and of the brightest lamp (4 bits)
+LAMP_LIGHT = 14 # Block light emitted by a lamp
+
+# Occlusion culling settings
+OCCLUSION_CULLING = True # Skip the chunks hidden behind solid terrain: only the chunks the camera can reach through air (caves included) are drawn (consult frustum.py)
+
+# Level of detail settings (consult downsample_voxels in meshes/chunk_mesh_builder.py for more information)
+LOD_DISTANCES = tuple(get_override('LOD_DISTANCES', (192, 320, 448))) # Distances (voxels from the camera to the chunk center) beyond which chunks are meshed with cubes of 2, 4 and 8 voxels (at most 3 levels, the biggest cube must divide CHUNK_SIZE), () to disable
+LOD_HYSTERESIS = 16 # Voxels past a distance before a chunk changes level, so it doesn't flicker between two levels while the player moves
+
+# Background meshing settings
+BACKGROUND_MESHING = True # Build chunk meshes on worker threads so edits never stall the frame
+MESH_THREADS = 0 # Number of meshing threads (0 to use all the cores)
+MESH_UPLOAD_BUDGET_MS = 2.0 # Max time per frame (in milliseconds) spent uploading finished meshes to the GPU
+
+# Mesh cache settings
+MESH_CACHE = get_override('MESH_CACHE', True) # Keep the chunk meshes on disk and reuse them when a chunk and its neighbours didn't change
+MESH_CACHE_DIR = 'cache/meshes'
+MESH_CACHE_SIZE_MB = 512 # The least recently used meshes are deleted beyond this size
+
+# Chunk arena settings (consult meshes/chunk_arena.py for more information)
+CHUNK_ARENA_MB = 16 # Starting size of the texture holding the faces of all the chunk meshes (it doubles when it is full)
+ARENA_BLOCK = 64 # Faces per block of the arena, meshes take whole blocks
+MULTI_DRAW_INDIRECT = True # Draw all the visible chunks with a single call if the GPU supports it (OpenGL 4.3), else one call per run of chunks
+
+# Startup settings
+JIT_CACHE_DIR = os.path.join(PROJECT_DIR, 'cache', 'numba') # Machine code of the njit functions, so only the first launch compiles them (NUMBA_CACHE_DIR overrides it)
+STARTUP_PROFILE = True # Print how long the launch took (imports, JIT, terrain generation, meshing, GL setup, textures...)
+STARTUP_PROFILE_LOG = 'cache/startup.jsonl' # Every launch appends its startup profile here
+
+# Frame profiler settings (consult frame_profiler.py for more information)
+FRAME_PROFILER = False # Time every frame from the start (otherwise only while the overlay is shown or a trace is recorded)
+PROFILER_OVERLAY_KEY = pg.K_F3 # Show or hide the timings of the frame stages and the rendering counters
+PROFILER_TRACE_KEY = pg.K_F4 # Start recording the frames, press it again to save them as a Chrome trace and a CSV
+FRAME_TRACE_DIR = 'cache/traces'
+FRAME_PROFILER_HISTORY = 120 # Frames averaged by the overlay
+FRAME_OVERLAY_INTERVAL = 0.25 # Seconds between two updates of the overlay text
+OVERLAY_FONT_SIZE = 16
+
+# World generation settings
+PARALLEL_WORLD_GEN = True # Generate the chunks on all the CPU cores at once (same result as the serial generation)
+WORLD_GEN_THREADS = 0 # Number of threads used by the parallel generation (0 to use all the cores)
+WORLD_GEN_BATCH = 64 # Chunks generated at once (their voxels are kept uncompressed until the whole batch is stored)
+
 # Camera settings
 ASPECT_RATIO = WIN_RES.x / WIN_RES.y 
 FOV_DEG = 50 # Field of view degree value
@@ -66,8 +143,12 @@ NEAR = 0.1 # Near plane distance from camera
 FAR = 2000.0 # Far plane distance from camera
 PITCH_MAX = glm.radians(89) # Max vertical rotations
 
-# Physics settings
-GRAVITY_STRENGTH = 0.1 # Gravity force
+# Physics settings (consult physics.py for more information)
+PHYSICS_TICK_RATE = 120 # Physics steps per second, the same at any frame rate
+PHYSICS_STEP = 1 / PHYSICS_TICK_RATE # Seconds simulated by a step
+MAX_PHYSICS_STEPS = 8 # Max steps per frame (after a long frame the simulation slows down instead of catching up)
+GRAVITY_STRENGTH = 25.0 # Gravity acceleration (voxels per second squared)
+MAX_FALL_SPEED = 50.0 # Voxels per second
 
 # Player controls
 FORWARD_KEY = pg.K_w
@@ -76,18 +157,20 @@ LEFT_KEY = pg.K_a
 RIGHT_KEY = pg.K_d
 UP_KEY = pg.K_q
 DOWN_KEY = pg.K_e
+SWITCH_BLOCK_KEY = pg.K_f # Change the block that is placed (consult PLACEABLE_BLOCKS)
 
 # Player settings
 ALLOW_COLLISION = False # Allow player to collide with blocks
 ALLOW_FLIGHT = True # Allow player to fly
 GRAVITY_ENABLED = False # Enable or disable gravity
-PLAYER_SPEED = 0.005 # Player movement speed
+PLAYER_SPEED = 0.005 # Player movement speed (voxels per millisecond)
 PLAYER_ROT_SPEED = 0.003 # Camera rotation speed
 PLAYER_POS = glm.vec3(CENTER_XZ + 0.5, WORLD_H * CHUNK_SIZE + 0.5, CENTER_XZ + 0.5)
 #PLAYER_POS = glm.vec3(CENTER_XZ, CHUNK_SIZE, CENTER_XZ) # Starting player position
 PLAYER_WIDTH = 1
 PLAYER_HEIGTH = 2
 PLAYER_DEPTH = 1
+PLAYER_EYE_HEIGHT = 1.6 # Height of the camera above the bottom of the player bounding box
 MOUSE_SENSITIVITY = 0.002 # Mouse sensibility
 
 # Standardized colors
@@ -101,6 +184,8 @@ STONE = 4
 SNOW = 5
 LEAVES = 6
 WOOD = 7
+LAMP = 8 # Emits LAMP_LIGHT
+PLACEABLE_BLOCKS = (DIRT, LAMP) # Blocks the player can place, SWITCH_BLOCK_KEY goes to the next one
 
 # Terrain levels (at which heigth different types of terrain should take place)
 SNOW_LVL = 54
@@ -120,4 +205,46 @@ WATER_AREA = 5 * CHUNK_SIZE * WORLD_W # Area of water block
 
 # Cloud settings
 CLOUD_SCALE = 25 # Dimension
-CLOUD_HEIGHT = WORLD_H * CHUNK_SIZE * 2 # Heigth of the clouds
\ No newline at end of file
+CLOUD_HEIGHT = WORLD_H * CHUNK_SIZE * 2 # Heigth of the clouds
+CLOUD_DRIFT = 300 # Max distance (voxels) the clouds move back and forth with time
+CLOUD_TILE_SIZE = 48 # Cloud cells along each side of a tile (at most 62, a row of a tile is an int64 bitmask)
+CLOUD_TILE_RADIUS = math.ceil((FAR + CLOUD_DRIFT) / CLOUD_SCALE / CLOUD_TILE_SIZE) # Tiles meshed in every direction around the tile of the player (enough to reach the far plane)
+
+SOURCE_FOLDERS = ('', 'meshes', 'world_objects') # Folders of the python modules of the engine (relative to this file)
+
+def get_sources_hash() -> str:
+    """
+    Hash of the python sources of the engine. Numba only checks the file of a function to validate its cache, so a function
+    calling one of another module (e.g. voxel_storage.get_voxel) would keep running the old code of it after that module changed.
+    Only the module files of SOURCE_FOLDERS are read, not the caches, saves or virtual environments next to them. The benchmarks
+    are left out: the engine never calls them and their own njit functions only call the ones of the engine.
+    """
+    sha = hashlib.sha1()
+    for folder in SOURCE_FOLDERS:
+        path = os.path.join(PROJECT_DIR, folder)
+        for name in sorted(os.listdir(path)) if os.path.isdir(path) else (): # Same order every time
+            if name.endswith('.py'):
+                sha.update(f'{folder}/{name}'.encode())
+                with open(os.path.join(path, name), 'rb') as file:
+                    sha.update(file.read())
+    return sha.hexdigest()
+
+def remove_stale_jit_caches():
+    """
+    Delete the compiled functions of older sources, they can't be used anymore. Only the folders of JIT_CACHE_DIR named
+    like a sources key (12 hex digits) other than SOURCES_KEY are removed. Called once when the game starts (consult main.py).
+    """
+    if SOURCES_KEY is None or not os.path.isdir(JIT_CACHE_DIR): # NUMBA_CACHE_DIR is set, the folder isn't ours
+        return
+    for name in os.listdir(JIT_CACHE_DIR):
+        if name != SOURCES_KEY and re.fullmatch('[0-9a-f]{12}', name):
+            shutil.rmtree(os.path.join(JIT_CACHE_DIR, name), ignore_errors=True)
+
+# The settings are compiled into the njit functions as constants and numba only checks the source files to validate its cache,
+# so every version of the sources gets its own folder of compiled functions (older ones are deleted by remove_stale_jit_caches),
+# with a folder in it for every combination of settings (SEED is passed as an argument so it doesn't count)
+SOURCES_KEY = None
+if not os.environ.get('NUMBA_CACHE_DIR'):
+    SOURCES_KEY = get_sources_hash()[:12]
+    SETTINGS_KEY = repr(sorted((name, repr(value)) for name, value in globals().items() if name.isupper() and name not in ('SEED', 'SOURCES_KEY')))
+    numba.config.CACHE_DIR = os.path.join(JIT_CACHE_DIR, SOURCES_KEY, hashlib.sha1(SETTINGS_KEY.encode()).hexdigest()[:12])
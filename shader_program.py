@@ -10,13 +10,16 @@ class ShaderProgram:
         self.voxel_marker = self.get_program(shader_name='voxel_marker')
         self.water = self.get_program(shader_name='water')
         self.clouds = self.get_program(shader_name='clouds')
+        self.overlay = self.get_program(shader_name='overlay')
         # Set uniforms 
         self.set_uniforms_on_init()
 
     def set_uniforms_on_init(self):
         # Chunk uniforms
         self.chunk['m_proj'].write(self.player.m_proj)
-        self.chunk['m_model'].write(glm.mat4())
+        self.chunk['u_faces'] = 4 # Texture locations of the chunk arena (consult meshes/chunk_arena.py for more information)
+        self.chunk['u_chunk_offsets'] = 5
+        self.chunk['arena_block'] = ARENA_BLOCK
         self.chunk['u_texture_array_0'] = 1 # Assign texture location consult textures.py for more information
         self.chunk['bg_color'].write(BG_COLOR)
         self.chunk['water_line'] = WATER_LINE
@@ -38,6 +41,10 @@ class ShaderProgram:
         self.clouds['center'] = CENTER_XZ
         self.clouds['bg_color'].write(BG_COLOR)
         self.clouds['cloud_scale'] = CLOUD_SCALE
+        self.clouds['drift'] = CLOUD_DRIFT
+
+        # Overlay uniforms
+        self.overlay['u_texture_0'] = 3 # Texture location of the overlay text (consult meshes/overlay_mesh.py for more information)
 
     def update(self):
         # Update view matrices
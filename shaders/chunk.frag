@@ -18,9 +18,9 @@ flat in int face_id; // Face id
 flat in int voxel_id; // Voxel id
 
 void main() {
-    vec2 face_uv = uv;
+    vec2 face_uv = fract(uv); // Repeat the texture on quads bigger than one voxel
     // Adjust texture coordinates based on face id
-    face_uv.x = uv.x / 3.0 - min(face_id, 2) / 3.0;
+    face_uv.x = face_uv.x / 3.0 - min(face_id, 2) / 3.0;
 
     // Sample the texture color from the texture array
     vec3 tex_col = texture(u_texture_array_0, vec3(face_uv, voxel_id)).rgb;
@@ -1,16 +1,20 @@
 #version 330 core
 
-layout (location = 0) in uint packed_data; // Input packed data containing vertex information
+// No vertex attributes: every 6 vertices are the two triangles of a face, read from the chunk arena with gl_VertexID
 
-// Variables to store unpacked vertex data
+// Variables to store unpacked face data
 int x, y, z;
-int ao_id;
 int flip_id;
+int width, height;
+int ao[4];
+int light_level; // Brightest of the sky light and the block light of the air in front of the face
 
 // Uniform matrices for transformations
 uniform mat4 m_proj; // Projection matrix
 uniform mat4 m_view; // View matrix
-uniform mat4 m_model; // Model matrix
+uniform usampler2D u_faces; // Packed faces of all the chunks (consult meshes/chunk_arena.py)
+uniform isampler2D u_chunk_offsets; // World offset of the chunk that owns each block of the arena (consult meshes/chunk_arena.py)
+uniform int arena_block; // Faces per block of the arena
 
 // Output variables to the fragment shader
 flat out int voxel_id; // Voxel ID
@@ -24,6 +28,12 @@ out vec3 frag_world_pos; // Fragment position in world space
 // Ambient occlusion values
 const float ao_values[4] = float[4](0.1, 0.25, 0.5, 1.0);
 
+// Light of a level: a level less is 0.8 times darker, and level 0 isn't pitch black
+const float min_light = 0.1;
+float get_light(int level) {
+    return mix(min_light, 1.0, pow(0.8, float(15 - level)));
+}
+
 // Shading values for each face
 const float face_shading[6] = float[6](
     1.0, 0.5,  // Top and bottom faces
@@ -37,6 +47,16 @@ const vec2 uv_coords[4] = vec2[4](
     vec2(1, 0), vec2(1, 1)
 );
 
+// Corners of the two triangles of a face for each face_id, not flipped and flipped (same order as the old vertex meshes)
+const int corner_indices[72] = int[72](
+    0, 3, 2, 0, 2, 1,  1, 0, 3, 1, 3, 2,  // Top face
+    0, 2, 3, 0, 1, 2,  1, 3, 0, 1, 2, 3,  // Bottom face
+    0, 1, 2, 0, 2, 3,  3, 0, 1, 3, 1, 2,  // Right face
+    0, 2, 1, 0, 3, 2,  3, 1, 0, 3, 2, 1,  // Left face
+    0, 1, 2, 0, 2, 3,  3, 0, 1, 3, 1, 2,  // Back face
+    0, 2, 1, 0, 3, 2,  3, 1, 0, 3, 2, 1   // Front face
+);
+
 // Indices for texture coordinates based on face orientation and flip
 const int uv_indices[24] = int[24](
     1, 0, 2, 1, 2, 3,  // Even face
@@ -52,39 +72,56 @@ vec3 hash31(float p) {
     return fract((p3.xxy + p3.yzz) * p3.zyx) + 0.05;
 }
 
-// Function to unpack the packed vertex data
-void unpack(uint packed_data) {
-    // Bit lengths and masks for unpacking
-    uint b_bit = 6u, c_bit = 6u, d_bit = 8u, e_bit = 3u, f_bit = 2u, g_bit = 1u;
-    uint b_mask = 63u, c_mask = 63u, d_mask = 255u, e_mask = 7u, f_mask = 3u, g_mask = 1u;
-    // Bit shifts for unpacking
-    uint fg_bit = f_bit + g_bit;
-    uint efg_bit = e_bit + fg_bit;
-    uint defg_bit = d_bit + efg_bit;
-    uint cdefg_bit = c_bit + defg_bit;
-    uint bcdefg_bit = b_bit + cdefg_bit;
-    // Unpacking vertex data
-    x = int(packed_data >> bcdefg_bit); // Extract x coordinate
-    y = int((packed_data >> cdefg_bit) & b_mask); // Extract y coordinate
-    z = int((packed_data >> defg_bit) & c_mask); // Extract z coordinate
-    // Extract final data
-    voxel_id = int((packed_data >> efg_bit) & d_mask); // Extract voxel ID
-    face_id = int((packed_data >> fg_bit) & e_mask); // Extract face ID
-    ao_id = int((packed_data >> g_bit) & f_mask); // Extract ambient occlusion ID
-    flip_id = int(packed_data & g_mask); // Extract flip ID
+// Function to unpack the packed face data (consult pack_face in meshes/chunk_mesh_builder.py)
+void unpack(uvec2 packed_face) {
+    x = int(packed_face.x >> 24u); // Extract the first corner
+    y = int((packed_face.x >> 18u) & 63u);
+    z = int((packed_face.x >> 12u) & 63u);
+    voxel_id = int((packed_face.x >> 4u) & 255u); // Extract voxel ID
+    face_id = int((packed_face.x >> 1u) & 7u); // Extract face ID
+    flip_id = int(packed_face.x & 1u); // Extract flip ID
+
+    for (int corner = 0; corner < 4; corner++) {
+        ao[corner] = int((packed_face.y >> uint(18 - 2 * corner)) & 3u); // Extract ambient occlusion ID of each corner
+    }
+    uint light = (packed_face.y >> 20u) & 255u; // Extract the sky light (high 4 bits) and the block light
+    light_level = int(max(light >> 4u, light & 15u));
+    width = int((packed_face.y >> 6u) & 63u); // Extract the size of the quad (1 x 1 without greedy meshing)
+    height = int(packed_face.y & 63u);
+}
+
+// Offset of a corner from the first one (width along the texture u axis, height along v)
+vec3 get_corner(int corner) {
+    vec2 size = vec2(corner == 1 || corner == 2 ? width : 0, corner >= 2 ? height : 0); // Corners 0, 1, 2, 3 are (0, 0), (1, 0), (1, 1), (0, 1) for top and bottom faces
+    if (face_id < 2) return vec3(size.x, 0, size.y);
+    size = vec2(corner >= 2 ? width : 0, corner == 1 || corner == 2 ? height : 0); // The others go along v first
+    if (face_id < 4) return vec3(0, size.y, size.x);
+    return vec3(size.x, size.y, 0);
 }
 
 void main() {
-    unpack(packed_data); // Unpack the vertex data
+    int face = gl_VertexID / 6; // Index of the face in the arena
+    int row_size = textureSize(u_faces, 0).x;
+    unpack(texelFetch(u_faces, ivec2(face % row_size, face / row_size), 0).xy); // Unpack the face data
 
-    vec3 in_position = vec3(x, y, z); // Create the input position vector
-    int uv_index = gl_VertexID % 6  + ((face_id & 1) + flip_id * 2) * 6; // Calculate the UV index
+    int vertex = gl_VertexID % 6; // Vertex of the two triangles of the face
+    int corner = corner_indices[face_id * 12 + flip_id * 6 + vertex];
+    vec3 in_position = vec3(x, y, z) + get_corner(corner); // Create the input position vector
+    int uv_index = vertex + ((face_id & 1) + flip_id * 2) * 6; // Calculate the UV index
 
     uv = uv_coords[uv_indices[uv_index]]; // Set the texture coordinates
 
-    shading = face_shading[face_id] * ao_values[ao_id]; // Calculate the shading factor
+    // Stretch the texture coordinates over the whole quad so the texture is repeated once per voxel
+    uv *= vec2(width, height);
+
+    shading = face_shading[face_id] * ao_values[ao[corner]] * get_light(light_level); // Calculate the shading factor
+
+    // The face index in the arena tells which block the face is in, and so which chunk
+    int block = face / arena_block;
+    row_size = textureSize(u_chunk_offsets, 0).x;
+    ivec3 chunk_offset = texelFetch(u_chunk_offsets, ivec2(block % row_size, block / row_size), 0).xyz;
 
-    frag_world_pos = (m_model * vec4(in_position, 1.0)).xyz; // Transform the position to world space
+    frag_world_pos = in_position + vec3(chunk_offset); // Transform the position to world space
 
     gl_Position = m_proj * m_view * vec4(frag_world_pos, 1.0); // Calculate the final position in clip space
 }
\ No newline at end of file
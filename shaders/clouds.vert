@@ -12,6 +12,7 @@ uniform mat4 m_view_proj; // Combined view-projection matrix (not used in this s
 uniform int center; // Center position for scaling and translation
 uniform float u_time; // Time variable for animation
 uniform float cloud_scale; // Scale factor for the clouds
+uniform float drift; // Max distance the clouds move back and forth
 
 void main() {
     vec3 pos = vec3(in_position); // Copy the input position to a local variable
@@ -21,7 +22,7 @@ void main() {
     pos.xz *= cloud_scale; // Scale the x and z coordinates
     pos.xz += center; // Translate back to the original position
 
-    float time = 300 * sin(0.01 * u_time); // Calculate the time-based translation for cloud movement
+    float time = drift * sin(0.01 * u_time); // Calculate the time-based translation for cloud movement
     pos.xz += time; // Apply the time-based translation to the x and z coordinates
 
     // Transform the position to clip space using the projection and view matrices
@@ -0,0 +1,15 @@
+#version 330 core
+
+// Output variable to store the final color of the fragment
+layout (location = 0) out vec4 fragColor;
+
+// Input texture coordinates from the vertex shader
+in vec2 uv;
+
+// Uniform variables
+uniform sampler2D u_texture_0; // Texture with the text
+
+void main() {
+    // Text is drawn as it is, blending uses its alpha
+    fragColor = texture(u_texture_0, uv);
+}
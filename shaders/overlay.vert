@@ -0,0 +1,18 @@
+#version 330 core
+
+// Input vertex attributes
+layout (location = 0) in vec2 in_position; // Corner of the quad, (0, 0) is the top left one
+
+// Uniform variables
+uniform vec2 u_size; // Size of the overlay in normalized device coordinates
+
+// Output variable to pass texture coordinates to the fragment shader
+out vec2 uv;
+
+void main() {
+    // The first row of the texture is the top of the text
+    uv = in_position;
+
+    // Place the quad in the top left corner of the screen
+    gl_Position = vec4(-1.0 + in_position.x * u_size.x, 1.0 - in_position.y * u_size.y, 0.0, 1.0);
+}
@@ -0,0 +1,95 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from numba import config
+from numba.core import event
+from settings import STARTUP_PROFILE, STARTUP_PROFILE_LOG
+
+class CompileListener(event.Listener):
+    """Time spent by numba compiling functions (the ones loaded from the cache aren't compiled) and number of compilations."""
+
+    def __init__(self):
+        self.depth = 0 # Functions called by a function are compiled inside its compilation
+        self.seconds = 0
+        self.compiled = 0
+
+    def on_start(self, event):
+        if self.depth == 0:
+            self.start = time.perf_counter()
+        self.depth += 1
+        self.compiled += 1
+
+    def on_end(self, event):
+        self.depth -= 1
+        if self.depth == 0:
+            self.seconds += time.perf_counter() - self.start
+
+class StartupProfiler:
+    """
+    Breaks the launch time (from the start of main.py to the first frame on screen) down into sections, each with the
+    time numba spent compiling in it. The report is printed and appended to STARTUP_PROFILE_LOG (a JSON object a line)
+    so the startup time can be followed between launches.
+    """
+
+    def __init__(self, start_time):
+        self.start_time = start_time # time.perf_counter() at the start of the program
+        self.last_time = start_time # End of the last section
+        self.sections = {} # name -> [seconds, seconds spent compiling]
+        self.is_finished = False
+
+        self.listener = CompileListener()
+        event.register('numba:compile', self.listener)
+
+    def add(self, name, seconds, jit_seconds=0):
+        section = self.sections.setdefault(name, [0, 0]) # Sections with the same name are summed up
+        section[0] += seconds
+        section[1] += jit_seconds
+        self.last_time = time.perf_counter()
+
+    @contextmanager
+    def section(self, name):
+        """Time the code in the with block (nothing is recorded after the first frame)."""
+        if self.is_finished:
+            yield
+            return
+        start, jit_start = time.perf_counter(), self.listener.seconds
+        yield
+        self.add(name, time.perf_counter() - start, self.listener.seconds - jit_start)
+
+    def finish(self, name='first frame'):
+        """Record the time since the last section as name and report the launch."""
+        jit_seconds = self.listener.seconds - sum(jit for _, jit in self.sections.values())
+        self.add(name, time.perf_counter() - self.last_time, jit_seconds)
+        self.is_finished = True
+        event.unregister('numba:compile', self.listener)
+
+        total = time.perf_counter() - self.start_time
+        report = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'total': round(total, 4),
+            'jit': round(self.listener.seconds, 4),
+            'compiled': self.listener.compiled,
+            'warm': self.listener.compiled == 0, # Every kernel came from the cache
+            'sections': {name: {'seconds': round(seconds, 4), 'jit': round(jit, 4)} for name, (seconds, jit) in self.sections.items()},
+            'cache_dir': config.CACHE_DIR,
+        }
+        if STARTUP_PROFILE:
+            self.print_report(report)
+            self.save_report(report)
+        return report
+
+    @staticmethod
+    def print_report(report):
+        print(f'Startup: {report["total"]:.2f} s to the first frame ({"warm" if report["warm"] else "cold"} JIT cache, '
+              f'{report["jit"]:.2f} s compiling {report["compiled"]} functions)')
+        for name, section in report['sections'].items():
+            print(f'  {name:20s} {section["seconds"]:7.3f} s  (jit {section["jit"]:.3f} s)')
+
+    @staticmethod
+    def save_report(report, path=STARTUP_PROFILE_LOG):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(path, 'a') as file:
+            file.write(json.dumps(report) + '\n')
@@ -1,12 +1,15 @@
 from noise import noise2, noise3
-from random import random
+from numba import prange
 from settings import *
+from chunk_table import get_column_index
 
-@njit
-def get_height(x, z):
-    # island mask
-    island = 1 / (pow(0.0025 * math.hypot(x - CENTER_XZ, z - CENTER_XZ), 20) + 0.0001)
-    island = min(island, 1)
+@njit(cache=True)
+def get_height(x, z, noise_tables):
+    # island mask (a streaming world has no borders to hide)
+    island = 1
+    if not STREAMING_WORLD:
+        island = 1 / (pow(0.0025 * math.hypot(x - CENTER_XZ, z - CENTER_XZ), 20) + 0.0001)
+        island = min(island, 1)
 
     # amplitude
     a1 = CENTER_Y
@@ -16,37 +19,105 @@ def get_height(x, z):
     f1 = 0.005
     f2, f4, f8 = f1 * 2, f1 * 4, f1 * 8
 
-    if noise2(0.1 * x, 0.1 * z) < 0:
+    if noise2(0.1 * x, 0.1 * z, noise_tables) < 0:
         a1 /= 1.07
 
     height = 0
-    height += noise2(x * f1, z * f1) * a1 + a1
-    height += noise2(x * f2, z * f2) * a2 - a2
-    height += noise2(x * f4, z * f4) * a4 + a4
-    height += noise2(x * f8, z * f8) * a8 - a8
+    height += noise2(x * f1, z * f1, noise_tables) * a1 + a1
+    height += noise2(x * f2, z * f2, noise_tables) * a2 - a2
+    height += noise2(x * f4, z * f4, noise_tables) * a4 + a4
+    height += noise2(x * f8, z * f8, noise_tables) * a8 - a8
 
-    height = max(height,  noise2(x * f8, z * f8) + 2)
+    height = max(height,  noise2(x * f8, z * f8, noise_tables) + 2)
     height *= island
 
     return int(height)
 
-@njit
+# Salts of hash_random, so every random choice made at the same voxel gets its own number
+SURFACE_SALT = 0
+TREE_SALT = 1
+LEAVES_SALT = 2
+
+@njit(cache=True)
+def hash_random(world_seed, wx, wy, wz, salt) -> float:
+    """
+    Pseudo random number in [0, 1) that only depends on the world seed, a world position and a salt (a hash of them with
+    the murmur3 finalizer), so a voxel is generated the same way whatever chunks, order or threads it is generated with.
+    """
+    h = (world_seed * 0x9E3779B1 + wx * 0x85EBCA77 + wy * 0xC2B2AE3D + wz * 0x27D4EB2F + salt * 0x165667B1) & 0xFFFFFFFF
+    h ^= h >> 16
+    h = (h * 0x85EBCA6B) & 0xFFFFFFFF
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & 0xFFFFFFFF
+    h ^= h >> 16
+    return h / 4294967296.0
+
+@njit(parallel=True, cache=True)
+def build_heightmap(heightmap, column_positions, noise_tables):
+    """
+    Compute the terrain height of every column of voxels once, so all the chunks stacked on the same column can share it.
+    The heights of the chunk column at column_positions[i] (chunk coordinates x, z) are stored in the row get_column_index(x, z),
+    heightmap[row][x + CHUNK_SIZE * z] being the height at local (x, z).
+    """
+    for i in prange(len(column_positions)):
+        row = get_column_index(column_positions[i, 0], column_positions[i, 1])
+        cx = column_positions[i, 0] * CHUNK_SIZE
+        cz = column_positions[i, 1] * CHUNK_SIZE
+        for z in range(CHUNK_SIZE):
+            for x in range(CHUNK_SIZE):
+                heightmap[row, x + CHUNK_SIZE * z] = get_height(x + cx, z + cz, noise_tables)
+
+@njit(cache=True)
+def generate_terrain(voxels, heights, cx, cy, cz, noise_tables, world_seed):
+    """
+    Fill the voxels of the chunk whose first voxel is at world position (cx, cy, cz).
+    heights is the heightmap of the chunk column (see build_heightmap).
+    noise_tables and world_seed come from the seed of the world (noise.noise_tables and SEED), they are arguments so the
+    compiled kernels cached on disk don't depend on the seed. The random choices come from hash_random, so a chunk can be
+    generated again at any time (consult world_save.py).
+    """
+    for x in range(CHUNK_SIZE):
+        wx = x + cx
+        for z in range(CHUNK_SIZE):
+            wz = z + cz
+            world_height = heights[x + CHUNK_SIZE * z]
+            local_height = min(world_height - cy, CHUNK_SIZE)
+
+            for y in range(local_height):
+                wy = y + cy
+                set_voxel_id(voxels, x, y, z, wx, wy, wz, world_height, noise_tables, world_seed)
+
+@njit(parallel=True, cache=True)
+def generate_terrain_parallel(chunks_voxels, heightmap, chunk_positions, noise_tables, world_seed):
+    """
+    Generate all the chunks in chunk_positions (chunk coordinates) on every available core.
+    The voxels of chunk i are written to chunks_voxels[i], the heights of its column are read from the heightmap.
+    """
+    for i in prange(len(chunk_positions)):
+        chunk_x, chunk_y, chunk_z = chunk_positions[i, 0], chunk_positions[i, 1], chunk_positions[i, 2]
+        voxels = chunks_voxels[i]
+        voxels[:] = 0 # The buffer is reused and may come from np.empty
+
+        heights = heightmap[get_column_index(chunk_x, chunk_z)]
+        generate_terrain(voxels, heights, chunk_x * CHUNK_SIZE, chunk_y * CHUNK_SIZE, chunk_z * CHUNK_SIZE, noise_tables, world_seed)
+
+@njit(cache=True)
 def get_index(x, y, z):
     """Get the index of a voxel in the voxels array."""
     return x + CHUNK_SIZE * z + CHUNK_AREA * y
 
-@njit
-def set_voxel_id(voxels, x, y, z, wx, wy, wz, world_height):
+@njit(cache=True)
+def set_voxel_id(voxels, x, y, z, wx, wy, wz, world_height, noise_tables, world_seed):
     voxel_id = 0 # Air (default value)
 
     if wy < world_height - 1: # If not at the top of the world minus 1
         # Create caves
-        if (noise3(wx * 0.09, wy * 0.09, wz * 0.09) > 0 and noise2(wx * 0.1, wz * 0.1) * 3 + 3 < wy < world_height - 10): # Noise for caves
+        if (noise3(wx * 0.09, wy * 0.09, wz * 0.09, noise_tables) > 0 and noise2(wx * 0.1, wz * 0.1, noise_tables) * 3 + 3 < wy < world_height - 10): # Noise for caves
             voxel_id = 0 # Set to air
         else:
             voxel_id = STONE # Else set to stone
     else:
-        rng = int(7 * random()) # Random number between 0 and 6
+        rng = int(7 * hash_random(world_seed, wx, wy, wz, SURFACE_SALT)) # Random number between 0 and 6
         ry = wy - rng # Random height
         if SNOW_LVL <= ry < world_height: # If the height is between the snow level and the world height
             voxel_id = SNOW # Set to snow
@@ -68,11 +139,11 @@ def set_voxel_id(voxels, x, y, z, wx, wy, wz, world_height):
 
     # If the world is less than the dirt level place a tree
     if wy < DIRT_LVL:
-        place_tree(voxels, x, y, z, voxel_id)
+        place_tree(voxels, x, y, z, wx, wy, wz, voxel_id, world_seed)
 
-@njit
-def place_tree(voxels, x, y, z, voxel_id):
-    rnd = random() # Random number between 0 and 1
+@njit(cache=True)
+def place_tree(voxels, x, y, z, wx, wy, wz, voxel_id, world_seed):
+    rnd = hash_random(world_seed, wx, wy, wz, TREE_SALT) # Random number between 0 and 1
     if voxel_id != GRASS or rnd > TREE_PROBABILITY: # If the voxel id is not grass or the random number is greater than the tree probability
         return None # Return None
     if y + TREE_HEIGHT >= CHUNK_SIZE: # If the height of the tree is greater than the chunk size
@@ -89,7 +160,7 @@ def place_tree(voxels, x, y, z, voxel_id):
     m = 0
     for n, iy in enumerate(range(TREE_H_HEIGHT, TREE_HEIGHT - 1)):
         k = iy % 2
-        rng = int(random() * 2)
+        rng = int(hash_random(world_seed, wx, wy + iy, wz, LEAVES_SALT) * 2)
         for ix in range(-TREE_H_WIDTH + m, TREE_H_WIDTH - m * rng):
             for iz in range(-TREE_H_WIDTH + m * rng, TREE_H_WIDTH - m):
                 if (ix + iz) % 4:
@@ -1,5 +1,9 @@
+import itertools
+from numba import prange
 from settings import *
+from meshes.chunk_mesh import get_section_index
 from meshes.chunk_mesh_builder import get_chunk_index
+from voxel_storage import get_voxel
 
 class VoxelHandler:
     def __init__(self, world):
@@ -14,57 +18,72 @@ class VoxelHandler:
         self.voxel_local_pos = None
         self.voxel_world_pos = None
         self.voxel_normal = None
+        self.ray_key = None # Player pose and voxels version of the last ray cast, its result is kept until one of them changes
 
         self.interaction_mode = 0  # 0: remove voxel   1: add voxel
-        self.new_voxel_id = DIRT
+        self.new_voxel_id = PLACEABLE_BLOCKS[0]
+
+        self.dirty_sections = {} # Chunk -> indices of its sections edited during this frame
 
     def add_voxel(self):
         if self.voxel_id:
             # check voxel id along normal
             result = self.get_voxel_info(self.voxel_world_pos + self.voxel_normal)
+            if result is None: # The chunk isn't loaded (edge of the loaded area or above the world)
+                return
 
             # is the new place empty?
             if not result[0]:
                 _, voxel_index, _, chunk = result
-                chunk.voxels[voxel_index] = self.new_voxel_id
-                chunk.mesh.rebuild()
+                self.edit_voxel(chunk, voxel_index, self.new_voxel_id)
+                self.update_light(self.voxel_world_pos + self.voxel_normal)
 
                 # was it an empty chunk
                 if chunk.is_empty:
                     chunk.is_empty = False
 
-    def rebuild_chunk(self, adj_voxel_pos):
-        """Rebuild a chunk based identified by the a voxel position."""
-        index = get_chunk_index(adj_voxel_pos) # Get chunk index
-        if index != -1: # If chunk exists
-            self.chunks[index].mesh.rebuild() # Rebuild mesh
-
-    def rebuild_adjacent_chunks(self):
-        lx, ly, lz = self.voxel_local_pos
-        wx, wy, wz = self.voxel_world_pos
-
-        if lx == 0:
-            self.rebuild_chunk((wx - 1, wy, wz))
-        elif lx == CHUNK_SIZE - 1:
-            self.rebuild_chunk((wx + 1, wy, wz))
-
-        if ly == 0:
-            self.rebuild_chunk((wx, wy - 1, wz))
-        elif ly == CHUNK_SIZE - 1:
-            self.rebuild_chunk((wx, wy + 1, wz))
-
-        if lz == 0:
-            self.rebuild_chunk((wx, wy, wz - 1))
-        elif lz == CHUNK_SIZE - 1:
-            self.rebuild_chunk((wx, wy, wz + 1))
+    def edit_voxel(self, chunk, voxel_index, voxel_id):
+        """Change a voxel of a chunk and record the edit, only the edits are saved (consult world_save.py)."""
+        self.world.voxels.set_voxel(chunk.index, voxel_index, voxel_id)
+        chunk.edits[voxel_index] = voxel_id
+        chunk.is_saved = False # The edit has to be saved
+
+    def update_light(self, voxel_world_pos):
+        """Update the light around a voxel that just changed and mark the sections to rebuild (the voxels whose light changed included)."""
+        changed_box = self.world.lighting.update_voxel(voxel_world_pos)
+        self.mark_dirty(voxel_world_pos)
+        if changed_box:
+            self.mark_dirty(*changed_box)
+
+    def mark_dirty(self, voxel_world_pos, last_voxel_world_pos=None):
+        """
+        Mark the sections whose mesh depends on the given voxel (or on the box of voxels up to last_voxel_world_pos):
+        the ones that contain it and the ones that touch it (diagonals included because of ambient occlusion),
+        even if they belong to the adjacent chunks. The sections are rebuilt once at the end of the frame (see flush_dirty).
+        """
+        if last_voxel_world_pos is None:
+            last_voxel_world_pos = voxel_world_pos
+        # (chunk coordinate, section coordinate) of the voxels and of their neighbours, along each axis
+        axes = [{(coord // CHUNK_SIZE, coord % CHUNK_SIZE // SECTION_SIZE) for coord in range(first - 1, last + 2)}
+                for first, last in zip(voxel_world_pos, last_voxel_world_pos)]
+
+        for (cx, sx), (cy, sy), (cz, sz) in itertools.product(*axes):
+            chunk = self.world.get_chunk(cx, cy, cz)
+            if chunk and chunk.mesh:
+                self.dirty_sections.setdefault(chunk, set()).add(get_section_index(sx, sy, sz))
+
+    def flush_dirty(self):
+        """Rebuild the sections edited during this frame (a chunk edited several times is only rebuilt once)."""
+        for chunk, sections in self.dirty_sections.items():
+            chunk.mesh.rebuild(sections)
+        self.dirty_sections.clear()
 
     def remove_voxel(self):
         """Remove a voxel from the world."""
         if self.voxel_id: # If voxel exists
-            self.chunk.voxels[self.voxel_index] = 0 # Set voxel to air
+            self.edit_voxel(self.chunk, self.voxel_index, 0) # Set voxel to air
 
-            self.chunk.mesh.rebuild() # Rebuild mesh
-            self.rebuild_adjacent_chunks() # Rebuild adjacent chunks
+            self.update_light(self.voxel_world_pos) # Rebuild the sections around the voxel (and the ones it lit) at the end of the frame
 
     def set_voxel(self):
         """Set a voxel in the world."""	
@@ -77,80 +96,121 @@ class VoxelHandler:
         """Switch between add and remove voxel mode."""
         self.interaction_mode = not self.interaction_mode # Switch mode
 
+    def switch_block(self):
+        """Switch to the next block of PLACEABLE_BLOCKS to add."""
+        self.new_voxel_id = PLACEABLE_BLOCKS[(PLACEABLE_BLOCKS.index(self.new_voxel_id) + 1) % len(PLACEABLE_BLOCKS)]
+
     def update(self):
+        self.flush_dirty()
         self.ray_cast()
 
-    def ray_cast(self):
-        """Ray casting algorithm to find the voxel the player is looking at."""
-        # Start point of the ray
-        x1, y1, z1 = self.engine.player.position # Player position
-        # End point of the ray
-        x2, y2, z2 = self.engine.player.position + self.engine.player.forward * MAX_RAY_DIST # Player position + forward vector * max ray distance
-
-        current_voxel_pos = glm.ivec3(x1, y1, z1) # Current voxel position
-        self.voxel_id = 0 # Voxel id
-        self.voxel_normal = glm.ivec3(0) # Voxel normal
-        step_dir = -1 
-
-        dx = glm.sign(x2 - x1)
-        delta_x = min(dx / (x2 - x1), 10000000.0) if dx != 0 else 10000000.0
-        max_x = delta_x * (1.0 - glm.fract(x1)) if dx > 0 else delta_x * glm.fract(x1)
-
-        dy = glm.sign(y2 - y1)
-        delta_y = min(dy / (y2 - y1), 10000000.0) if dy != 0 else 10000000.0
-        max_y = delta_y * (1.0 - glm.fract(y1)) if dy > 0 else delta_y * glm.fract(y1)
-
-        dz = glm.sign(z2 - z1)
-        delta_z = min(dz / (z2 - z1), 10000000.0) if dz != 0 else 10000000.0
-        max_z = delta_z * (1.0 - glm.fract(z1)) if dz > 0 else delta_z * glm.fract(z1)
-
-        while not (max_x > 1.0 and max_y > 1.0 and max_z > 1.0):
-
-            result = self.get_voxel_info(voxel_world_pos=current_voxel_pos)
-            if result[0]:
-                self.voxel_id, self.voxel_index, self.voxel_local_pos, self.chunk = result
-                self.voxel_world_pos = current_voxel_pos
-
-                if step_dir == 0:
-                    self.voxel_normal.x = -dx
-                elif step_dir == 1:
-                    self.voxel_normal.y = -dy
-                else:
-                    self.voxel_normal.z = -dz
-                return True
-
-            if max_x < max_y:
-                if max_x < max_z:
-                    current_voxel_pos.x += dx
-                    max_x += delta_x
-                    step_dir = 0
-                else:
-                    current_voxel_pos.z += dz
-                    max_z += delta_z
-                    step_dir = 2
-            else:
-                if max_y < max_z:
-                    current_voxel_pos.y += dy
-                    max_y += delta_y
-                    step_dir = 1
-                else:
-                    current_voxel_pos.z += dz
-                    max_z += delta_z
-                    step_dir = 2
-        return False
+    def ray_cast(self) -> bool:
+        """Find the voxel the player is looking at (consult cast_ray for more information), True if there is one."""
+        player = self.engine.player
+        position, forward = tuple(player.position), tuple(player.forward)
+        key = position, forward, self.world.voxels.version
+        if key == self.ray_key: # Same pose and no voxel changed: same voxel as the last frame
+            return bool(self.voxel_id)
+        self.ray_key = key
+
+        voxel_id, x, y, z, nx, ny, nz = cast_ray(position, forward, MAX_RAY_DIST, self.world.voxels.arrays, self.world.chunk_coords)
+        self.voxel_id = voxel_id
+        if not voxel_id:
+            return False
+
+        self.voxel_world_pos = glm.ivec3(x, y, z)
+        self.voxel_normal = glm.ivec3(nx, ny, nz)
+        self.voxel_id, self.voxel_index, self.voxel_local_pos, self.chunk = self.get_voxel_info(self.voxel_world_pos)
+        return True
+
+    def cast_rays(self, origins, directions, max_dist=MAX_RAY_DIST) -> np.array:
+        """
+        Cast many rays at once (line of sight tests, tools...): origins and directions are n x 3 arrays (unit directions).
+        Returns an n x 7 int32 array, each row is the result of cast_ray for a ray (voxel id 0: nothing hit).
+        """
+        origins = np.ascontiguousarray(origins, dtype='float64')
+        directions = np.ascontiguousarray(directions, dtype='float64')
+        hits = np.empty([len(origins), 7], dtype='int32')
+        cast_rays(origins, directions, max_dist, self.world.voxels.arrays, self.world.chunk_coords, hits)
+        return hits
 
     def get_voxel_info(self, voxel_world_pos) -> tuple:
-        """Get the voxel id of a voxel in the world."""
-        cx, cy, cz = chunk_pos = voxel_world_pos / CHUNK_SIZE # Get chunk position
-
-        if 0 <= cx < WORLD_W and 0 <= cy < WORLD_H and 0 <= cz < WORLD_D: # If chunk position is within world dimensions
-            chunk_index = cx + WORLD_W * cz + WORLD_AREA * cy # Get chunk index
-            chunk = self.chunks[chunk_index] # Get chunk
+        """Get (voxel id, voxel index, local position, chunk) of a voxel in the world, None if its chunk isn't loaded."""
+        wx, wy, wz = voxel_world_pos
+        chunk_pos = glm.ivec3(wx // CHUNK_SIZE, wy // CHUNK_SIZE, wz // CHUNK_SIZE) # Get chunk position (floor division also works with negative coordinates)
+        chunk = self.world.get_chunk(*chunk_pos) # Get chunk (None if it is not loaded)
 
+        if chunk: # If the chunk is loaded
             lx, ly, lz = voxel_local_pos = voxel_world_pos - chunk_pos * CHUNK_SIZE # Get voxel local position
 
             voxel_index = lx + CHUNK_SIZE * lz + CHUNK_AREA * ly # Get voxel index
-            voxel_id = chunk.voxels[voxel_index] # Get voxel id
+            voxel_id = self.world.voxels.get_voxel(chunk.index, voxel_index) # Get voxel id
 
             return voxel_id, voxel_index, voxel_local_pos, chunk
-        return 0, 0, 0, 0
+        return None
+
+@njit(cache=True)
+def cast_ray(origin, direction, max_dist, world_voxels, chunk_coords):
+    """
+    Walk the voxels crossed by the segment from origin to origin + direction * max_dist (DDA) until a solid one.
+    Returns (voxel_id, x, y, z, nx, ny, nz): the world position of the voxel and the normal of the face the ray went
+    through (0, 0, 0 and voxel_id 0 if the segment only crosses air or chunks that aren't loaded).
+    """
+    x1, y1, z1 = origin
+    x2, y2, z2 = x1 + direction[0] * max_dist, y1 + direction[1] * max_dist, z1 + direction[2] * max_dist
+    x, y, z = math.floor(x1), math.floor(y1), math.floor(z1) # Current voxel (floor instead of truncation for negative coordinates)
+
+    # Step along each axis, fraction of the segment between two voxel borders and fraction at the next border
+    dx = (x2 > x1) - (x2 < x1)
+    delta_x = min(dx / (x2 - x1), 10000000.0) if dx != 0 else 10000000.0
+    max_x = delta_x * (1.0 - (x1 - x)) if dx > 0 else delta_x * (x1 - x)
+
+    dy = (y2 > y1) - (y2 < y1)
+    delta_y = min(dy / (y2 - y1), 10000000.0) if dy != 0 else 10000000.0
+    max_y = delta_y * (1.0 - (y1 - y)) if dy > 0 else delta_y * (y1 - y)
+
+    dz = (z2 > z1) - (z2 < z1)
+    delta_z = min(dz / (z2 - z1), 10000000.0) if dz != 0 else 10000000.0
+    max_z = delta_z * (1.0 - (z1 - z)) if dz > 0 else delta_z * (z1 - z)
+
+    step_dir = -1
+    while not (max_x > 1.0 and max_y > 1.0 and max_z > 1.0):
+        chunk_index = get_chunk_index((x, y, z), chunk_coords)
+        if chunk_index != -1:
+            voxel_id = int(get_voxel(world_voxels, chunk_index, x % CHUNK_SIZE + CHUNK_SIZE * (z % CHUNK_SIZE) + CHUNK_AREA * (y % CHUNK_SIZE)))
+            if voxel_id:
+                if step_dir == 0:
+                    return voxel_id, x, y, z, -dx, 0, 0
+                elif step_dir == 1:
+                    return voxel_id, x, y, z, 0, -dy, 0
+                return voxel_id, x, y, z, 0, 0, -dz
+
+        if max_x < max_y:
+            if max_x < max_z:
+                x += dx
+                max_x += delta_x
+                step_dir = 0
+            else:
+                z += dz
+                max_z += delta_z
+                step_dir = 2
+        else:
+            if max_y < max_z:
+                y += dy
+                max_y += delta_y
+                step_dir = 1
+            else:
+                z += dz
+                max_z += delta_z
+                step_dir = 2
+    return 0, x, y, z, 0, 0, 0
+
+@njit(parallel=True, cache=True)
+def cast_rays(origins, directions, max_dist, world_voxels, chunk_coords, hits):
+    """Cast the rays of the rows of origins and directions on all the cores, row i of hits gets the result of cast_ray for ray i."""
+    for i in prange(len(origins)):
+        origin = origins[i, 0], origins[i, 1], origins[i, 2]
+        direction = directions[i, 0], directions[i, 1], directions[i, 2]
+        hit = cast_ray(origin, direction, max_dist, world_voxels, chunk_coords)
+        for j in range(7):
+            hits[i, j] = hit[j]
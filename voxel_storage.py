@@ -0,0 +1,235 @@
+from settings import *
+
+# Compact voxel storage: every chunk of the chunk table has a slot (int64) that describes how its voxels are stored
+#   uniform  all the voxels have the same id           slot = voxel_id << 8
+#   palette  up to 16 different ids, BITS bits a voxel  slot = offset << 8 | BITS (1, 2 or 4)
+#            data[offset:offset + PALETTE_SIZE] is the palette, the packed indices follow
+#   dense    one byte a voxel like a plain chunk        slot = offset << 8 | 8
+# The blocks of data are never changed in place when a chunk changes representation: the new block is appended and then the
+# slot is replaced with a single store, so meshes built on other threads always read a consistent (maybe old) chunk.
+UNIFORM = 0
+DENSE = 8
+PALETTE_SIZE = 16
+
+@njit(cache=True)
+def get_block_size(bits):
+    """Bytes of data used by a chunk stored with the given bits per voxel (0 for uniform chunks)."""
+    if bits == UNIFORM:
+        return 0
+    if bits == DENSE:
+        return CHUNK_VOL
+    return PALETTE_SIZE + CHUNK_VOL * bits // 8
+
+@njit(cache=True)
+def get_voxel(world_voxels, chunk_index, voxel_index):
+    """Get the id of a voxel of the chunk in the given row of the chunk table (world_voxels is VoxelStorage.arrays)."""
+    slots, data = world_voxels
+    slot = slots[chunk_index]
+    bits = slot & 15
+
+    if bits == UNIFORM:
+        return (slot >> 8) & 255
+    offset = slot >> 8
+    if bits == DENSE:
+        return data[offset + voxel_index]
+
+    # shifts instead of divisions: bits is 1, 2 or 4 so log2(bits) is bits >> 1 and a byte holds 8 >> log2(bits) voxels
+    log_bits = bits >> 1
+    packed = data[offset + PALETTE_SIZE + (voxel_index >> (3 - log_bits))]
+    shift = (voxel_index & ((8 >> log_bits) - 1)) << log_bits
+    return data[offset + ((packed >> shift) & ((1 << bits) - 1))]
+
+@njit(nogil=True, cache=True)
+def decode_chunk(world_voxels, chunk_index, voxels):
+    """Write all the voxels of a chunk into voxels (CHUNK_VOL uint8)."""
+    slots, data = world_voxels
+    slot = slots[chunk_index]
+    bits = slot & 15
+    offset = slot >> 8
+
+    if bits == UNIFORM:
+        voxels[:] = (slot >> 8) & 255
+    elif bits == DENSE:
+        voxels[:] = data[offset:offset + CHUNK_VOL]
+    else:
+        log_bits = bits >> 1
+        mask = (1 << bits) - 1
+        for i in range(CHUNK_VOL):
+            packed = data[offset + PALETTE_SIZE + (i >> (3 - log_bits))]
+            voxels[i] = data[offset + ((packed >> ((i & ((8 >> log_bits) - 1)) << log_bits)) & mask)]
+
+@njit(nogil=True, cache=True)
+def decode_box(world_voxels, chunk_index, x0, x1, y0, y1, z0, z1, voxels, start, row, area):
+    """
+    Write the voxels of a box of a chunk (local coordinates, the ends excluded) into voxels: the voxel (x, y, z) goes to
+    start + (x - x0) + row * (z - z0) + area * (y - y0). The representation of the chunk is checked once for the whole box.
+    """
+    slots, data = world_voxels
+    slot = slots[chunk_index]
+    bits = slot & 15
+    offset = slot >> 8
+    log_bits = bits >> 1
+    mask = (1 << bits) - 1
+
+    for y in range(y0, y1):
+        for z in range(z0, z1):
+            i = CHUNK_SIZE * z + CHUNK_AREA * y # First voxel of the row of the chunk
+            j = start + row * (z - z0) + area * (y - y0) # and where it goes
+            if bits == UNIFORM:
+                voxels[j:j + x1 - x0] = (slot >> 8) & 255
+            elif bits == DENSE:
+                voxels[j:j + x1 - x0] = data[offset + i + x0:offset + i + x1]
+            else:
+                for x in range(x0, x1):
+                    packed = data[offset + PALETTE_SIZE + ((i + x) >> (3 - log_bits))]
+                    voxels[j + x - x0] = data[offset + ((packed >> (((i + x) & ((8 >> log_bits) - 1)) << log_bits)) & mask)]
+
+@njit(cache=True)
+def encode_chunk(voxels, block):
+    """
+    Find the smallest representation of the voxels (CHUNK_VOL uint8) and write its data to block.
+    Returns (bits, size of the data), for uniform chunks size is the voxel id.
+    """
+    palette_index = np.full(256, -1, dtype=np.int32) # Voxel id -> index in the palette
+    palette_len = 0
+    for i in range(CHUNK_VOL):
+        voxel_id = voxels[i]
+        if palette_index[voxel_id] == -1:
+            palette_index[voxel_id] = palette_len
+            if palette_len < PALETTE_SIZE:
+                block[palette_len] = voxel_id
+            palette_len += 1
+
+    if palette_len == 1:
+        return UNIFORM, int(voxels[0])
+    if palette_len > PALETTE_SIZE:
+        block[:CHUNK_VOL] = voxels
+        return DENSE, CHUNK_VOL
+
+    block[palette_len:PALETTE_SIZE] = block[0] # Unused entries
+    bits = 1
+    while (1 << bits) < palette_len:
+        bits *= 2 # 1, 2 or 4 so voxels never straddle two bytes
+    log_bits = bits >> 1
+
+    packed = block[PALETTE_SIZE:PALETTE_SIZE + CHUNK_VOL * bits // 8]
+    packed[:] = 0
+    for i in range(CHUNK_VOL):
+        packed[i >> (3 - log_bits)] |= palette_index[voxels[i]] << ((i & ((8 >> log_bits) - 1)) << log_bits)
+    return bits, PALETTE_SIZE + CHUNK_VOL * bits // 8
+
+@njit(cache=True)
+def set_packed_voxel(world_voxels, chunk_index, voxel_index, voxel_id) -> bool:
+    """Change a voxel of a palette or dense chunk in place, returns False if the chunk has to change representation."""
+    slots, data = world_voxels
+    slot = slots[chunk_index]
+    bits = slot & 15
+    offset = slot >> 8
+
+    if bits == UNIFORM:
+        return voxel_id == (slot >> 8) & 255
+    if bits == DENSE:
+        data[offset + voxel_index] = voxel_id
+        return True
+
+    for palette_id in range(1 << bits):
+        if data[offset + palette_id] == voxel_id:
+            log_bits = bits >> 1
+            shift = (voxel_index & ((8 >> log_bits) - 1)) << log_bits
+            byte_index = offset + PALETTE_SIZE + (voxel_index >> (3 - log_bits))
+            data[byte_index] = (data[byte_index] & ~(((1 << bits) - 1) << shift)) | (palette_id << shift)
+            return True
+    return False
+
+@njit(cache=True)
+def compact(slots, data, new_data):
+    """Copy the blocks of the chunks into new_data one after the other, returns the new slots and the bytes used."""
+    new_slots = slots.copy()
+    used = 0
+    for i in range(len(slots)):
+        bits = slots[i] & 15
+        size = get_block_size(bits)
+        if size:
+            offset = slots[i] >> 8
+            new_data[used:used + size] = data[offset:offset + size]
+            new_slots[i] = used << 8 | bits
+            used += size
+    return new_slots, used
+
+class VoxelStorage:
+    """
+    Voxels of all the chunks of the chunk table, stored in the smallest of three representations (see above).
+    Chunks of a single voxel id (air above the terrain, stone under it) only take their slot.
+    """
+
+    def __init__(self, num_chunks):
+        self.slots = np.zeros(num_chunks, dtype='int64') # Every chunk starts as air
+        self.data = np.empty(0, dtype='uint8')
+        self.used = 0 # Bytes of data in use (live blocks and old blocks not compacted yet)
+        self.arrays = self.slots, self.data # What the njit functions take (replaced as a whole when data is reallocated)
+        self.block = np.empty(CHUNK_VOL, dtype='uint8') # Scratch buffer for encode_chunk
+        self.version = 0 # Changes with every stored chunk or voxel, so results computed from the voxels can be reused until then
+
+    def allocate(self, size) -> int:
+        """Get the offset of size free bytes of data, compacting and growing it if needed."""
+        if self.used + size > len(self.data):
+            # New arrays instead of changing the old ones, jobs that are still reading them keep working
+            live = sum(int(get_block_size(bits)) for bits in self.slots & 15)
+            new_data = np.empty(max(2 * (live + size), CHUNK_VOL), dtype='uint8')
+            self.slots, self.used = compact(self.slots, self.data, new_data)
+            self.data = new_data
+            self.arrays = self.slots, self.data
+
+        offset = self.used
+        self.used += size
+        return offset
+
+    def store(self, chunk_index, voxels):
+        """Store the voxels (CHUNK_VOL uint8) of a chunk in its row."""
+        self.version += 1
+        bits, size = encode_chunk(voxels, self.block)
+        if bits == UNIFORM:
+            self.slots[chunk_index] = int(size) << 8
+            return
+
+        offset = self.allocate(int(size))
+        self.data[offset:offset + size] = self.block[:size]
+        self.slots[chunk_index] = offset << 8 | int(bits) # The data is ready before the slot points to it
+
+    def get_chunk(self, chunk_index) -> np.array:
+        """Get a copy of the voxels of a chunk (CHUNK_VOL uint8)."""
+        voxels = np.empty(CHUNK_VOL, dtype='uint8')
+        decode_chunk(self.arrays, chunk_index, voxels)
+        return voxels
+
+    def get_voxel(self, chunk_index, voxel_index) -> int:
+        return get_voxel(self.arrays, chunk_index, voxel_index)
+
+    def set_voxel(self, chunk_index, voxel_index, voxel_id):
+        """Change a voxel, the chunk is stored again if its id doesn't fit the current representation."""
+        self.version += 1
+        if set_packed_voxel(self.arrays, chunk_index, voxel_index, voxel_id):
+            return
+
+        voxels = self.get_chunk(chunk_index)
+        voxels[voxel_index] = voxel_id
+        self.store(chunk_index, voxels)
+
+    def is_empty(self, chunk_index) -> bool:
+        """Check if a chunk is made only of air."""
+        return self.slots[chunk_index] == 0
+
+    def get_report(self, chunk_indices) -> dict:
+        """Memory used by the given chunks compared to storing each of them in CHUNK_VOL bytes."""
+        bits = self.slots[chunk_indices] & 15
+        report = {
+            'chunks': len(chunk_indices),
+            'uniform': int(np.sum(bits == UNIFORM)),
+            'palette': int(np.sum((bits != UNIFORM) & (bits != DENSE))),
+            'dense': int(np.sum(bits == DENSE)),
+            'dense_bytes': len(chunk_indices) * CHUNK_VOL,
+            'bytes': len(chunk_indices) * self.slots.itemsize + sum(int(get_block_size(b)) for b in bits),
+            'allocated_bytes': self.slots.nbytes + self.data.nbytes, # Including free space and old blocks
+        }
+        report['saved_bytes'] = report['dense_bytes'] - report['bytes']
+        return report
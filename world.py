@@ -1,69 +1,315 @@
 from settings import *
+from numba import config, set_num_threads, get_num_threads
 from world_objects.chunk import Chunk
+from terrain_gen import build_heightmap, generate_terrain_parallel
+from noise import noise_tables
+from chunk_table import UNLOADED, get_column_index, get_table_index
 from voxel_handler import VoxelHandler
+from physics import Physics
+from world_save import WorldSave
+from voxel_storage import VoxelStorage, get_voxel
+from lighting import Lighting
+from meshes.chunk_arena import ChunkArena
+from meshes.chunk_mesh_builder import ALL_FACES_CONNECTED
 
 class World:
     def __init__(self, engine):
         self.engine = engine
-        self.chunks = [None for _ in range(WORLD_VOL)]
-        self.voxels = np.empty([WORLD_VOL, CHUNK_VOL], dtype='uint8')
-        self.build_chunks()
-        self.build_chunk_mesh()
+        # Chunk table: row get_table_index(x, y, z) holds the chunk at chunk coordinates (x, y, z)
+        # In a streaming world the rows are recycled as the player moves, so memory only depends on STREAM_RADIUS
+        self.chunks = [None for _ in range(CHUNK_TABLE_VOL)]
+        self.voxels = VoxelStorage(CHUNK_TABLE_VOL) # Compressed voxels of every row (consult voxel_storage.py for more information)
+        self.chunk_coords = np.full([CHUNK_TABLE_VOL, 3], UNLOADED, dtype='int32') # Chunk coordinates of the chunk stored in each row
+        self.heightmap = np.empty([CHUNK_TABLE_AREA, CHUNK_AREA], dtype='int32') # Terrain height of every column, shared by the chunks stacked on it
+        self.mesh_vertices = np.zeros(CHUNK_TABLE_VOL, dtype='int32') # Vertices of the mesh on the GPU of the chunk in each row (0: nothing to draw)
+        self.chunk_lods = np.zeros(CHUNK_TABLE_VOL, dtype='int32') # Level of detail the mesh of each row is built with (0: full resolution, see update_lods)
+        self.changed_lods = np.empty(CHUNK_TABLE_VOL, dtype='int32') # Rows that changed level during the last update_lods
+        self.chunk_visibility = np.full(CHUNK_TABLE_VOL, ALL_FACES_CONNECTED, dtype='int64') # Faces of each chunk connected through air (occlusion culling, consult frustum.py)
+        self.arena = ChunkArena(engine) # Vertex buffer holding the meshes of all the rows
+        self.lighting = Lighting(self) # Sky and block light of every voxel of the rows (consult lighting.py for more information)
+
+        self.player_column = None # Chunk column (x, z) the player was in during the last streaming update
+        self.pending_columns = [] # Chunk columns (x, z) around the player still to generate, the nearest one is last
+        self.world_save = WorldSave() if LOAD_SAVED_WORLD or SAVE_ON_EXIT else None
+
+        profiler = self.engine.startup_profiler
+        if STREAMING_WORLD:
+            self.stream_chunks(max_columns=None) # Load the whole view distance before the first frame
+        else:
+            with profiler.section('terrain generation'):
+                self.build_chunks()
+            with profiler.section('meshing'):
+                self.update_lods() # The chunks far from the player are meshed at a lower resolution from the start
+                self.build_chunk_mesh()
+        if BACKGROUND_MESHING:
+            with profiler.section('meshing'):
+                self.engine.mesh_scheduler.flush() # Start with every mesh on the GPU
         self.voxel_handler = VoxelHandler(self)
+        self.physics = Physics(self) # Fixed timestep collisions against the voxels (consult physics.py for more information)
 
     def update(self):
+        if STREAMING_WORLD:
+            self.stream_chunks()
+        self.update_lods()
         self.voxel_handler.update()
 
+    def update_lods(self):
+        """Update the level of detail of the chunks from their distance to the player, the meshes of the ones that changed level are rebuilt."""
+        if not LOD_DISTANCES:
+            return
+        count = update_lods(self.chunk_coords, tuple(self.engine.player.position), self.chunk_lods, self.changed_lods)
+        for chunk_index in self.changed_lods[:count]:
+            chunk = self.chunks[chunk_index]
+            if chunk and chunk.mesh: # The old mesh is drawn until the new one is uploaded
+                chunk.mesh.rebuild(sections=())
+        self.engine.frame_profiler.count('lod changes', count)
+
+    def build_heightmap(self, columns):
+        """Compute the terrain height of the given chunk columns (once for all the WORLD_H chunks of a column)."""
+        column_positions = np.array(columns, dtype='int64')
+        build_heightmap(self.heightmap, column_positions, noise_tables)
+
+    def get_column_heights(self, chunk_position):
+        """Get the heightmap of the column of chunks that contains the given chunk (indexed x + CHUNK_SIZE * z)."""
+        cx, _, cz = chunk_position
+        return self.heightmap[get_column_index(cx, cz)]
+
+    def get_height(self, world_x, world_z) -> int:
+        """Get the generated terrain height at the given world column (0 if the column is not loaded)."""
+        chunk_x, local_x = divmod(math.floor(world_x), CHUNK_SIZE)
+        chunk_z, local_z = divmod(math.floor(world_z), CHUNK_SIZE)
+
+        if self.get_chunk(chunk_x, 0, chunk_z):
+            return int(self.get_column_heights((chunk_x, 0, chunk_z))[local_x + CHUNK_SIZE * local_z])
+        return 0
+
+    def get_top_block(self, world_x, world_z) -> int:
+        """
+        Get the height of the highest solid voxel of a column (including trees and player edits), -1 if the column is empty or not loaded.
+        Unlike get_height it reads the voxels, so it also works after the terrain has been edited.
+        """
+        chunk_x, local_x = divmod(math.floor(world_x), CHUNK_SIZE)
+        chunk_z, local_z = divmod(math.floor(world_z), CHUNK_SIZE)
+
+        if self.get_chunk(chunk_x, 0, chunk_z):
+            return int(get_top_block(self.voxels.arrays, get_column_index(chunk_x, chunk_z), local_x + CHUNK_SIZE * local_z))
+        return -1
+
     def build_chunks(self):
-        for x in range(WORLD_W):
+        columns = [(x, z) for z in range(WORLD_D) for x in range(WORLD_W)]
+        self.load_columns(columns)
+
+    def load_columns(self, columns) -> list:
+        """
+        Load (or generate if they weren't saved) the chunks of the given chunk columns (x, z) and store them in the chunk table.
+        The chunks that were stored in the same rows are released (and saved if they changed). Returns the new chunks.
+        """
+        self.build_heightmap(columns) # Also needed by saved columns (get_height)
+
+        chunks = []
+        for x, z in columns:
             for y in range(WORLD_H):
-                for z in range(WORLD_D):
-                    chunk = Chunk(self, position=(x, y, z))
+                chunk = Chunk(self, position=(x, y, z))
+
+                chunk_index = get_table_index(x, y, z)
+                old_chunk = self.chunks[chunk_index]
+                if SAVE_ON_EXIT and old_chunk and not old_chunk.is_saved: # Save its edits before the chunk is released
+                    self.world_save.save_edits(old_chunk.position, old_chunk.edits)
+                self.chunks[chunk_index] = chunk
+                self.chunk_coords[chunk_index] = x, y, z
+                self.mesh_vertices[chunk_index] = 0 # Until the mesh of the new chunk is uploaded
+                self.chunk_visibility[chunk_index] = ALL_FACES_CONNECTED # Seen through until its mesh is built
+                self.arena.release(chunk_index)
+
+                chunk.index = chunk_index # row of its voxels
+                chunks.append(chunk)
+
+        if LOAD_SAVED_WORLD: # Only the edits are saved, the chunks are generated and then edited again
+            for chunk in chunks:
+                chunk.edits = self.world_save.load_edits(chunk.position) or {} # Only reads this chunk from its region file
 
-                    chunk_index = x + WORLD_W * z + WORLD_AREA * y
-                    self.chunks[chunk_index] = chunk
+        if PARALLEL_WORLD_GEN:
+            for i in range(0, len(chunks), WORLD_GEN_BATCH):
+                self.build_voxels_parallel(chunks[i:i + WORLD_GEN_BATCH])
+        else:
+            for chunk in chunks:
+                self.voxels.store(chunk.index, apply_edits(chunk.build_voxels(), chunk.edits))
 
-                    # put the chunk voxels in a separate array
-                    self.voxels[chunk_index] = chunk.build_voxels()
+        for chunk in chunks:
+            chunk.is_empty = self.voxels.is_empty(chunk.index)
+        self.lighting.light_columns(chunks) # Also spreads into the loaded columns around, meshed again by stream_chunks
+        return chunks
 
-                    # get pointer to voxels
-                    chunk.voxels = self.voxels[chunk_index]
+    def build_voxels_parallel(self, chunks, threads=WORLD_GEN_THREADS):
+        """Generate the voxels of the given chunks at once, spreading them across the CPU cores."""
+        if not chunks:
+            return
+        chunk_positions = np.array([chunk.position for chunk in chunks], dtype='int64')
+
+        default_threads = get_num_threads()
+        if threads:
+            set_num_threads(min(threads, config.NUMBA_NUM_THREADS)) # Can't use more threads than numba started with
+        chunks_voxels = np.empty([len(chunks), CHUNK_VOL], dtype='uint8')
+        generate_terrain_parallel(chunks_voxels, self.heightmap, chunk_positions, noise_tables, SEED)
+        set_num_threads(default_threads)
+
+        for chunk, voxels in zip(chunks, chunks_voxels):
+            self.voxels.store(chunk.index, apply_edits(voxels, chunk.edits))
+
+    def save(self):
+        """Save the edits of the chunks edited since they were loaded, and the seed of the world."""
+        for chunk in self.chunks:
+            if chunk and not chunk.is_saved:
+                self.world_save.save_edits(chunk.position, chunk.edits)
+                chunk.is_saved = True
+        self.world_save.save_meta()
+        self.world_save.close() # Write everything to disk (region files are opened again if needed)
+
+    def get_memory_report(self) -> dict:
+        """Memory used by the voxels of the loaded chunks (consult VoxelStorage.get_report for more information)."""
+        return self.voxels.get_report([chunk.index for chunk in self.chunks if chunk])
 
     def build_chunk_mesh(self):
         for chunk in self.chunks:
             chunk.build_mesh()
 
-    def get_voxel_bounds(self, world_pos) -> tuple:
+    def is_column_loaded(self, x, z) -> bool:
+        """Check if the chunk column at chunk coordinates (x, z) is in the chunk table."""
+        cx, _, cz = self.chunk_coords[get_column_index(x, z)]
+        return cx == x and cz == z
+
+    def stream_chunks(self, max_columns=STREAM_COLUMNS_PER_FRAME):
         """
-        Get the voxel bounding box for the given world position.
+        Generate the chunk columns that came into view around the player, nearest first (at most max_columns, None for no limit).
+        A new column takes the rows of the one that left the view on the opposite side, then it is meshed with its neighbours.
         """
-        world_x, world_y, world_z = world_pos
+        player_x, _, player_z = self.engine.player.position
+        player_column = math.floor(player_x / CHUNK_SIZE), math.floor(player_z / CHUNK_SIZE)
+
+        if player_column != self.player_column: # The player entered another column: update the columns to load
+            self.player_column = px, pz = player_column
+            window = [(px + dx, pz + dz) for dx in range(-STREAM_RADIUS, STREAM_RADIUS + 1) for dz in range(-STREAM_RADIUS, STREAM_RADIUS + 1)]
+            self.pending_columns = [column for column in window if not self.is_column_loaded(*column)]
+            self.pending_columns.sort(key=lambda column: (column[0] - px) ** 2 + (column[1] - pz) ** 2, reverse=True)
+
+        if not self.pending_columns:
+            return
+
+        num_columns = len(self.pending_columns) if max_columns is None else min(max_columns, len(self.pending_columns))
+        columns = [self.pending_columns.pop() for _ in range(num_columns)]
+        profiler = self.engine.startup_profiler # Only records the first call, made before the first frame
+        with profiler.section('terrain generation'):
+            new_chunks = self.load_columns(columns)
+
+        # Faces and ambient occlusion on the borders depend on the neighbours (diagonals included) so those need a new mesh too
+        remesh = {id(chunk): chunk for chunk in new_chunks}
+        for x, z in columns:
+            for dx in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    for y in range(WORLD_H):
+                        chunk = self.get_chunk(x + dx, y, z + dz)
+                        if chunk and chunk.mesh:
+                            remesh[id(chunk)] = chunk
 
-        chunk_x, voxel_x = divmod(int(world_x), CHUNK_SIZE)
-        chunk_y, voxel_y = divmod(int(world_y), CHUNK_SIZE)
-        chunk_z, voxel_z = divmod(int(world_z), CHUNK_SIZE)
+        with profiler.section('meshing'):
+            self.update_lods() # Level of the new chunks (their rows may have been far from the player)
+            for chunk in remesh.values():
+                if chunk.mesh:
+                    chunk.mesh.rebuild()
+                else:
+                    chunk.build_mesh()
 
-        chunk_index = chunk_x + WORLD_W * chunk_z + WORLD_AREA * chunk_y
-        chunk = self.chunks[chunk_index]
+    def get_chunk(self, chunk_x, chunk_y, chunk_z):
+        """Get the chunk at the given chunk coordinates, None if it is not loaded (or outside of the world)."""
+        if not 0 <= chunk_y < WORLD_H:
+            return None
 
-        return chunk.get_voxel_bound_box(voxel_x, voxel_y, voxel_z)
+        chunk_index = get_table_index(chunk_x, chunk_y, chunk_z)
+        x, y, z = self.chunk_coords[chunk_index]
+        if x != chunk_x or z != chunk_z:
+            return None
+        return self.chunks[chunk_index]
 
     def render(self):
-        for chunk in self.chunks:
-            chunk.render()
-    
+        frustum = self.engine.player.frustum
+        profiler = self.engine.frame_profiler
+        if profiler.enabled and OCCLUSION_CULLING: # Chunks in the frustum, to tell how many the occlusion culling skips
+            in_frustum = len(frustum.get_visible_chunks(self.chunk_coords, self.mesh_vertices))
+
+        # Frustum (and occlusion) culling of all the chunks at once, only the visible ones are drawn (all in one go, from the chunk arena)
+        visible = frustum.get_visible_chunks(self.chunk_coords, self.mesh_vertices, self.chunk_visibility if OCCLUSION_CULLING else None)
+        draw_calls = self.arena.render(visible, self.mesh_vertices)
+
+        if profiler.enabled:
+            profiler.count('chunks drawn', len(visible))
+            profiler.count('chunk draw calls', draw_calls)
+            profiler.count('chunks culled', np.count_nonzero(self.mesh_vertices) - len(visible))
+            if OCCLUSION_CULLING:
+                profiler.count('chunks occluded', in_frustum - len(visible))
+                profiler.count('occluded % of frustum', 100 * (in_frustum - len(visible)) / max(in_frustum, 1))
+            profiler.count('triangles', int(self.mesh_vertices[visible].sum()) // 3)
+            for lod, chunks in enumerate(np.bincount(self.chunk_lods[visible], minlength=len(LOD_DISTANCES) + 1)):
+                profiler.count(f'chunks drawn at lod {lod}', chunks)
+
     def get_voxel_id(self, voxel_world_pos):
         """Get the voxel id of a voxel in the world."""
-        cx, cy, cz = chunk_pos = voxel_world_pos / CHUNK_SIZE  # Get chunk position
-
-        if 0 <= cx < WORLD_W and 0 <= cy < WORLD_H and 0 <= cz < WORLD_D:  # If chunk position is within world dimensions
-            chunk_index = int(cx) + WORLD_W * int(cz) + WORLD_AREA * int(cy)  # Get chunk index
-            chunk = self.chunks[chunk_index]  # Get chunk
+        wx, wy, wz = (math.floor(coord) for coord in voxel_world_pos)
+        chunk = self.get_chunk(wx // CHUNK_SIZE, wy // CHUNK_SIZE, wz // CHUNK_SIZE) # Floor division also works with negative coordinates
 
-            lx, ly, lz = voxel_world_pos - chunk_pos * CHUNK_SIZE  # Get voxel local position
+        if chunk:
+            lx, ly, lz = wx % CHUNK_SIZE, wy % CHUNK_SIZE, wz % CHUNK_SIZE  # Get voxel local position
 
-            voxel_index = int(lx) + CHUNK_SIZE * int(lz) + CHUNK_AREA * int(ly)  # Get voxel index
-            voxel_id = chunk.voxels[voxel_index]  # Get voxel id
+            voxel_index = lx + CHUNK_SIZE * lz + CHUNK_AREA * ly  # Get voxel index
+            voxel_id = self.voxels.get_voxel(chunk.index, voxel_index)  # Get voxel id
 
             return voxel_id
         return 0
+
+def apply_edits(voxels, edits) -> np.array:
+    """Write the edits of a chunk (voxel index -> voxel id, consult Chunk.edits) over its generated voxels, returns the voxels."""
+    if edits:
+        voxels[np.fromiter(edits.keys(), dtype='int64', count=len(edits))] = np.fromiter(edits.values(), dtype='uint8', count=len(edits))
+    return voxels
+
+@njit(cache=True)
+def get_top_block(world_voxels, column_index, voxel_index) -> int:
+    """
+    World y of the highest solid voxel at voxel_index (x + CHUNK_SIZE * z) of the column of chunks in the given column of
+    the chunk table, -1 if it is all air. A single scan from the top down, the chunks made only of air are skipped at once.
+    """
+    slots = world_voxels[0]
+    for cy in range(WORLD_H - 1, -1, -1):
+        chunk_index = column_index + CHUNK_TABLE_AREA * cy
+        if slots[chunk_index] == 0: # Only air
+            continue
+        for y in range(CHUNK_SIZE - 1, -1, -1):
+            if get_voxel(world_voxels, chunk_index, voxel_index + CHUNK_AREA * y):
+                return cy * CHUNK_SIZE + y
+    return -1
+
+@njit(cache=True)
+def update_lods(chunk_coords, position, chunk_lods, changed) -> int:
+    """
+    Level of detail of every row of the chunk table: lod + 1 once the center of its chunk is further than LOD_DISTANCES[lod]
+    from position, with LOD_HYSTERESIS voxels of margin in both directions before it changes. The rows whose level
+    changed are written to changed, returns how many they are.
+    """
+    count = 0
+    for i in range(len(chunk_coords)):
+        if chunk_coords[i, 0] == UNLOADED:
+            continue
+        dx = (chunk_coords[i, 0] + 0.5) * CHUNK_SIZE - position[0]
+        dy = (chunk_coords[i, 1] + 0.5) * CHUNK_SIZE - position[1]
+        dz = (chunk_coords[i, 2] + 0.5) * CHUNK_SIZE - position[2]
+        distance = math.sqrt(dx * dx + dy * dy + dz * dz)
+
+        lod = chunk_lods[i]
+        while lod < len(LOD_DISTANCES) and distance > LOD_DISTANCES[lod] + LOD_HYSTERESIS:
+            lod += 1
+        while lod > 0 and distance < LOD_DISTANCES[lod - 1] - LOD_HYSTERESIS:
+            lod -= 1
+        if lod != chunk_lods[i]:
+            chunk_lods[i] = lod
+            changed[count] = i
+            count += 1
+    return count
@@ -1,75 +1,26 @@
-import random
 from settings import *
 from meshes.chunk_mesh import ChunkMesh
-from terrain_gen import *
+from terrain_gen import generate_terrain
+from noise import noise_tables
 
 class Chunk:
     def __init__(self, world, position):
         self.engine = world.engine
         self.world = world
         self.position: glm.vec3 = position
-        self.m_model: glm.mat4x4 = self.get_model_matrix()
-        self.voxels: np.array = None
+        self.index: int = None # Row of the chunk table that holds the chunk (and its voxels in World.voxels)
         self.mesh: ChunkMesh = None
         self.is_empty: bool = True
-
-        self.center: glm.vec3 = (glm.vec3(self.position) + 0.5) * CHUNK_SIZE
-        self.is_on_frustum: bool = self.engine.player.frustum.is_on_frustum
-
-    def get_model_matrix(self):
-        """
-        Get the model matrix for the chunk.
-
-        Returns:
-            glm.mat4x4: The model matrix for the chunk.
-        """
-
-        m_model: glm.mat4x4 = glm.translate(glm.mat4(), glm.vec3(self.position) * CHUNK_SIZE)
-        return m_model
-
-    def set_uniform(self):
-        """
-        Set the uniform variables for the chunk (model matrix).
-        """
-        self.mesh.program['m_model'].write(self.m_model)
+        self.edits: dict = {} # Voxels changed by the player (voxel index -> voxel id), the rest of the chunk is generated (see world_save.py)
+        self.is_saved: bool = True # The edits are the same as in the saved world (nothing to save in a chunk just generated)
 
     def build_mesh(self):
         self.mesh: ChunkMesh = ChunkMesh(self)
 
-    def render(self):
-        if not self.is_empty and self.is_on_frustum(self):
-            self.set_uniform()
-            self.mesh.render()
-
     def build_voxels(self):
+        """Generate the voxels of the chunk (the world stores them, see World.load_columns)."""
         voxels = np.zeros(CHUNK_VOL, dtype='uint8')
 
         cx, cy, cz = glm.ivec3(self.position) * CHUNK_SIZE
-        self.generate_terrain(voxels, cx, cy, cz)
-
-        if np.any(voxels):
-            self.is_empty = False
+        generate_terrain(voxels, self.world.get_column_heights(self.position), cx, cy, cz, noise_tables, SEED)
         return voxels
-
-    def get_voxel_bound_box(self, local_x, local_y, local_z) -> tuple:
-        min_x = self.position[0] * CHUNK_SIZE + local_x
-        max_x = min_x + 1
-        min_y = self.position[1] * CHUNK_SIZE + local_y
-        max_y = min_y + 1
-        min_z = self.position[2] * CHUNK_SIZE + local_z
-        max_z = min_z + 1
-        return (min_x, max_x, min_y, max_y, min_z, max_z)
-
-    @staticmethod
-    @njit
-    def generate_terrain(voxels, cx, cy, cz):
-        for x in range(CHUNK_SIZE):
-            wx = x + cx
-            for z in range(CHUNK_SIZE):
-                wz = z + cz
-                world_height = get_height(wx, wz)
-                local_height = min(world_height - cy, CHUNK_SIZE)
-
-                for y in range(local_height):
-                    wy = y + cy
-                    set_voxel_id(voxels, x, y, z, wx, wy, wz, world_height)
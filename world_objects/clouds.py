@@ -8,6 +8,7 @@ class Clouds:
 
     def update(self):
         self.mesh.program['u_time'] = self.engine.time # Update uniform time in shader  
+        self.mesh.update() # Build the tiles the player got close to
 
     def render(self):
         self.mesh.render() # Render
\ No newline at end of file
@@ -0,0 +1,182 @@
+import json
+import mmap
+import os
+import zlib
+from settings import *
+
+# Region file layout:
+#   header  magic, format version, CHUNK_SIZE, WORLD_H, REGION_SIZE (5 uint32)
+#   index   one slot per chunk (REGION_SIZE * REGION_SIZE columns of WORLD_H chunks, same order as the chunk table)
+#   data    zlib compressed edits of the chunks (consult encode_edits), every chunk starts on a SECTOR_SIZE boundary and takes whole sectors
+# Only the voxels changed by the player are saved: the rest of a chunk is generated again from the seed when it is loaded
+# (the terrain generation is deterministic, consult hash_random), so the size of a save depends on the edits and not on the world.
+REGION_MAGIC = 0x47525856 # 'VXRG'
+REGION_VERSION = 2
+HEADER_DTYPE = np.dtype([('magic', '<u4'), ('version', '<u4'), ('chunk_size', '<u4'), ('world_h', '<u4'), ('region_size', '<u4')])
+SLOT_DTYPE = np.dtype([('sector', '<u4'), ('sectors', '<u4'), ('length', '<u4'), ('saved', '<u4')])
+REGION_SLOTS = REGION_SIZE * REGION_SIZE * WORLD_H
+SECTOR_SIZE = 512 # Small, most chunks only have a few edits
+DATA_START = -(-(HEADER_DTYPE.itemsize + REGION_SLOTS * SLOT_DTYPE.itemsize) // SECTOR_SIZE) # First data sector (after header and index)
+
+class RegionFile:
+    """
+    A region file: the chunks of REGION_SIZE x REGION_SIZE chunk columns.
+    The file is memory mapped, so opening it only reads the header and a chunk is only read when it is loaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            self.create()
+
+        self.file = open(path, 'r+b')
+        self.map = None
+        self.index = None # Slots of the chunks (a view of the mapped file, writing to it updates the file)
+        self.remap()
+
+        header = np.frombuffer(self.map, HEADER_DTYPE, count=1).copy()[0] # Copy, a view would keep the map from being closed
+        if header['magic'] != REGION_MAGIC or header['version'] != REGION_VERSION:
+            raise ValueError(f'{path} is not a region file (or it was saved by another version)')
+        if (header['chunk_size'], header['world_h'], header['region_size']) != (CHUNK_SIZE, WORLD_H, REGION_SIZE):
+            raise ValueError(f'{path} was saved with different CHUNK_SIZE, WORLD_H or REGION_SIZE settings')
+
+    def create(self):
+        """Write an empty region file (header and an index without saved chunks)."""
+        header = np.array([(REGION_MAGIC, REGION_VERSION, CHUNK_SIZE, WORLD_H, REGION_SIZE)], dtype=HEADER_DTYPE)
+        with open(self.path, 'wb') as file:
+            file.write(header.tobytes())
+            file.write(np.zeros(REGION_SLOTS, dtype=SLOT_DTYPE).tobytes())
+            file.truncate(DATA_START * SECTOR_SIZE)
+
+    def remap(self):
+        """Map the file again (needed after it grows)."""
+        self.index = None # The view has to be released before the map can be closed
+        if self.map:
+            self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.index = np.frombuffer(self.map, SLOT_DTYPE, count=REGION_SLOTS, offset=HEADER_DTYPE.itemsize)
+
+    @staticmethod
+    def get_slot(x, y, z) -> int:
+        """Slot of the chunk at the given chunk coordinates (any chunk of the region, the coordinates wrap around)."""
+        return x % REGION_SIZE + REGION_SIZE * (z % REGION_SIZE) + REGION_SIZE * REGION_SIZE * y
+
+    def has_chunk(self, x, y, z) -> bool:
+        return bool(self.index[self.get_slot(x, y, z)]['saved'])
+
+    def read_chunk(self, x, y, z) -> bytes:
+        """Get the saved data of a chunk, None if the chunk was never saved."""
+        sector, _, length, saved = self.index[self.get_slot(x, y, z)]
+        if not saved:
+            return None
+        start = int(sector) * SECTOR_SIZE
+        return self.map[start:start + length]
+
+    def write_chunk(self, x, y, z, data):
+        """Save the data of a chunk, in place if it fits in its old sectors or else at the end of the file."""
+        slot = self.get_slot(x, y, z)
+        sectors = -(-len(data) // SECTOR_SIZE)
+
+        sector = int(self.index[slot]['sector'])
+        if sectors > self.index[slot]['sectors']: # Doesn't fit anymore: append it (the old sectors are left unused)
+            sector = max(len(self.map) // SECTOR_SIZE, DATA_START)
+            self.file.seek(sector * SECTOR_SIZE)
+            self.file.write(data)
+            self.file.truncate((sector + sectors) * SECTOR_SIZE)
+            self.file.flush()
+            self.remap()
+        else:
+            self.map[sector * SECTOR_SIZE:sector * SECTOR_SIZE + len(data)] = data
+            sectors = self.index[slot]['sectors'] # Keep all the sectors of the slot for later saves
+
+        self.index[slot] = sector, sectors, len(data), 1
+
+    def close(self):
+        self.map.flush()
+        self.index = None
+        self.map.close()
+        self.file.close()
+
+def encode_edits(edits) -> bytes:
+    """
+    Compress the edits of a chunk (voxel index -> voxel id, consult Chunk.edits): the gaps between the sorted voxel indices
+    (uint32, small numbers for edits close to each other) followed by the voxel ids (uint8).
+    """
+    if not edits:
+        return b''
+    voxel_indices = np.array(sorted(edits), dtype='<u4')
+    voxel_ids = np.array([edits[voxel_index] for voxel_index in voxel_indices.tolist()], dtype='uint8')
+    gaps = np.diff(voxel_indices, prepend=np.uint32(0))
+    return zlib.compress(gaps.tobytes() + voxel_ids.tobytes(), level=1)
+
+def decode_edits(data) -> dict:
+    """Edits of a chunk (voxel index -> voxel id) saved by encode_edits."""
+    if not data:
+        return {}
+    data = zlib.decompress(data)
+    count = len(data) // 5
+    voxel_indices = np.cumsum(np.frombuffer(data, dtype='<u4', count=count))
+    voxel_ids = np.frombuffer(data, dtype='uint8', offset=4 * count)
+    return dict(zip(voxel_indices.tolist(), voxel_ids.tolist()))
+
+class WorldSave:
+    """
+    A saved world: world.json (seed and settings needed to generate the world) and the region files with the edits of the chunks.
+    Region files are opened the first time one of their chunks is needed.
+    """
+
+    def __init__(self, path=SAVE_DIR):
+        self.path = path
+        self.regions = {} # (region x, region z) -> RegionFile
+        os.makedirs(os.path.join(path, 'regions'), exist_ok=True)
+        self.check_version()
+
+    def check_version(self):
+        """
+        Stop with a clear error if the save has region files of another format version (e.g. version 1, that stored whole
+        chunks instead of their edits): they can't be read, and writing the edits of the chunks into them would fail on exit.
+        """
+        folder = os.path.join(self.path, 'regions')
+        for name in sorted(os.listdir(folder)):
+            if not name.endswith('.region'):
+                continue
+            with open(os.path.join(folder, name), 'rb') as file:
+                header = np.frombuffer(file.read(HEADER_DTYPE.itemsize), HEADER_DTYPE, count=1)[0]
+            if header['magic'] == REGION_MAGIC and header['version'] != REGION_VERSION:
+                raise ValueError(f'{self.path} was saved with region format version {header["version"]}, this version of the game '
+                                 f'reads version {REGION_VERSION} (only the edits of the chunks). Delete or move the folder {self.path} '
+                                 f'to start a new world.')
+
+    def get_region(self, x, z) -> RegionFile:
+        """Get the region file that holds the chunk column (x, z), creating it if needed."""
+        key = x // REGION_SIZE, z // REGION_SIZE
+        if key not in self.regions:
+            self.regions[key] = RegionFile(os.path.join(self.path, 'regions', f'r.{key[0]}.{key[1]}.region'))
+        return self.regions[key]
+
+    def has_region(self, x, z) -> bool:
+        """Check if the region file of the chunk column (x, z) exists (without creating it)."""
+        key = x // REGION_SIZE, z // REGION_SIZE
+        return key in self.regions or os.path.exists(os.path.join(self.path, 'regions', f'r.{key[0]}.{key[1]}.region'))
+
+    def load_edits(self, position) -> dict:
+        """Read the saved edits of the chunk at the given position (voxel index -> voxel id), None if the chunk was never saved."""
+        x, y, z = position
+        if not self.has_region(x, z):
+            return None
+        data = self.get_region(x, z).read_chunk(x, y, z)
+        return None if data is None else decode_edits(data)
+
+    def save_edits(self, position, edits):
+        """Save the edits of the chunk at the given position (all of them, they replace the saved ones)."""
+        x, y, z = position
+        self.get_region(x, z).write_chunk(x, y, z, encode_edits(edits))
+
+    def save_meta(self):
+        with open(os.path.join(self.path, 'world.json'), 'w') as file:
+            json.dump({'seed': SEED, 'chunk_size': CHUNK_SIZE, 'world_h': WORLD_H, 'region_size': REGION_SIZE}, file)
+
+    def close(self):
+        for region in self.regions.values():
+            region.close()
+        self.regions.clear()